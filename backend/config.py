@@ -0,0 +1,127 @@
+"""
+Novel-Copilot 运行配置
+基于 pydantic-settings，支持环境变量与 .env 文件覆盖
+"""
+
+from functools import lru_cache
+from typing import Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """后端全局配置"""
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
+
+    # ============ 数据库 ============
+    # 引擎配置档: production(WAL + 调优 pragma) / default(SQLite 默认行为)
+    db_profile: str = "production"
+    db_echo: bool = False
+    # 以下参数仅在 production 配置档中生效
+    db_journal_mode: str = "WAL"
+    db_synchronous: str = "NORMAL"
+    db_mmap_size: int = 256 * 1024 * 1024  # 256MB
+    db_cache_size: int = -64000  # 负数表示 KiB，约 64MB
+    db_temp_store: str = "MEMORY"
+    db_busy_timeout: int = 5000  # 毫秒
+    db_foreign_keys: bool = True
+
+    # ============ 导入 ============
+    import_max_bytes: int = 512 * 1024 * 1024  # 上传文件大小上限
+    import_max_record_bytes: int = 32 * 1024 * 1024  # 单条记录（如一个章节）大小上限
+    import_batch_size: int = 200  # 批量插入的行数
+
+    # ============ AI 客户端池 ============
+    ai_client_max_clients: int = 16  # 最多缓存的 (api_base, api_key) 组合
+    ai_client_idle_timeout: float = 600.0  # 空闲多少秒后移出客户端池
+    ai_client_retire_grace: float = 900.0  # 移出后等待进行中请求结束再关闭的秒数
+    ai_max_connections: int = 20
+    ai_max_keepalive_connections: int = 10
+    ai_keepalive_expiry: float = 60.0  # 空闲 keep-alive 连接保留秒数
+    ai_connect_timeout: float = 10.0
+    ai_request_timeout: float = 600.0
+
+    # ============ AI 响应缓存 ============
+    # 摘要、改写、数据提取的非流式响应缓存：进程内 LRU + SQLite 表
+    ai_cache_enabled: bool = True
+    ai_cache_memory_entries: int = 512
+    ai_cache_max_rows: int = 5000  # SQLite 表最多保留的条目数（按最近访问淘汰）
+    ai_cache_ttl: int = 30 * 24 * 3600  # 条目有效期（秒）
+
+    # ============ 批量摘要 ============
+    ai_batch_concurrency: int = 4  # 同时进行的摘要请求数（可在请求中覆盖）
+    ai_batch_commit_size: int = 10  # 每生成多少个摘要提交一次
+    ai_batch_max_retries: int = 2  # 单个章节失败后的重试次数
+    ai_batch_retry_delay: float = 1.0  # 首次重试等待秒数，之后按 2 倍递增
+
+    # ============ 数据提取 ============
+    # 长内容按段落分块并发提取后合并（均可在请求中覆盖）
+    ai_extract_chunk_chars: int = 6000  # 每块最多字符数
+    ai_extract_overlap_chars: int = 300  # 相邻块重叠的字符数（不超过块大小的 1/4）
+    ai_extract_concurrency: int = 4  # 同时进行的提取请求数
+
+    # ============ 流式输出 ============
+    # 续写 SSE 合并增量文本的默认参数（可在请求中覆盖），窗口为 0 表示逐 token 输出
+    sse_coalesce_ms: int = 40
+    sse_coalesce_bytes: int = 1024
+    # 续写系统提示缓存的最大条目数（按项目 + 章节）
+    context_cache_size: int = 256
+    # 续写前文摘要的 token 预算（可在请求中覆盖），其中最多 context_fine_share 用于最近章节的章节摘要
+    context_summary_tokens: int = 1500
+    context_fine_share: float = 0.6
+    # 摘要树每个阶段包含的章节数
+    summary_arc_size: int = 10
+
+    # ============ 续写 token 预算 ============
+    token_counter: str = "estimate"  # estimate / tiktoken（需另行安装 tiktoken）
+    tiktoken_encoding: str = "cl100k_base"
+    # 模型上下文窗口，按模型名前缀匹配（取最长匹配），未匹配时使用默认值
+    model_context_windows: dict[str, int] = {
+        "gpt-4o": 128000,
+        "gpt-4.1": 1000000,
+        "gpt-4-turbo": 128000,
+        "gpt-4": 8192,
+        "gpt-3.5-turbo": 16385,
+        "deepseek": 64000,
+        "qwen": 32768,
+        "glm-4": 128000,
+        "llama3": 8192,
+        "mistral": 32768,
+    }
+    model_context_window_default: int = 8192
+    # 输入 token 上限（控制首 token 延迟），为 0 时只受模型窗口限制
+    context_max_input_tokens: int = 16000
+    context_reserve_tokens: int = 200  # 消息格式等额外开销
+    # 前文至少保留的 token 数；扣除输出长度与固定部分后不足时拒绝请求（max_tokens 过大）
+    context_min_tokens: int = 256
+
+    # ============ 片段检索 ============
+    retrieval_top_k: int = 4  # 续写时注入的相关片段数（可在请求中覆盖），0 表示关闭
+    retrieval_query_chars: int = 500  # 以前文结尾多少字符作为检索查询
+    retrieval_catchup_chapters: int = 20  # 每次续写最多补建索引的章节数（导入/恢复后的章节）
+    semantic_recall_k: int = 0  # 续写时额外注入的语义检索片段数，0 表示只用关键词检索
+
+    # ============ 向量检索 ============
+    # hashing: 离线特征哈希（无需模型服务）；openai: OpenAI 兼容的 /embeddings 接口
+    embedding_provider: str = "hashing"
+    embedding_dim: int = 256  # hashing 向量维度
+    embedding_model: str = "text-embedding-3-small"
+    embedding_api_base: Optional[str] = None  # 为空时与续写使用相同的默认服务
+    embedding_api_key: Optional[str] = None
+    embedding_batch_size: int = 64  # 每次 /embeddings 请求的文本数
+
+    # ============ 日志 ============
+    log_level: str = "INFO"
+    # 按模块覆盖级别，如 LOG_LEVELS='{"services.ai_service": "DEBUG"}'
+    log_levels: dict[str, str] = {}
+    log_format: str = "text"  # text / json
+    log_file: Optional[str] = None
+    log_max_field_chars: int = 500  # 结构化字段的最大输出长度
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """获取全局配置（进程内单例）"""
+    return Settings()
+
+
+settings = get_settings()
@@ -3,21 +3,72 @@ Novel-Copilot 数据库连接配置
 使用 SQLAlchemy 异步驱动 + aiosqlite
 """
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from pathlib import Path
 
+from config import settings
+
 # 数据库文件路径
 DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 DATABASE_URL = f"sqlite+aiosqlite:///{DATA_DIR}/novel.db"
 
+# 引擎配置档 -> 每个连接建立时执行的 PRAGMA
+ENGINE_PROFILES = {
+    # SQLite 默认行为（回滚日志、无 busy timeout）
+    "default": {},
+    # WAL 允许读写并发，busy_timeout 避免自动保存与 AI 提取提交冲突时直接报 "database is locked"
+    "production": {
+        "journal_mode": settings.db_journal_mode,
+        "synchronous": settings.db_synchronous,
+        "mmap_size": settings.db_mmap_size,
+        "cache_size": settings.db_cache_size,
+        "temp_store": settings.db_temp_store,
+        "busy_timeout": settings.db_busy_timeout,
+        "foreign_keys": "ON" if settings.db_foreign_keys else "OFF",
+    },
+}
+
+
+def get_engine_pragmas(profile: str) -> dict:
+    """获取指定配置档的 PRAGMA 设置"""
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown database profile: {profile} (available: {', '.join(ENGINE_PROFILES)})")
+    return ENGINE_PROFILES[profile]
+
+
+def create_engine_for_profile(url: str, profile: str):
+    """按配置档创建异步引擎，并在每个新连接上应用 PRAGMA"""
+    pragmas = get_engine_pragmas(profile)
+    connect_args = {}
+    if "busy_timeout" in pragmas:
+        # sqlite3 驱动层的等待时间（秒），与 busy_timeout 保持一致
+        connect_args["timeout"] = pragmas["busy_timeout"] / 1000
+
+    async_engine = create_async_engine(
+        url,
+        echo=settings.db_echo,
+        future=True,
+        connect_args=connect_args,
+    )
+
+    if pragmas:
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+
+    return async_engine
+
+
 # 异步引擎
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,  # 生产环境设为 False
-    future=True,
-)
+engine = create_engine_for_profile(DATABASE_URL, settings.db_profile)
 
 # 异步会话工厂
 async_session = async_sessionmaker(
@@ -32,10 +83,23 @@ class Base(DeclarativeBase):
     pass
 
 
-async def init_db():
-    """初始化数据库表"""
+def _init_schema(conn) -> list[int]:
+    """建表并执行迁移（同步连接）"""
+    from migrations import LATEST_VERSION, is_empty_database, run_migrations, set_schema_version
+
+    fresh = is_empty_database(conn)
+    Base.metadata.create_all(conn)
+    if fresh:
+        # 全新数据库由 create_all 直接建出最新结构，无需逐个迁移
+        set_schema_version(conn, LATEST_VERSION)
+        return []
+    return run_migrations(conn)
+
+
+async def init_db() -> list[int]:
+    """初始化数据库表，并将已有数据库迁移到最新版本"""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        return await conn.run_sync(_init_schema)
 
 
 async def get_db():
@@ -0,0 +1,167 @@
+"""
+Novel-Copilot 日志配置
+- 调用方只把日志记录放入队列，格式化与输出在后台线程完成，不阻塞事件循环
+- 日志级别可按模块配置（LOG_LEVEL / LOG_LEVELS）
+- 每条日志附带当前请求 ID；结构化字段在输出时按长度截断
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+
+from config import settings
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_listener: logging.handlers.QueueListener | None = None
+_queue_handler: logging.Handler | None = None
+
+
+def log_fields(**fields) -> dict:
+    """
+    附加结构化字段: logger.info("msg", extra=log_fields(project_id=1, data=...))
+    字段值在后台线程中序列化并截断
+    """
+    return {"fields": fields}
+
+
+def truncate(value, limit: int | None = None) -> str:
+    """将任意值转为字符串并截断到 limit 个字符"""
+    limit = limit or settings.log_max_field_chars
+    if not isinstance(value, str):
+        try:
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            value = repr(value)
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...(+{len(value) - limit} chars)"
+
+
+class _RequestIdFilter(logging.Filter):
+    """在调用方线程记录请求 ID（contextvars 不会跨越到监听线程）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """text: 时间 级别 [模块] [请求ID] 消息 key=value；json: 每行一个 JSON 对象"""
+
+    def __init__(self, fmt_type: str = "text"):
+        super().__init__(datefmt="%Y-%m-%d %H:%M:%S")
+        self.fmt_type = fmt_type
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {k: truncate(v) for k, v in (getattr(record, "fields", None) or {}).items()}
+        request_id = getattr(record, "request_id", "-")
+        if self.fmt_type == "json":
+            payload = {
+                "ts": self.formatTime(record, self.datefmt),
+                "level": record.levelname,
+                "logger": record.name,
+                "request_id": request_id,
+                "message": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                payload["exc_info"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False)
+
+        line = f"{self.formatTime(record, self.datefmt)} {record.levelname:<7} [{record.name}] [{request_id}] {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """只在调用方合并 msg/args，结构化字段留给监听线程格式化"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # 异常对象不跨线程传递，这里先格式化为文本
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.msg = f"{record.msg}\n{record.exc_text}"
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+
+def setup_logging() -> None:
+    """初始化日志（可重复调用）"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = StructuredFormatter(settings.log_format)
+    handlers: list[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+    if settings.log_file:
+        handlers.append(logging.FileHandler(settings.log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _queue_handler = _QueueHandler(log_queue)
+    _queue_handler.addFilter(_RequestIdFilter())
+
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.log_level.upper())
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """停止后台线程并输出队列中剩余的日志"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
+
+
+class RequestIdMiddleware:
+    """
+    ASGI 中间件：为每个请求设置请求 ID（沿用 X-Request-ID 请求头或随机生成），
+    并写回响应头；流式响应的生成过程同样能取到该 ID
+    """
+
+    header = b"x-request-id"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = next(
+            (v.decode("latin-1")[:64] for k, v in scope.get("headers", []) if k == self.header),
+            None,
+        ) or uuid.uuid4().hex[:12]
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (self.header, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
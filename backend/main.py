@@ -3,13 +3,16 @@ Novel-Copilot 后端入口
 FastAPI 应用主文件
 """
 
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
+from logging_config import setup_logging, shutdown_logging, RequestIdMiddleware
 from database import init_db
+from services.client_pool import client_registry
 from routers import (
     projects_router,
     characters_router,
@@ -21,16 +24,24 @@ from routers import (
     snapshots_router,
 )
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
+    setup_logging()
     # 启动时初始化数据库
-    await init_db()
-    print("[INFO] Database initialized")
+    applied = await init_db()
+    if applied:
+        logger.info("Database migrated to version %s", applied[-1])
+    logger.info("Database initialized")
     yield
     # 关闭时清理资源
-    print("[INFO] Shutting down...")
+    logger.info("Shutting down...")
+    await client_registry.aclose()
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -47,8 +58,12 @@ app.add_middleware(
     allow_credentials=False,  # 通配符 * 与 credentials=True 不兼容
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Context-Budget"],
 )
 
+# 请求 ID（写入日志与响应头 X-Request-ID）
+app.add_middleware(RequestIdMiddleware)
+
 # 注册路由
 app.include_router(projects_router)
 app.include_router(characters_router)
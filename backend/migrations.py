@@ -0,0 +1,157 @@
+"""
+Novel-Copilot 数据库迁移
+基于 SQLite PRAGMA user_version 的版本化迁移，用于升级已有的 novel.db
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Union
+
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Connection
+
+# 迁移步骤：SQL 语句，或接收同步 Connection 的函数（用于需要 Python 处理数据的迁移）
+MigrationStep = Union[str, Callable[[Connection], None]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    """单个版本迁移"""
+    version: int
+    description: str
+    steps: tuple[MigrationStep, ...]
+
+
+def _backfill_chapter_content_hash(conn: Connection) -> None:
+    """为已有章节计算内容哈希"""
+    from services.text_service import content_hash
+
+    rows = conn.execute(text("SELECT id, content FROM chapters")).all()
+    if rows:
+        conn.execute(
+            text("UPDATE chapters SET content_hash = :hash WHERE id = :id"),
+            [{"id": row.id, "hash": content_hash(row.content)} for row in rows],
+        )
+
+
+def add_column_if_missing(table: str, column: str, ddl: str) -> Callable[[Connection], None]:
+    """生成"列不存在时才添加"的迁移步骤（新表可能已由 create_all 建出完整结构）"""
+    def step(conn: Connection) -> None:
+        columns = {col["name"] for col in inspect(conn).get_columns(table)}
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+
+def _compress_snapshot_payloads(conn: Connection) -> None:
+    """将旧快照的未压缩 JSON 数据与未压缩内容块转为压缩存储"""
+    from services.snapshot_service import compress_payload
+
+    rows = conn.execute(text("SELECT id, data FROM snapshots WHERE payload IS NULL")).all()
+    for row in rows:
+        raw = (row.data or "{}").encode("utf-8")
+        payload = compress_payload(raw)
+        conn.execute(
+            text(
+                "UPDATE snapshots SET payload = :payload, data = '{}', "
+                "raw_size = :raw_size, stored_size = :stored_size WHERE id = :id"
+            ),
+            {"id": row.id, "payload": payload, "raw_size": len(raw), "stored_size": len(payload)},
+        )
+
+    blobs = conn.execute(text("SELECT hash, data FROM snapshot_blobs WHERE typeof(data) = 'text'")).all()
+    for blob in blobs:
+        raw = blob.data.encode("utf-8")
+        stored = compress_payload(raw)
+        conn.execute(
+            text("UPDATE snapshot_blobs SET data = :data, size = :size, stored_size = :stored_size WHERE hash = :hash"),
+            {"hash": blob.hash, "data": stored, "size": len(raw), "stored_size": len(stored)},
+        )
+
+
+# 迁移列表（版本号必须递增，已发布的迁移不可修改，只能追加）
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        description="为外键列和排序列添加索引",
+        steps=(
+            "CREATE INDEX IF NOT EXISTS ix_chapters_project_rank ON chapters (project_id, rank)",
+            "CREATE INDEX IF NOT EXISTS ix_characters_project_id ON characters (project_id)",
+            "CREATE INDEX IF NOT EXISTS ix_relationships_project_id ON relationships (project_id)",
+            "CREATE INDEX IF NOT EXISTS ix_relationships_source_id ON relationships (source_id)",
+            "CREATE INDEX IF NOT EXISTS ix_relationships_target_id ON relationships (target_id)",
+            "CREATE INDEX IF NOT EXISTS ix_data_tables_project_type ON data_tables (project_id, table_type)",
+            "CREATE INDEX IF NOT EXISTS ix_snapshots_project_created ON snapshots (project_id, created_at)",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="章节内容哈希",
+        steps=(
+            add_column_if_missing("chapters", "content_hash", "VARCHAR(64)"),
+            _backfill_chapter_content_hash,
+        ),
+    ),
+    Migration(
+        version=3,
+        description="快照数据压缩存储",
+        steps=(
+            add_column_if_missing("snapshots", "payload", "BLOB"),
+            add_column_if_missing("snapshots", "raw_size", "INTEGER NOT NULL DEFAULT 0"),
+            add_column_if_missing("snapshots", "stored_size", "INTEGER NOT NULL DEFAULT 0"),
+            add_column_if_missing("snapshot_blobs", "stored_size", "INTEGER NOT NULL DEFAULT 0"),
+            _compress_snapshot_payloads,
+        ),
+    ),
+    Migration(
+        version=4,
+        description="章节摘要/数据提取对应的正文哈希",
+        steps=(
+            add_column_if_missing("chapters", "summary_hash", "VARCHAR(64)"),
+            add_column_if_missing("chapters", "extracted_hash", "VARCHAR(64)"),
+        ),
+    ),
+    Migration(
+        version=5,
+        description="摘要树阶段记录所含章节",
+        steps=(
+            add_column_if_missing("summary_nodes", "chapter_ids", "JSON"),
+        ),
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def get_schema_version(conn: Connection) -> int:
+    """读取数据库当前的迁移版本"""
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def set_schema_version(conn: Connection, version: int) -> None:
+    """写入迁移版本（PRAGMA 不支持参数绑定）"""
+    conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+
+def is_empty_database(conn: Connection) -> bool:
+    """数据库中是否还没有任何表（全新数据库）"""
+    return not inspect(conn).get_table_names()
+
+
+def run_migrations(conn: Connection) -> list[int]:
+    """
+    依次执行尚未应用的迁移
+    返回: 本次应用的版本号列表
+    """
+    current = get_schema_version(conn)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        for step in migration.steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(text(step))
+        set_schema_version(conn, migration.version)
+        applied.append(migration.version)
+    return applied
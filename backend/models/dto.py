@@ -4,7 +4,7 @@ Novel-Copilot Pydantic 数据传输对象 (DTO)
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -132,6 +132,9 @@ class ChapterResponse(BaseModel):
     summary: Optional[str]
     chapter_outline: Optional[str]
     characters_mentioned: Optional[list]
+    content_hash: Optional[str] = None
+    summary_hash: Optional[str] = None
+    extracted_hash: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -139,6 +142,78 @@ class ChapterResponse(BaseModel):
         from_attributes = True
 
 
+class TextOperation(BaseModel):
+    """单个文本操作（位置单位为 Unicode 字符）"""
+    op: Literal["insert", "delete"]
+    pos: int = Field(..., ge=0)
+    text: Optional[str] = None  # insert 时的插入内容
+    length: int = Field(0, ge=0)  # delete 时的删除长度
+
+
+class ChapterPatch(BaseModel):
+    """增量更新章节内容"""
+    base_hash: str  # 客户端持有的内容哈希
+    operations: list[TextOperation]
+
+
+class ChapterPatchResponse(BaseModel):
+    """增量更新结果（不返回正文）"""
+    id: int
+    content_hash: str
+    word_count: int
+    changed: bool
+    updated_at: datetime
+
+
+class ChapterWordCount(BaseModel):
+    id: int
+    title: str
+    word_count: int
+
+
+class ChapterStaleness(BaseModel):
+    """
+    章节派生数据状态
+    summary_status / extraction_status:
+        "missing" - 尚未生成
+        "outdated" - 正文已在生成后修改
+        "untracked" - 已有数据但来源版本未知（早于哈希记录）
+    """
+    id: int
+    title: str
+    rank: int
+    content_hash: Optional[str]
+    summary_status: Optional[Literal["missing", "outdated", "untracked"]] = None
+    extraction_status: Optional[Literal["missing", "outdated"]] = None
+
+
+class PassageHit(BaseModel):
+    """片段检索结果（BM25 得分）"""
+    passage_id: int
+    chapter_id: int
+    chapter_title: str
+    position: int
+    text: str
+    score: float
+
+
+class SemanticHit(BaseModel):
+    """语义检索结果（余弦相似度）；数据表条目没有章节信息"""
+    kind: Literal["passages", "facts"]
+    key: int  # 片段 ID 或条目文本哈希
+    text: str
+    score: float
+    chapter_id: Optional[int] = None
+    chapter_title: Optional[str] = None
+
+
+class ProjectWordCountResponse(BaseModel):
+    """项目字数统计"""
+    project_id: int
+    total: int
+    chapters: list[ChapterWordCount]
+
+
 class ChapterReorder(BaseModel):
     """批量更新章节排序"""
     chapter_ids: list[int]  # 按新顺序排列的章节 ID 列表
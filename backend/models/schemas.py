@@ -5,7 +5,7 @@ Novel-Copilot SQLAlchemy 数据模型
 
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Text, Integer, Float, ForeignKey, JSON, DateTime, func
+from sqlalchemy import String, Text, Integer, Float, ForeignKey, JSON, DateTime, Index, LargeBinary, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database import Base
@@ -36,6 +36,9 @@ class Project(Base):
 class Character(Base):
     """角色表"""
     __tablename__ = "characters"
+    __table_args__ = (
+        Index("ix_characters_project_id", "project_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -56,6 +59,11 @@ class Character(Base):
 class Relationship(Base):
     """角色关系表"""
     __tablename__ = "relationships"
+    __table_args__ = (
+        Index("ix_relationships_project_id", "project_id"),
+        Index("ix_relationships_source_id", "source_id"),
+        Index("ix_relationships_target_id", "target_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -75,6 +83,10 @@ class Relationship(Base):
 class Chapter(Base):
     """章节表"""
     __tablename__ = "chapters"
+    __table_args__ = (
+        # 章节列表按 rank 排序、续写时按 rank 查找前文
+        Index("ix_chapters_project_rank", "project_id", "rank"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -82,7 +94,13 @@ class Chapter(Base):
     content: Mapped[Optional[str]] = mapped_column(Text, nullable=True, default="")
     rank: Mapped[int] = mapped_column(Integer, default=0)
     word_count: Mapped[int] = mapped_column(Integer, default=0)
+    # 正文内容哈希 (SHA-256)，用于增量保存的版本校验
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # 生成/保存摘要时的正文哈希，与 content_hash 不一致说明摘要已过期
+    summary_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # 最近一次 AI 提取数据时的正文哈希
+    extracted_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     # 章节大纲
     chapter_outline: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     characters_mentioned: Mapped[Optional[list]] = mapped_column(JSON, nullable=True, default=list)
@@ -105,6 +123,9 @@ class DataTable(Base):
         5 = 物品表 (拥有人, 物品描述, 物品名, 重要原因)
     """
     __tablename__ = "data_tables"
+    __table_args__ = (
+        Index("ix_data_tables_project_type", "project_id", "table_type"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -122,12 +143,138 @@ class Snapshot(Base):
         "manual" - 用户手动创建的快照
     """
     __tablename__ = "snapshots"
+    __table_args__ = (
+        # 快照列表按创建时间倒序
+        Index("ix_snapshots_project_created", "project_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     snapshot_type: Mapped[str] = mapped_column(String(20), nullable=False, default="manual")
-    # 完整快照数据 (JSON): { project, chapters, characters, relationships, data_tables }
-    data: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # 压缩后的快照清单（首字节为压缩格式），仅在查看详情/恢复时加载
+    # 清单: { format, project, chapters, characters, relationships, data_tables }
+    # format=2 时章节正文、角色记录、数据表行以内容哈希引用 snapshot_blobs；旧快照为完整数据
+    payload: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True, deferred=True)
+    # 未压缩的逻辑大小（清单 + 引用的全部内容块）
+    raw_size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # 实际占用（压缩后的清单 + 本快照新写入的内容块）
+    stored_size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # 旧版未压缩数据列，迁移后为空对象，仅为兼容旧库的 NOT NULL 约束保留
+    legacy_data: Mapped[Optional[dict]] = mapped_column("data", JSON, nullable=True, default=dict, deferred=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class SnapshotBlob(Base):
+    """
+    快照内容块表 - 按内容哈希去重存储，多个快照共享同一内容块
+    """
+    __tablename__ = "snapshot_blobs"
+
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)  # SHA-256(原始内容)
+    # 压缩后的内容（首字节为压缩格式）
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # 原始字节数
+    stored_size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # 压缩后字节数
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class SnapshotBlobRef(Base):
+    """快照 -> 内容块引用表，用于删除快照时回收无引用的内容块"""
+    __tablename__ = "snapshot_blob_refs"
+    __table_args__ = (
+        Index("ix_snapshot_blob_refs_blob_hash", "blob_hash"),
+    )
+
+    snapshot_id: Mapped[int] = mapped_column(ForeignKey("snapshots.id", ondelete="CASCADE"), primary_key=True)
+    blob_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+
+
+class SummaryNode(Base):
+    """
+    摘要树节点 - 章节摘要按固定章节数汇总为阶段概要，阶段概要再汇总为全书概要
+    level:
+        "arc" - 阶段概要，position 为阶段序号（按章节顺序）；每个阶段记录所含章节，
+                新章节并入前一阶段直到满 summary_arc_size 章，插入/删除章节不影响其他阶段
+        "book" - 全书概要，position 固定为 0
+    """
+    __tablename__ = "summary_nodes"
+    __table_args__ = (
+        Index("ix_summary_nodes_project_level", "project_id", "level", "position", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    level: Mapped[str] = mapped_column(String(10), nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # 覆盖的章节排序范围（含两端）
+    start_rank: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    end_rank: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    chapter_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # 阶段包含的章节 ID（按排序，含尚无摘要的章节）；为空的旧数据按排序范围推断
+    chapter_ids: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)
+    # 子节点摘要的哈希，子节点不变时不重新生成
+    source_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    summary: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class SearchChapter(Base):
+    """检索索引状态表 - 记录每个章节已建立索引的正文哈希"""
+    __tablename__ = "search_chapters"
+    __table_args__ = (
+        Index("ix_search_chapters_project_id", "project_id"),
+    )
+
+    chapter_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    project_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
+
+class SearchPassage(Base):
+    """检索片段表 - 章节正文按段落切分的片段"""
+    __tablename__ = "search_passages"
+    __table_args__ = (
+        Index("ix_search_passages_chapter", "chapter_id", "position"),
+        Index("ix_search_passages_project_id", "project_id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    project_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    chapter_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)  # 在章节中的序号
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    text_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    length: Mapped[int] = mapped_column(Integer, nullable=False)  # 词项数（BM25 文档长度）
+
+
+class SearchPosting(Base):
+    """检索倒排表 - (项目, 词项) -> 片段及词频"""
+    __tablename__ = "search_postings"
+    __table_args__ = (
+        Index("ix_search_postings_passage_id", "passage_id"),
+        {"sqlite_with_rowid": False},
+    )
+
+    project_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    term: Mapped[str] = mapped_column(String(32), primary_key=True)
+    passage_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    tf: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class AIResponseCache(Base):
+    """AI 响应缓存表 - 摘要/改写/提取等非流式调用的模型原始输出"""
+    __tablename__ = "ai_response_cache"
+    __table_args__ = (
+        Index("ix_ai_response_cache_accessed", "accessed_at"),
+    )
+
+    # SHA-256(类型 + 模型 + 服务地址 + 模板版本 + 参数 + 消息内容)
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # summary / modify / extract
+    model: Mapped[str] = mapped_column(String(255), nullable=False)
+    response: Mapped[str] = mapped_column(Text, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    accessed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
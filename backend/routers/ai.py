@@ -3,18 +3,33 @@ AI 功能 API 路由
 SSE 流式续写、摘要生成
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
-from database import get_db
-from models.schemas import Project, Character, Relationship, Chapter
-from services.ai_service import generate_continuation, generate_summary, list_models
+from config import settings
+from database import async_session, get_db
+from logging_config import log_fields, truncate
+from models.schemas import Project, Character, Chapter, SummaryNode
+from services.ai_service import generate_continuation, generate_summary, list_models, iter_extractions
+from services.stream_service import coalesce_deltas
+from services.json_parser import parse_llm_json
+from services.context_service import get_continuation_sections, bump_context_version, context_cache
+from services.budget_service import BudgetError, plan_continuation
+from services.client_pool import client_registry
+from services.response_cache import response_cache
+from services.search_service import retrieve_related_passages
+from services.summary_service import summarize_chapters, rebuild_summary_tree
+from services.text_service import content_hash
 
 router = APIRouter(prefix="/api/ai", tags=["AI"])
+logger = logging.getLogger(__name__)
 
 
 class ContinueRequest(BaseModel):
@@ -27,6 +42,13 @@ class ContinueRequest(BaseModel):
     max_tokens: int = 1000
     api_base: Optional[str] = None
     api_key: Optional[str] = None
+    # SSE 合并参数，为空时使用配置默认值
+    coalesce_ms: Optional[int] = Field(None, ge=0, le=1000)
+    coalesce_bytes: Optional[int] = Field(None, ge=1, le=65536)
+    # 前文摘要 token 预算，为空时使用配置默认值
+    summary_tokens: Optional[int] = Field(None, ge=0, le=32000)
+    # 注入的相关片段数，为空时使用配置默认值，0 表示不检索
+    retrieval_k: Optional[int] = Field(None, ge=0, le=20)
 
 
 class SummarizeRequest(BaseModel):
@@ -35,6 +57,7 @@ class SummarizeRequest(BaseModel):
     model: str = "gpt-4o-mini"
     api_base: Optional[str] = None
     api_key: Optional[str] = None
+    bypass_cache: bool = False  # 跳过响应缓存，强制重新生成
 
 
 @router.post("/continue")
@@ -42,89 +65,42 @@ async def ai_continue(data: ContinueRequest, db: AsyncSession = Depends(get_db))
     """
     AI 续写 (SSE 流式返回)
     
-    返回 text/event-stream 格式
+    返回 text/event-stream 格式；X-Context-Budget 响应头给出各部分的 token 分配/需求
     """
-    # 获取项目信息
-    result = await db.execute(select(Project).where(Project.id == data.project_id))
-    project = result.scalar_one_or_none()
-    if not project:
+    # 系统提示各部分：项目、角色关系、前文摘要、章节大纲（按版本号缓存）
+    sections = await get_continuation_sections(db, data.project_id, data.chapter_id, data.summary_tokens)
+    if sections is None:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    # 获取角色关系（用于 RAG 上下文）
-    result = await db.execute(
-        select(Relationship, Character)
-        .join(Character, Relationship.source_id == Character.id)
-        .where(Relationship.project_id == data.project_id)
-    )
-    
-    relationships = []
-    for rel, source_char in result.all():
-        # 获取目标角色名
-        target_result = await db.execute(select(Character).where(Character.id == rel.target_id))
-        target_char = target_result.scalar_one_or_none()
-        if target_char:
-            relationships.append({
-                "source_name": source_char.name,
-                "target_name": target_char.name,
-                "relation_type": rel.relation_type,
-                "description": rel.description,
-            })
+    # 以前文结尾检索之前章节中的相关片段（BM25）
+    retrieval_k = settings.retrieval_top_k if data.retrieval_k is None else data.retrieval_k
+    passages = await retrieve_related_passages(data.project_id, data.chapter_id, data.context, retrieval_k)
     
-    # 获取前面章节的摘要（用于上下文连贯性）
-    previous_summaries = ""
-    if data.chapter_id:
-        # 获取当前章节信息
-        current_chapter_result = await db.execute(
-            select(Chapter).where(Chapter.id == data.chapter_id)
+    # 按模型预算分配并截断前文与各部分
+    try:
+        system_prompt, context, budget = plan_continuation(
+            sections, data.context, data.model, data.max_tokens, passages=passages
         )
-        current_chapter = current_chapter_result.scalar_one_or_none()
-        
-        if current_chapter:
-            # 获取排序在当前章节之前的章节（最多 3 章）
-            prev_chapters_result = await db.execute(
-                select(Chapter)
-                .where(Chapter.project_id == data.project_id)
-                .where(Chapter.rank < current_chapter.rank)
-                .order_by(Chapter.rank.desc())
-                .limit(3)
-            )
-            prev_chapters = prev_chapters_result.scalars().all()
-            
-            # 按顺序排列并提取摘要
-            prev_chapters = list(reversed(prev_chapters))
-            summaries = []
-            for ch in prev_chapters:
-                if ch.summary:
-                    summaries.append(f"【{ch.title}】{ch.summary}")
-            
-            if summaries:
-                previous_summaries = "\\n\\n".join(summaries)
+    except BudgetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if budget.trimmed:
+        logger.info("Continuation context trimmed", extra=log_fields(model=data.model, allocation=budget.header()))
     
-    # 获取当前章节大纲
-    chapter_outline = ""
-    if data.chapter_id:
-        ch_result = await db.execute(select(Chapter).where(Chapter.id == data.chapter_id))
-        ch = ch_result.scalar_one_or_none()
-        if ch and ch.chapter_outline:
-            chapter_outline = ch.chapter_outline
+    coalesce_ms = settings.sse_coalesce_ms if data.coalesce_ms is None else data.coalesce_ms
+    coalesce_bytes = data.coalesce_bytes or settings.sse_coalesce_bytes
     
     async def event_stream():
-        """SSE 事件流生成器"""
-        async for chunk in generate_continuation(
-            context=data.context,
-            world_view=project.world_view or "",
-            style=project.style or "",
-            relationships=relationships,
-            previous_summaries=previous_summaries,
-            outline=project.outline or "",
-            chapter_outline=chapter_outline,
-            perspective=project.perspective or "third",
+        """SSE 事件流生成器（按时间窗口/字节数合并增量文本）"""
+        deltas = generate_continuation(
+            context=context,
+            system_prompt=system_prompt,
             model=data.model,
             temperature=data.temperature,
             max_tokens=data.max_tokens,
             api_base=data.api_base,
             api_key=data.api_key,
-        ):
+        )
+        async for chunk in coalesce_deltas(deltas, coalesce_ms, coalesce_bytes):
             # SSE 格式: 将内容中的换行符编码为 \\n 避免破坏 SSE 协议
             encoded_chunk = chunk.replace("\n", "\\n")
             yield f"data: {encoded_chunk}\n\n"
@@ -136,6 +112,7 @@ async def ai_continue(data: ContinueRequest, db: AsyncSession = Depends(get_db))
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Context-Budget": budget.header(),
         }
     )
 
@@ -147,6 +124,27 @@ class ModifyRequest(BaseModel):
     model: str = "gpt-4o-mini"
     api_base: Optional[str] = None
     api_key: Optional[str] = None
+    bypass_cache: bool = False
+
+
+@router.get("/metrics")
+async def ai_metrics():
+    """AI 相关的进程内指标：续写上下文缓存命中率与组装耗时、响应缓存、客户端池"""
+    return {
+        "context_cache": context_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "client_pool": client_registry.stats(),
+    }
+
+
+@router.delete("/cache")
+async def purge_response_cache(
+    kind: Optional[str] = Query(None, pattern="^(summary|modify|extract|rollup)$"),
+):
+    """清空 AI 响应缓存（可按类型）"""
+    deleted = await response_cache.purge(kind)
+    logger.info("Response cache purged", extra=log_fields(kind=kind, deleted=deleted))
+    return {"deleted": deleted}
 
 
 @router.post("/modify")
@@ -161,6 +159,7 @@ async def ai_modify(data: ModifyRequest):
             model=data.model,
             api_base=data.api_base,
             api_key=data.api_key,
+            use_cache=not data.bypass_cache,
         )
         return {"success": True, "result": result}
     except Exception as e:
@@ -169,7 +168,10 @@ async def ai_modify(data: ModifyRequest):
 
 @router.post("/summarize")
 async def ai_summarize(data: SummarizeRequest, db: AsyncSession = Depends(get_db)):
-    """AI 生成章节摘要并保存"""
+    """
+    AI 生成章节摘要并保存
+    已有摘要且对应当前正文时直接返回（bypass_cache 时强制重新生成）
+    """
     result = await db.execute(select(Chapter).where(Chapter.id == data.chapter_id))
     chapter = result.scalar_one_or_none()
     if not chapter:
@@ -178,20 +180,123 @@ async def ai_summarize(data: SummarizeRequest, db: AsyncSession = Depends(get_db
     if not chapter.content:
         raise HTTPException(status_code=400, detail="Chapter has no content")
     
+    current_hash = chapter.content_hash or content_hash(chapter.content)
+    if chapter.summary and chapter.summary_hash == current_hash and not data.bypass_cache:
+        return {"summary": chapter.summary, "up_to_date": True}
+    
     # 生成摘要
     summary = await generate_summary(
         chapter.content, 
         model=data.model,
         api_base=data.api_base,
         api_key=data.api_key,
+        use_cache=not data.bypass_cache,
     )
     
     # 保存到数据库
     chapter.summary = summary
+    chapter.summary_hash = current_hash
+    bump_context_version(db, chapter.project_id)
     await db.flush()
     await db.refresh(chapter)
     
-    return {"summary": summary}
+    return {"summary": summary, "up_to_date": False}
+
+
+class BatchSummarizeRequest(BaseModel):
+    """批量摘要请求"""
+    project_id: int
+    chapter_ids: Optional[list[int]] = None  # 为空时处理摘要缺失或过期的章节
+    model: str = "gpt-4o-mini"
+    api_base: Optional[str] = None
+    api_key: Optional[str] = None
+    bypass_cache: bool = False  # 同时重新生成摘要已是最新的章节
+    concurrency: Optional[int] = Field(None, ge=1, le=16)
+
+
+@router.post("/summarize/batch")
+async def ai_summarize_batch(data: BatchSummarizeRequest, db: AsyncSession = Depends(get_db)):
+    """
+    批量生成章节摘要 (SSE 流式返回进度)
+    
+    每个事件为一行 JSON，见 summarize_chapters 的事件说明
+    """
+    project = await db.execute(select(Project.id).where(Project.id == data.project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    async def event_stream():
+        async for event in summarize_chapters(
+            data.project_id,
+            chapter_ids=data.chapter_ids,
+            model=data.model,
+            api_base=data.api_base,
+            api_key=data.api_key,
+            force=data.bypass_cache,
+            concurrency=data.concurrency,
+        ):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
+class SummaryTreeRequest(BaseModel):
+    """摘要树更新请求"""
+    project_id: int
+    model: str = "gpt-4o-mini"
+    api_base: Optional[str] = None
+    api_key: Optional[str] = None
+    bypass_cache: bool = False  # 重新生成所有节点
+
+
+@router.post("/summary-tree")
+async def ai_rebuild_summary_tree(data: SummaryTreeRequest, db: AsyncSession = Depends(get_db)):
+    """增量更新项目摘要树（只重新生成子节点发生变化的阶段概要/全书概要）"""
+    project = await db.execute(select(Project.id).where(Project.id == data.project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    return await rebuild_summary_tree(
+        data.project_id,
+        model=data.model,
+        api_base=data.api_base,
+        api_key=data.api_key,
+        force=data.bypass_cache,
+    )
+
+
+@router.get("/summary-tree/{project_id}")
+async def get_summary_tree(project_id: int, db: AsyncSession = Depends(get_db)):
+    """获取项目摘要树（全书概要与各阶段概要）"""
+    result = await db.execute(
+        select(SummaryNode)
+        .where(SummaryNode.project_id == project_id)
+        .order_by(SummaryNode.level, SummaryNode.position)
+    )
+    nodes = [
+        {
+            "level": node.level,
+            "position": node.position,
+            "start_rank": node.start_rank,
+            "end_rank": node.end_rank,
+            "chapter_count": node.chapter_count,
+            "summary": node.summary,
+            "updated_at": node.updated_at,
+        }
+        for node in result.scalars().all()
+    ]
+    return {
+        "book": next((n for n in nodes if n["level"] == "book"), None),
+        "arcs": [n for n in nodes if n["level"] == "arc"],
+    }
 
 
 class ModelsRequest(BaseModel):
@@ -277,40 +382,26 @@ class ExtractDataRequest(BaseModel):
     """提取数据请求"""
     project_id: int
     content: str  # 要分析的内容
+    chapter_id: Optional[int] = None  # 内容所属章节，用于记录/跳过已提取的版本
     model: str = "gpt-4o-mini"
     api_base: str = None
     api_key: str = None
+    bypass_cache: bool = False
+    # 分块大小与并发数，为空时使用配置默认值
+    chunk_chars: Optional[int] = Field(None, ge=500, le=100000)
+    concurrency: Optional[int] = Field(None, ge=1, le=16)
 
 
-@router.post("/extract-data")
-async def extract_data(data: ExtractDataRequest, db: AsyncSession = Depends(get_db)):
+async def _apply_extraction(db: AsyncSession, project_id: int, extracted: dict) -> dict:
     """
-    从内容中提取结构化数据并更新数据表
-    返回: 更新统计
+    把提取结果合并进项目数据表（第一列相同的行更新非空字段，否则追加）
+    返回: {表键: 条目数}
     """
-    from services.ai_service import extract_all_data
     from models.schemas import DataTable
     
-    print(f"[DEBUG] extract-data called for project {data.project_id}")
-    print(f"[DEBUG] Content length: {len(data.content)}")
-    print(f"[DEBUG] Model: {data.model}, API Base: {data.api_base}, API Key: {'***' if data.api_key else 'None'}")
-    
-    # 调用 AI 提取数据
-    try:
-        extracted = await extract_all_data(
-            content=data.content,
-            model=data.model,
-            api_base=data.api_base,
-            api_key=data.api_key,
-        )
-        print(f"[DEBUG] Extracted data: {extracted}")
-    except Exception as e:
-        print(f"[ERROR] extract_all_data failed: {e}")
-        return {"success": False, "error": str(e), "updates": {}, "total": 0}
-    
     # 获取或创建项目的数据表
     result = await db.execute(
-        select(DataTable).where(DataTable.project_id == data.project_id)
+        select(DataTable).where(DataTable.project_id == project_id)
     )
     tables = {t.table_type: t for t in result.scalars().all()}
     
@@ -318,7 +409,7 @@ async def extract_data(data: ExtractDataRequest, db: AsyncSession = Depends(get_
     for table_type in range(6):
         if table_type not in tables:
             new_table = DataTable(
-                project_id=data.project_id,
+                project_id=project_id,
                 table_type=table_type,
                 rows=[]
             )
@@ -372,11 +463,11 @@ async def extract_data(data: ExtractDataRequest, db: AsyncSession = Depends(get_
                     for col_idx, col_value in row.items():
                         if col_value:  # 只更新非空值
                             new_rows[existing_row_idx][col_idx] = col_value
-                    print(f"[DEBUG] Updated existing row in table {table_type}: {first_col_value}")
+                    logger.debug("Updated existing row in table %s: %s", table_type, first_col_value)
                 else:
                     # 添加新行
                     new_rows.append(row)
-                    print(f"[DEBUG] Added new row to table {table_type}: {row}")
+                    logger.debug("Added new row to table %s", table_type, extra=log_fields(row=row))
                     
             # 重新赋值而不是就地修改，确保 SQLAlchemy 检测到变化
             table.rows = new_rows
@@ -388,16 +479,122 @@ async def extract_data(data: ExtractDataRequest, db: AsyncSession = Depends(get_
     for table in modified_tables:
         flag_modified(table, "rows")
     
+    return updates
+
+
+async def _check_extracted(db: AsyncSession, data: ExtractDataRequest) -> tuple[Optional[Chapter], str, bool]:
+    """返回 (内容所属章节, 内容哈希, 是否已提取过同一版本)"""
+    chapter = None
+    extracted_hash = content_hash(data.content)
+    if data.chapter_id is not None:
+        result = await db.execute(
+            select(Chapter)
+            .where(Chapter.id == data.chapter_id)
+            .where(Chapter.project_id == data.project_id)
+        )
+        chapter = result.scalar_one_or_none()
+        if not chapter:
+            raise HTTPException(status_code=404, detail="Chapter not found")
+        if chapter.extracted_hash == extracted_hash and not data.bypass_cache:
+            return chapter, extracted_hash, True
+    return chapter, extracted_hash, False
+
+
+def _extraction_options(data: ExtractDataRequest) -> dict:
+    return {
+        "model": data.model,
+        "api_base": data.api_base,
+        "api_key": data.api_key,
+        "use_cache": not data.bypass_cache,
+        "chunk_chars": data.chunk_chars,
+        "concurrency": data.concurrency,
+    }
+
+
+@router.post("/extract-data")
+async def extract_data(data: ExtractDataRequest, db: AsyncSession = Depends(get_db)):
+    """
+    从内容中提取结构化数据并更新数据表
+    长内容分块并发提取后合并；返回: 更新统计
+    """
+    logger.debug("extract-data called", extra=log_fields(
+        project_id=data.project_id,
+        content_chars=len(data.content),
+        model=data.model,
+        api_base=data.api_base,
+        api_key="***" if data.api_key else None,
+    ))
+    
+    # 同一章节的同一版本内容已提取过时跳过
+    chapter, extracted_hash, skipped = await _check_extracted(db, data)
+    if skipped:
+        return {"success": True, "skipped": True, "updates": {}, "total": 0}
+    
+    # 调用 AI 提取数据
+    done = None
+    async for event in iter_extractions(data.content, **_extraction_options(data)):
+        if event["type"] == "done":
+            done = event
+    extracted = done["data"]
+    logger.debug("Extracted data", extra=log_fields(data=extracted, failed=done["failed"]))
+    
+    updates = await _apply_extraction(db, data.project_id, extracted)
+    
+    # 有块提取失败时不记录已提取的版本，下次仍会重新提取
+    if chapter is not None and updates and not done["failed"]:
+        chapter.extracted_hash = extracted_hash
+    
     await db.commit()
-    print(f"[DEBUG] Commit successful, updates: {updates}")
+    logger.debug("Commit successful", extra=log_fields(updates=updates))
     
     return {
         "success": True,
         "updates": updates,
-        "total": sum(updates.values())
+        "total": sum(updates.values()),
+        "failed_chunks": done["failed"],
     }
 
 
+@router.post("/extract-data/stream")
+async def extract_data_stream(data: ExtractDataRequest, db: AsyncSession = Depends(get_db)):
+    """
+    分块提取结构化数据 (SSE 流式返回)
+    
+    每个事件为一行 JSON：start / chunk（各块完成时的部分结果）/ done（合并结果与更新统计），
+    全部块完成后写入数据表
+    """
+    chapter, extracted_hash, skipped = await _check_extracted(db, data)
+    chapter_id = chapter.id if chapter is not None else None
+    
+    async def event_stream():
+        if skipped:
+            yield f"data: {json.dumps({'type': 'done', 'skipped': True, 'updates': {}, 'total': 0})}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+        async for event in iter_extractions(data.content, **_extraction_options(data)):
+            if event["type"] == "done":
+                # 使用独立会话写入，不在流式响应期间占用请求会话
+                async with async_session() as session:
+                    updates = await _apply_extraction(session, data.project_id, event["data"])
+                    if chapter_id is not None and updates and not event["failed"]:
+                        await session.execute(
+                            update(Chapter).where(Chapter.id == chapter_id).values(extracted_hash=extracted_hash)
+                        )
+                    await session.commit()
+                event = {**event, "updates": updates, "total": sum(updates.values())}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
 class OrganizeCharactersRequest(BaseModel):
     """整理人物请求"""
     project_id: int
@@ -508,27 +705,10 @@ async def organize_characters(data: OrganizeCharactersRequest, db: AsyncSession
         )
         
         result_text = response.choices[0].message.content
-        import json
-        import re
-        
-        # 尝试解析 JSON，如果失败则尝试提取 JSON 部分
-        try:
-            result_data = json.loads(result_text)
-        except json.JSONDecodeError as e:
-            print(f"[WARN] organize_characters: Initial JSON parse failed: {e}")
-            # 尝试提取 JSON 对象
-            json_match = re.search(r'\{[\s\S]*\}', result_text)
-            if json_match:
-                try:
-                    result_data = json.loads(json_match.group())
-                except json.JSONDecodeError as e2:
-                    print(f"[ERROR] organize_characters: JSON extraction also failed: {e2}")
-                    print(f"[ERROR] Raw response: {result_text[:500]}...")
-                    raise HTTPException(status_code=500, detail=f"AI 返回的格式无法解析: {str(e2)}")
-            else:
-                print(f"[ERROR] organize_characters: No JSON found in response")
-                print(f"[ERROR] Raw response: {result_text[:500]}...")
-                raise HTTPException(status_code=500, detail="AI 返回的内容不包含有效 JSON")
+        result_data = parse_llm_json(result_text)
+        if not isinstance(result_data, dict):
+            logger.error("organize_characters: No JSON found in response", extra=log_fields(response=result_text))
+            raise HTTPException(status_code=500, detail="AI 返回的内容不包含有效 JSON")
         
         # 更新人物表
         characters = result_data.get("characters", [])
@@ -593,9 +773,7 @@ async def organize_characters(data: OrganizeCharactersRequest, db: AsyncSession
         }
         
     except Exception as e:
-        print(f"[ERROR] organize_characters: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("organize_characters failed: %s", e)
         return {
             "success": False,
             "message": f"整理失败: {str(e)}"
@@ -642,7 +820,7 @@ async def generate_avatar(data: GenerateAvatarRequest, db: AsyncSession = Depend
         if bio_desc:
             prompt += f", {bio_desc}"
     
-    print(f"[INFO] Generating avatar for {character.name} with prompt: {prompt[:100]}...")
+    logger.info("Generating avatar for %s", character.name, extra=log_fields(prompt=truncate(prompt, 100)))
     
     try:
         async with httpx.AsyncClient(timeout=120.0) as client:
@@ -663,7 +841,7 @@ async def generate_avatar(data: GenerateAvatarRequest, db: AsyncSession = Depend
             
             if response.status_code != 200:
                 error_detail = response.text
-                print(f"[ERROR] Image API error: {error_detail}")
+                logger.error("Image API error", extra=log_fields(status=response.status_code, detail=error_detail))
                 raise HTTPException(status_code=response.status_code, detail=f"Image API error: {error_detail}")
             
             result_data = response.json()
@@ -676,12 +854,12 @@ async def generate_avatar(data: GenerateAvatarRequest, db: AsyncSession = Depend
             else:
                 raise HTTPException(status_code=500, detail="No image returned from API")
             
-            print(f"[INFO] Original image URL: {image_url[:80]}...")
+            logger.debug("Original image URL", extra=log_fields(url=truncate(image_url, 80)))
             
             # 下载原图
             img_response = await client.get(image_url)
             if img_response.status_code != 200:
-                print(f"[ERROR] Failed to download image: {img_response.status_code}")
+                logger.error("Failed to download image: %s", img_response.status_code)
                 raise HTTPException(status_code=500, detail="Failed to download generated image")
             
             # 使用 Pillow 压缩为 540p 缩略图
@@ -707,14 +885,16 @@ async def generate_avatar(data: GenerateAvatarRequest, db: AsyncSession = Depend
                 thumbnail = thumbnail.convert('RGB')
             thumbnail.save(thumbnail_path, "JPEG", quality=85, optimize=True)
             
-            print(f"[INFO] Thumbnail saved to: {thumbnail_path}")
+            logger.debug("Thumbnail saved to: %s", thumbnail_path)
             
             # 更新角色：原图 URL + 缩略图路径
             character.avatar_url = image_url
             character.thumbnail_path = f"/thumbnails/{thumbnail_filename}"
             await db.commit()
             
-            print(f"[INFO] Avatar generated for {character.name}: original={image_url[:50]}..., thumbnail={character.thumbnail_path}")
+            logger.info("Avatar generated for %s", character.name, extra=log_fields(
+                original=truncate(image_url, 50), thumbnail=character.thumbnail_path,
+            ))
             
             return {
                 "success": True,
@@ -727,7 +907,5 @@ async def generate_avatar(data: GenerateAvatarRequest, db: AsyncSession = Depend
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Image generation timed out")
     except Exception as e:
-        print(f"[ERROR] generate_avatar: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("generate_avatar failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -2,25 +2,51 @@
 章节管理 API 路由
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+import asyncio
+from dataclasses import asdict
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_db
-from models.schemas import Chapter, Project
-from models.dto import ChapterCreate, ChapterUpdate, ChapterResponse, ChapterReorder
+from models.schemas import Chapter, DataTable, Project
+from models.dto import (
+    ChapterCreate, ChapterUpdate, ChapterResponse, ChapterReorder,
+    ChapterPatch, ChapterPatchResponse, ProjectWordCountResponse, ChapterStaleness, PassageHit,
+    SemanticHit,
+)
+from services.text_service import (
+    content_hash, apply_text_operations, TextOperationError, count_words, count_words_delta,
+)
+from services.context_service import bump_context_version
+from services.search_service import index_chapter, remove_chapter, ensure_project_index, search_passages, load_hits
+from services.embedding_service import get_embedder
+from services.vector_store import project_lock, sync_passages, sync_facts
+from services.data_table_service import format_facts
 
 router = APIRouter(prefix="/api", tags=["Chapters"])
 
+# 项目字数统计缓存: project_id -> ProjectWordCountResponse，章节写操作时失效
+_word_count_cache: dict[int, ProjectWordCountResponse] = {}
+
+# 会进入续写系统提示的章节字段（只改正文不影响续写上下文缓存）
+_CONTEXT_FIELDS = {"title", "rank", "summary", "chapter_outline"}
+
+# 空正文的哈希（空白章节不需要摘要/提取）
+_EMPTY_HASH = content_hash("")
+
+
+def invalidate_word_count(project_id: int) -> None:
+    """使项目字数统计缓存失效"""
+    _word_count_cache.pop(project_id, None)
+
 
-def count_words(text: str) -> int:
-    """计算字数（中文字符 + 英文单词）"""
-    if not text:
-        return 0
-    # 简单统计：中文字符 + 空格分隔的英文单词
-    chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
-    english_words = len([w for w in text.split() if w.isascii() and w.isalpha()])
-    return chinese_chars + english_words
+def recount_words(chapter: Chapter, new_content: str) -> int:
+    """重新计算章节字数，已有字数可信时只统计改动的段落"""
+    if chapter.content and chapter.word_count:
+        return count_words_delta(chapter.content, new_content, chapter.word_count)
+    return count_words(new_content)
 
 
 @router.get("/projects/{project_id}/chapters", response_model=list[ChapterResponse])
@@ -37,6 +63,144 @@ async def list_chapters(project_id: int, db: AsyncSession = Depends(get_db)):
     return result.scalars().all()
 
 
+@router.get("/projects/{project_id}/word-count", response_model=ProjectWordCountResponse)
+async def get_project_word_count(project_id: int, db: AsyncSession = Depends(get_db)):
+    """获取项目总字数及各章节字数（带缓存）"""
+    cached = _word_count_cache.get(project_id)
+    if cached is not None:
+        return cached
+    
+    project = await db.execute(select(Project.id).where(Project.id == project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    result = await db.execute(
+        select(Chapter.id, Chapter.title, Chapter.word_count)
+        .where(Chapter.project_id == project_id)
+        .order_by(Chapter.rank)
+    )
+    chapters = [
+        {"id": row.id, "title": row.title, "word_count": row.word_count or 0}
+        for row in result.all()
+    ]
+    response = ProjectWordCountResponse(
+        project_id=project_id,
+        total=sum(ch["word_count"] for ch in chapters),
+        chapters=chapters,
+    )
+    _word_count_cache[project_id] = response
+    return response
+
+
+@router.get("/projects/{project_id}/chapters/stale", response_model=list[ChapterStaleness])
+async def list_stale_chapters(project_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    列出摘要或提取数据与当前正文不一致的章节（按 rank 排序，不读取正文）
+    空白章节不计入
+    """
+    project = await db.execute(select(Project.id).where(Project.id == project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    result = await db.execute(
+        select(
+            Chapter.id, Chapter.title, Chapter.rank, Chapter.content_hash,
+            Chapter.summary_hash, Chapter.extracted_hash,
+            func.coalesce(func.length(Chapter.summary), 0).label("summary_length"),
+        )
+        .where(Chapter.project_id == project_id)
+        .where(Chapter.content_hash != _EMPTY_HASH)
+        .order_by(Chapter.rank)
+    )
+    stale = []
+    for row in result.all():
+        if not row.summary_length:
+            summary_status = "missing"
+        elif row.summary_hash is None:
+            summary_status = "untracked"
+        elif row.summary_hash != row.content_hash:
+            summary_status = "outdated"
+        else:
+            summary_status = None
+        
+        if row.extracted_hash is None:
+            extraction_status = "missing"
+        elif row.extracted_hash != row.content_hash:
+            extraction_status = "outdated"
+        else:
+            extraction_status = None
+        
+        if summary_status or extraction_status:
+            stale.append(ChapterStaleness(
+                id=row.id,
+                title=row.title,
+                rank=row.rank,
+                content_hash=row.content_hash,
+                summary_status=summary_status,
+                extraction_status=extraction_status,
+            ))
+    return stale
+
+
+@router.get("/projects/{project_id}/search", response_model=list[PassageHit])
+async def search_project_passages(
+    project_id: int,
+    q: str = Query(..., min_length=1, max_length=2000),
+    k: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    """全文检索项目章节片段（BM25），检索前补建未索引章节的索引"""
+    project = await db.execute(select(Project.id).where(Project.id == project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    await ensure_project_index(db, project_id)
+    hits = await search_passages(db, project_id, q, k)
+    return [PassageHit(**asdict(hit)) for hit in hits]
+
+
+@router.get("/projects/{project_id}/semantic-search", response_model=list[SemanticHit])
+async def semantic_search(
+    project_id: int,
+    q: str = Query(..., min_length=1, max_length=2000),
+    k: int = Query(10, ge=1, le=50),
+    kind: str = Query("passages", pattern="^(passages|facts)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    语义检索章节片段或数据表条目（余弦相似度）
+    检索前增量同步向量：只向量化新增的片段/条目，删除已不存在的
+    """
+    project = await db.execute(select(Project.id).where(Project.id == project_id))
+    if not project.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    embedder = get_embedder()
+    async with project_lock(project_id):
+        if kind == "passages":
+            await ensure_project_index(db, project_id)
+            store = await sync_passages(db, project_id, embedder)
+            texts = None
+        else:
+            tables = (await db.execute(
+                select(DataTable).where(DataTable.project_id == project_id)
+            )).scalars().all()
+            store, texts = await sync_facts(project_id, embedder, format_facts(tables))
+        queries = await embedder.embed([q])
+        matches = (await asyncio.to_thread(store.search, queries, k))[0]
+    
+    if texts is not None:
+        return [SemanticHit(kind=kind, key=key, text=texts[key], score=score) for key, score in matches]
+    hits = await load_hits(db, dict(matches))
+    return [
+        SemanticHit(
+            kind=kind, key=hit.passage_id, text=hit.text, score=hit.score,
+            chapter_id=hit.chapter_id, chapter_title=hit.chapter_title,
+        )
+        for hit in hits
+    ]
+
+
 @router.post("/projects/{project_id}/chapters", response_model=ChapterResponse, status_code=status.HTTP_201_CREATED)
 async def create_chapter(project_id: int, data: ChapterCreate, db: AsyncSession = Depends(get_db)):
     """创建新章节"""
@@ -56,11 +220,15 @@ async def create_chapter(project_id: int, data: ChapterCreate, db: AsyncSession
         chapter_data["rank"] = max_rank + 1
     
     chapter_data["word_count"] = count_words(chapter_data.get("content", ""))
+    chapter_data["content_hash"] = content_hash(chapter_data.get("content"))
     
     chapter = Chapter(project_id=project_id, **chapter_data)
     db.add(chapter)
+    bump_context_version(db, project_id)
     await db.flush()
     await db.refresh(chapter)
+    await index_chapter(db, project_id, chapter.id, chapter.content, chapter.content_hash)
+    invalidate_word_count(project_id)
     return chapter
 
 
@@ -86,16 +254,105 @@ async def update_chapter(chapter_id: int, data: ChapterUpdate, db: AsyncSession
     
     # 如果更新了内容，重新计算字数
     if "content" in update_data:
-        update_data["word_count"] = count_words(update_data["content"])
+        update_data["word_count"] = recount_words(chapter, update_data["content"] or "")
+        update_data["content_hash"] = content_hash(update_data["content"])
+    
+    # 手动保存的摘要视为对应保存时的正文
+    if "summary" in update_data:
+        update_data["summary_hash"] = (
+            update_data.get("content_hash", chapter.content_hash) if update_data["summary"] else None
+        )
     
     for key, value in update_data.items():
         setattr(chapter, key, value)
+    if _CONTEXT_FIELDS & update_data.keys():
+        bump_context_version(db, chapter.project_id)
     
     await db.flush()
     await db.refresh(chapter)
+    if "content" in update_data:
+        await index_chapter(db, chapter.project_id, chapter.id, chapter.content, chapter.content_hash)
+    invalidate_word_count(chapter.project_id)
     return chapter
 
 
+@router.patch("/chapters/{chapter_id}", response_model=ChapterPatchResponse)
+async def patch_chapter(chapter_id: int, data: ChapterPatch, db: AsyncSession = Depends(get_db)):
+    """
+    增量更新章节内容（自动保存）
+    基于 base_hash 应用插入/删除操作；base_hash 过期时返回 409 和当前哈希，
+    结果与当前内容一致时不写库
+    """
+    result = await db.execute(select(Chapter).where(Chapter.id == chapter_id))
+    chapter = result.scalar_one_or_none()
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    
+    current_hash = chapter.content_hash or content_hash(chapter.content)
+    if data.base_hash != current_hash:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Chapter content has changed", "content_hash": current_hash},
+        )
+    
+    try:
+        new_content = apply_text_operations(
+            chapter.content or "",
+            [op.model_dump() for op in data.operations],
+        )
+    except TextOperationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    new_hash = content_hash(new_content)
+    if new_hash == current_hash:
+        return ChapterPatchResponse(
+            id=chapter.id,
+            content_hash=current_hash,
+            word_count=chapter.word_count,
+            changed=False,
+            updated_at=chapter.updated_at,
+        )
+    
+    # 以读取时的哈希为条件写入：并发的自动保存基于同一 base_hash 时只有一个能成功
+    if chapter.content_hash is None:
+        unchanged = Chapter.content_hash.is_(None)
+    else:
+        unchanged = Chapter.content_hash == chapter.content_hash
+    outcome = await db.execute(
+        update(Chapter)
+        .where(Chapter.id == chapter_id, unchanged)
+        .values(
+            content=new_content,
+            content_hash=new_hash,
+            word_count=recount_words(chapter, new_content),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if outcome.rowcount == 0:
+        latest = (await db.execute(
+            select(Chapter.content_hash, Chapter.content).where(Chapter.id == chapter_id)
+        )).one_or_none()
+        if latest is None:
+            raise HTTPException(status_code=404, detail="Chapter not found")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Chapter content has changed",
+                "content_hash": latest.content_hash or content_hash(latest.content),
+            },
+        )
+    await db.refresh(chapter)
+    await index_chapter(db, chapter.project_id, chapter.id, new_content, new_hash)
+    invalidate_word_count(chapter.project_id)
+    return ChapterPatchResponse(
+        id=chapter.id,
+        content_hash=new_hash,
+        word_count=chapter.word_count,
+        changed=True,
+        updated_at=chapter.updated_at,
+    )
+
+
 @router.delete("/chapters/{chapter_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_chapter(chapter_id: int, db: AsyncSession = Depends(get_db)):
     """删除章节"""
@@ -104,7 +361,10 @@ async def delete_chapter(chapter_id: int, db: AsyncSession = Depends(get_db)):
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
+    await remove_chapter(db, chapter.id)
     await db.delete(chapter)
+    invalidate_word_count(chapter.project_id)
+    bump_context_version(db, chapter.project_id)
 
 
 @router.put("/chapters/reorder", response_model=list[ChapterResponse])
@@ -119,4 +379,7 @@ async def reorder_chapters(data: ChapterReorder, db: AsyncSession = Depends(get_
             chapters.append(chapter)
     
     await db.flush()
+    for project_id in {ch.project_id for ch in chapters}:
+        invalidate_word_count(project_id)
+        bump_context_version(db, project_id)
     return chapters
@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from models.schemas import Character, Project
 from models.dto import CharacterCreate, CharacterUpdate, CharacterResponse
+from services.context_service import bump_context_version
 
 router = APIRouter(prefix="/api", tags=["Characters"])
 
@@ -37,6 +38,7 @@ async def create_character(project_id: int, data: CharacterCreate, db: AsyncSess
     
     character = Character(project_id=project_id, **data.model_dump())
     db.add(character)
+    bump_context_version(db, project_id)
     await db.flush()
     await db.refresh(character)
     return character
@@ -64,6 +66,7 @@ async def update_character(character_id: int, data: CharacterUpdate, db: AsyncSe
     for key, value in update_data.items():
         setattr(character, key, value)
     
+    bump_context_version(db, character.project_id)
     await db.flush()
     await db.refresh(character)
     return character
@@ -78,6 +81,7 @@ async def delete_character(character_id: int, db: AsyncSession = Depends(get_db)
         raise HTTPException(status_code=404, detail="Character not found")
     
     await db.delete(character)
+    bump_context_version(db, character.project_id)
 
 
 @router.post("/projects/{project_id}/characters/save-avatar")
@@ -2,28 +2,63 @@
 数据导入导出 API 路由
 """
 
-import json
+from typing import Optional
 from urllib.parse import quote
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_db
 from models.schemas import Project, Character, Relationship, Chapter, DataTable
+from models.dto import ChapterResponse
+from services.export_service import (
+    EXPORT_VERSION, project_record, character_record, relationship_record, chapter_record, data_table_record,
+    stream_project_json, stream_project_ndjson,
+)
+from services.import_service import import_project_file, ImportFormatError, ImportLimitError
+from services.archive_service import stream_project_archive, import_project_archive, restore_archive_chapter
+from routers.chapters import invalidate_word_count
+from services.context_service import bump_context_version
 
 router = APIRouter(prefix="/api", tags=["Import/Export"])
 
 
 @router.get("/export/{project_id}")
-async def export_project(project_id: int, db: AsyncSession = Depends(get_db)):
-    """导出项目为 JSON（包含所有相关数据）"""
+async def export_project(
+    project_id: int,
+    format: str = Query("json", pattern="^(json|ndjson|zip)$"),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    导出项目为 JSON（包含所有相关数据）
+    stream=true 或 format=ndjson 时流式输出，服务端内存占用与项目大小无关
+    format=zip 导出归档（每章一个文件，含角色缩略图）
+    """
     # 获取项目
     result = await db.execute(select(Project).where(Project.id == project_id))
     project = result.scalar_one_or_none()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # URL 编码文件名以支持中文等特殊字符
+    encoded_filename = quote(f"{project.title}.{format}")
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"}
+    
+    if format == "zip":
+        return StreamingResponse(
+            stream_project_archive(project_id), media_type="application/zip", headers=headers
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_project_ndjson(project_id), media_type="application/x-ndjson", headers=headers
+        )
+    if stream:
+        return StreamingResponse(
+            stream_project_json(project_id), media_type="application/json", headers=headers
+        )
+    
     # 获取角色
     result = await db.execute(select(Character).where(Character.project_id == project_id))
     characters = result.scalars().all()
@@ -42,152 +77,75 @@ async def export_project(project_id: int, db: AsyncSession = Depends(get_db)):
     
     # 组装导出数据
     export_data = {
-        "version": "1.0",
-        "project": {
-            "title": project.title,
-            "description": project.description,
-            "world_view": project.world_view,
-            "style": project.style,
-        },
-        "characters": [
-            {
-                "id": c.id,
-                "name": c.name,
-                "bio": c.bio,
-                "attributes": c.attributes,
-                "position_x": c.position_x,
-                "position_y": c.position_y,
-            }
-            for c in characters
-        ],
-        "relationships": [
-            {
-                "source_id": r.source_id,
-                "target_id": r.target_id,
-                "relation_type": r.relation_type,
-                "description": r.description,
-            }
-            for r in relationships
-        ],
-        "chapters": [
-            {
-                "title": ch.title,
-                "content": ch.content,
-                "rank": ch.rank,
-                "summary": ch.summary,
-                "characters_mentioned": ch.characters_mentioned,
-            }
-            for ch in chapters
-        ],
-        "data_tables": [
-            {
-                "table_type": dt.table_type,
-                "rows": dt.rows,
-            }
-            for dt in data_tables
-        ],
+        "version": EXPORT_VERSION,
+        "project": project_record(project),
+        "characters": [character_record(c) for c in characters],
+        "relationships": [relationship_record(r) for r in relationships],
+        "chapters": [chapter_record(ch) for ch in chapters],
+        "data_tables": [data_table_record(dt) for dt in data_tables],
     }
     
-    # URL 编码文件名以支持中文等特殊字符
-    encoded_filename = quote(f"{project.title}.json")
-    
-    return JSONResponse(
-        content=export_data,
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-        }
-    )
+    return JSONResponse(content=export_data, headers=headers)
 
 
 @router.post("/import")
 async def import_project(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
-    """从 JSON 导入项目（包含所有相关数据）"""
+    """
+    从导出文件导入项目（普通 JSON 或 NDJSON，自动识别）
+    增量解析、分批写入，返回各阶段的记录数与耗时
+    """
     try:
-        content = await file.read()
-        data = json.loads(content.decode("utf-8"))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid JSON file: {str(e)}")
-    
-    # 验证数据格式
-    if "project" not in data:
-        raise HTTPException(status_code=400, detail="Missing 'project' field")
-    
-    # 收集警告信息
-    warnings = []
-    project_data = data["project"]
-    
-    if not project_data.get("style"):
-        warnings.append("缺少写作风格(style)")
-    if not project_data.get("world_view"):
-        warnings.append("缺少世界观(world_view)")
-    
-    # 创建项目
-    project = Project(
-        title=project_data.get("title", "Imported Project"),
-        description=project_data.get("description"),
-        world_view=project_data.get("world_view"),
-        style=project_data.get("style"),
-    )
-    db.add(project)
-    await db.flush()
-    
-    # ID 映射表（用于关系导入）
-    char_id_map = {}
+        report = await import_project_file(db, file)
+    except ImportLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid import file: {str(e)}")
     
-    # 创建角色
-    for char_data in data.get("characters", []):
-        old_id = char_data.get("id")
-        character = Character(
-            project_id=project.id,
-            name=char_data.get("name", "Unknown"),
-            bio=char_data.get("bio"),
-            attributes=char_data.get("attributes", {}),
-            position_x=char_data.get("position_x", 0),
-            position_y=char_data.get("position_y", 0),
-        )
-        db.add(character)
-        await db.flush()
-        if old_id:
-            char_id_map[old_id] = character.id
-    
-    # 创建关系（使用新 ID）
-    for rel_data in data.get("relationships", []):
-        old_source = rel_data.get("source_id")
-        old_target = rel_data.get("target_id")
-        if old_source in char_id_map and old_target in char_id_map:
-            relationship = Relationship(
-                project_id=project.id,
-                source_id=char_id_map[old_source],
-                target_id=char_id_map[old_target],
-                relation_type=rel_data.get("relation_type", "unknown"),
-                description=rel_data.get("description"),
-            )
-            db.add(relationship)
+    return {"message": "Import successful", **report}
+
+
+@router.post("/import/archive")
+async def import_archive(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """从 zip 归档导入项目（含角色缩略图），成员按需解压"""
+    try:
+        report = await import_project_archive(db, file.file)
+    except ImportLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
     
-    # 创建章节
-    for chapter_data in data.get("chapters", []):
-        chapter = Chapter(
-            project_id=project.id,
-            title=chapter_data.get("title", "Untitled"),
-            content=chapter_data.get("content", ""),
-            rank=chapter_data.get("rank", 0),
-            summary=chapter_data.get("summary"),
-            characters_mentioned=chapter_data.get("characters_mentioned", []),
-        )
-        db.add(chapter)
+    return {"message": "Import successful", **report}
+
+
+@router.post("/projects/{project_id}/import/archive/chapter", response_model=ChapterResponse)
+async def restore_chapter_from_archive(
+    project_id: int,
+    index: int = Query(..., ge=1, description="归档清单中的章节序号（从 1 开始）"),
+    chapter_id: Optional[int] = Query(None, description="要覆盖的章节，为空时新建章节"),
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """从 zip 归档中只读取并恢复一章，不解压其他成员"""
+    result = await db.execute(select(Project.id).where(Project.id == project_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Project not found")
     
-    # 创建数据表
-    for dt_data in data.get("data_tables", []):
-        data_table = DataTable(
-            project_id=project.id,
-            table_type=dt_data.get("table_type", 0),
-            rows=dt_data.get("rows", []),
+    chapter = None
+    if chapter_id is not None:
+        result = await db.execute(
+            select(Chapter).where(Chapter.id == chapter_id, Chapter.project_id == project_id)
         )
-        db.add(data_table)
-    
-    await db.flush()
-    await db.refresh(project)
+        chapter = result.scalar_one_or_none()
+        if not chapter:
+            raise HTTPException(status_code=404, detail="Chapter not found")
     
-    return {"message": "Import successful", "project_id": project.id, "warnings": warnings}
-
-
+    try:
+        chapter = await restore_archive_chapter(db, file.file, project_id, index, chapter)
+    except ImportLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+    
+    invalidate_word_count(project_id)
+    bump_context_version(db, project_id)
+    return chapter
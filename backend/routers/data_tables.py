@@ -11,19 +11,10 @@ from typing import Optional
 
 from database import get_db
 from models.schemas import DataTable
+from services.data_table_service import TABLE_TYPES
 
 router = APIRouter(prefix="/api/data-tables", tags=["DataTables"])
 
-# 表格类型定义
-TABLE_TYPES = {
-    0: {"name": "时空表", "columns": ["日期", "时间", "地点", "此地角色"]},
-    1: {"name": "角色特征表", "columns": ["角色名", "身体特征", "性格", "职业", "爱好", "喜欢的事物", "住所", "其他重要信息"]},
-    2: {"name": "社交关系表", "columns": ["角色名", "对主角关系", "对主角态度", "对主角好感"]},
-    3: {"name": "任务表", "columns": ["角色", "任务", "地点", "持续时间"]},
-    4: {"name": "重要事件表", "columns": ["角色", "事件简述", "日期", "地点", "情绪"]},
-    5: {"name": "物品表", "columns": ["拥有人", "物品描述", "物品名", "重要原因"]},
-}
-
 
 class DataTableResponse(BaseModel):
     id: int
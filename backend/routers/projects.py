@@ -3,12 +3,16 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_db
-from models.schemas import Project
+from models.schemas import Project, SummaryNode
 from models.dto import ProjectCreate, ProjectUpdate, ProjectResponse
+from services.snapshot_service import delete_project_snapshots
+from services.context_service import bump_context_version
+from services.search_service import remove_project
+from services.vector_store import remove_project_vectors
 
 router = APIRouter(prefix="/api/projects", tags=["Projects"])
 
@@ -52,6 +56,7 @@ async def update_project(project_id: int, data: ProjectUpdate, db: AsyncSession
     for key, value in update_data.items():
         setattr(project, key, value)
     
+    bump_context_version(db, project_id)
     await db.flush()
     await db.refresh(project)
     return project
@@ -65,4 +70,11 @@ async def delete_project(project_id: int, db: AsyncSession = Depends(get_db)):
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    await delete_project_snapshots(db, project_id)
+    await db.execute(delete(SummaryNode).where(SummaryNode.project_id == project_id))
+    await remove_project(db, project_id)
     await db.delete(project)
+    bump_context_version(db, project_id)
+    await db.commit()
+    # 向量文件不在事务内，提交成功后再删除
+    remove_project_vectors(project_id)
@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from models.schemas import Relationship, Project, Character
 from models.dto import RelationshipCreate, RelationshipUpdate, RelationshipResponse
+from services.context_service import bump_context_version
 
 router = APIRouter(prefix="/api", tags=["Relationships"])
 
@@ -47,6 +48,7 @@ async def create_relationship(data: RelationshipCreate, db: AsyncSession = Depen
     
     relationship = Relationship(**data.model_dump())
     db.add(relationship)
+    bump_context_version(db, data.project_id)
     await db.flush()
     await db.refresh(relationship)
     return relationship
@@ -64,6 +66,7 @@ async def update_relationship(relationship_id: int, data: RelationshipUpdate, db
     for key, value in update_data.items():
         setattr(relationship, key, value)
     
+    bump_context_version(db, relationship.project_id)
     await db.flush()
     await db.refresh(relationship)
     return relationship
@@ -78,3 +81,4 @@ async def delete_relationship(relationship_id: int, db: AsyncSession = Depends(g
         raise HTTPException(status_code=404, detail="Relationship not found")
     
     await db.delete(relationship)
+    bump_context_version(db, relationship.project_id)
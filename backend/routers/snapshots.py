@@ -5,12 +5,20 @@
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select
 from pydantic import BaseModel
 
-from database import get_db
-from models.schemas import Snapshot, Project, Chapter, Character, Relationship, DataTable
+from database import get_db, async_session
+from models.schemas import Snapshot, Project
+from services.snapshot_service import (
+    create_snapshot_record, load_snapshot_data, delete_snapshot_record, get_project_storage,
+)
+from services.snapshot_diff import load_snapshot_source, load_current_source, stream_diff
+from services.snapshot_restore import restore_project_snapshot
+from routers.chapters import invalidate_word_count
+from services.context_service import bump_context_version
 
 router = APIRouter(prefix="/api/snapshots", tags=["snapshots"])
 
@@ -30,6 +38,8 @@ class SnapshotResponse(BaseModel):
     name: str
     description: Optional[str]
     snapshot_type: str
+    raw_size: int = 0
+    stored_size: int = 0
     created_at: datetime
 
     class Config:
@@ -41,112 +51,20 @@ class SnapshotDetailResponse(SnapshotResponse):
     data: dict
 
 
-async def capture_project_snapshot(db: AsyncSession, project_id: int) -> dict:
-    """
-    捕获项目的完整快照数据
-    """
-    # 获取项目
-    result = await db.execute(select(Project).where(Project.id == project_id))
-    project = result.scalar_one_or_none()
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    
-    # 获取章节
-    chapters_result = await db.execute(
-        select(Chapter).where(Chapter.project_id == project_id).order_by(Chapter.rank)
-    )
-    chapters = chapters_result.scalars().all()
-    
-    # 获取角色
-    characters_result = await db.execute(
-        select(Character).where(Character.project_id == project_id)
-    )
-    characters = characters_result.scalars().all()
-    
-    # 获取关系
-    relationships_result = await db.execute(
-        select(Relationship).where(Relationship.project_id == project_id)
-    )
-    relationships = relationships_result.scalars().all()
-    
-    # 获取数据表
-    data_tables_result = await db.execute(
-        select(DataTable).where(DataTable.project_id == project_id)
-    )
-    data_tables = data_tables_result.scalars().all()
-    
-    return {
-        "project": {
-            "title": project.title,
-            "description": project.description,
-            "world_view": project.world_view,
-            "style": project.style,
-            "outline": project.outline,
-            "perspective": project.perspective,
-        },
-        "chapters": [
-            {
-                "id": ch.id,
-                "title": ch.title,
-                "content": ch.content,
-                "rank": ch.rank,
-                "word_count": ch.word_count,
-                "summary": ch.summary,
-                "chapter_outline": ch.chapter_outline,
-                "characters_mentioned": ch.characters_mentioned,
-            }
-            for ch in chapters
-        ],
-        "characters": [
-            {
-                "id": c.id,
-                "name": c.name,
-                "bio": c.bio,
-                "attributes": c.attributes,
-                "position_x": c.position_x,
-                "position_y": c.position_y,
-            }
-            for c in characters
-        ],
-        "relationships": [
-            {
-                "id": r.id,
-                "source_id": r.source_id,
-                "target_id": r.target_id,
-                "relation_type": r.relation_type,
-                "description": r.description,
-            }
-            for r in relationships
-        ],
-        "data_tables": [
-            {
-                "id": dt.id,
-                "table_type": dt.table_type,
-                "rows": dt.rows,
-            }
-            for dt in data_tables
-        ],
-    }
-
-
 @router.post("/", response_model=SnapshotResponse)
 async def create_snapshot(data: CreateSnapshotRequest, db: AsyncSession = Depends(get_db)):
     """创建项目快照"""
-    # 捕获快照数据
-    snapshot_data = await capture_project_snapshot(db, data.project_id)
-    
     # 生成快照名称
     name = data.name or f"快照 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
     
-    # 创建快照
-    snapshot = Snapshot(
-        project_id=data.project_id,
+    # 捕获快照（只写入新增的内容块）
+    snapshot = await create_snapshot_record(
+        db,
+        data.project_id,
         name=name,
         description=data.description,
         snapshot_type=data.snapshot_type,
-        data=snapshot_data,
     )
-    db.add(snapshot)
     await db.commit()
     await db.refresh(snapshot)
     
@@ -155,7 +73,7 @@ async def create_snapshot(data: CreateSnapshotRequest, db: AsyncSession = Depend
 
 @router.get("/{project_id}", response_model=list[SnapshotResponse])
 async def list_snapshots(project_id: int, db: AsyncSession = Depends(get_db)):
-    """获取项目的快照列表"""
+    """获取项目的快照列表（不加载快照数据）"""
     result = await db.execute(
         select(Snapshot)
         .where(Snapshot.project_id == project_id)
@@ -165,6 +83,12 @@ async def list_snapshots(project_id: int, db: AsyncSession = Depends(get_db)):
     return snapshots
 
 
+@router.get("/{project_id}/storage")
+async def get_snapshot_storage(project_id: int, db: AsyncSession = Depends(get_db)):
+    """获取项目快照的存储占用统计"""
+    return await get_project_storage(db, project_id)
+
+
 @router.get("/{snapshot_id}/detail", response_model=SnapshotDetailResponse)
 async def get_snapshot_detail(snapshot_id: int, db: AsyncSession = Depends(get_db)):
     """获取快照详情（包含完整数据）"""
@@ -172,7 +96,59 @@ async def get_snapshot_detail(snapshot_id: int, db: AsyncSession = Depends(get_d
     snapshot = result.scalar_one_or_none()
     if not snapshot:
         raise HTTPException(status_code=404, detail="Snapshot not found")
-    return snapshot
+    
+    data = await load_snapshot_data(db, snapshot)
+    return SnapshotDetailResponse(
+        id=snapshot.id,
+        project_id=snapshot.project_id,
+        name=snapshot.name,
+        description=snapshot.description,
+        snapshot_type=snapshot.snapshot_type,
+        raw_size=snapshot.raw_size,
+        stored_size=snapshot.stored_size,
+        created_at=snapshot.created_at,
+        data=data,
+    )
+
+
+@router.get("/{snapshot_id}/diff/{other}")
+async def diff_snapshot(snapshot_id: int, other: str, db: AsyncSession = Depends(get_db)):
+    """
+    对比快照 (NDJSON 流式返回)
+    other: 另一个快照 ID，或 "current" 表示与当前项目对比
+    """
+    result = await db.execute(select(Snapshot.id, Snapshot.project_id).where(Snapshot.id == snapshot_id))
+    base = result.one_or_none()
+    if not base:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    compare_current = other == "current"
+    if compare_current:
+        project = await db.execute(select(Project.id).where(Project.id == base.project_id))
+        if not project.scalar_one_or_none():
+            raise HTTPException(status_code=404, detail="Project not found")
+    else:
+        if not other.isdigit():
+            raise HTTPException(status_code=400, detail="other must be a snapshot id or 'current'")
+        result = await db.execute(select(Snapshot.project_id).where(Snapshot.id == int(other)))
+        other_project_id = result.scalar_one_or_none()
+        if other_project_id is None:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+        if other_project_id != base.project_id:
+            raise HTTPException(status_code=400, detail="Snapshots belong to different projects")
+    
+    async def diff_stream():
+        """NDJSON 差异流（使用独立会话，响应期间按需读取正文）"""
+        async with async_session() as session:
+            old = await load_snapshot_source(session, snapshot_id, f"snapshot:{snapshot_id}")
+            if compare_current:
+                new = await load_current_source(session, base.project_id)
+            else:
+                new = await load_snapshot_source(session, int(other), f"snapshot:{other}")
+            async for line in stream_diff(session, old, new):
+                yield line
+    
+    return StreamingResponse(diff_stream(), media_type="application/x-ndjson")
 
 
 @router.post("/{snapshot_id}/restore")
@@ -185,7 +161,6 @@ async def restore_snapshot(snapshot_id: int, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=404, detail="Snapshot not found")
     
     project_id = snapshot.project_id
-    data = snapshot.data
     
     # 获取项目
     project_result = await db.execute(select(Project).where(Project.id == project_id))
@@ -193,77 +168,14 @@ async def restore_snapshot(snapshot_id: int, db: AsyncSession = Depends(get_db))
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    # 恢复项目基本信息
-    project_data = data.get("project", {})
-    project.title = project_data.get("title", project.title)
-    project.description = project_data.get("description")
-    project.world_view = project_data.get("world_view")
-    project.style = project_data.get("style")
-    project.outline = project_data.get("outline")
-    project.perspective = project_data.get("perspective")
-    
-    # 删除现有章节并恢复
-    await db.execute(delete(Chapter).where(Chapter.project_id == project_id))
-    for ch_data in data.get("chapters", []):
-        chapter = Chapter(
-            project_id=project_id,
-            title=ch_data.get("title", ""),
-            content=ch_data.get("content", ""),
-            rank=ch_data.get("rank", 0),
-            word_count=ch_data.get("word_count", 0),
-            summary=ch_data.get("summary"),
-            chapter_outline=ch_data.get("chapter_outline"),
-            characters_mentioned=ch_data.get("characters_mentioned", []),
-        )
-        db.add(chapter)
-    
-    # 删除现有角色并恢复
-    await db.execute(delete(Character).where(Character.project_id == project_id))
-    character_id_map = {}  # 旧ID -> 新对象，用于关系恢复
-    for c_data in data.get("characters", []):
-        character = Character(
-            project_id=project_id,
-            name=c_data.get("name", ""),
-            bio=c_data.get("bio"),
-            attributes=c_data.get("attributes", {}),
-            position_x=c_data.get("position_x", 0),
-            position_y=c_data.get("position_y", 0),
-        )
-        db.add(character)
-        await db.flush()  # 获取新ID
-        character_id_map[c_data.get("id")] = character.id
-    
-    # 删除现有关系并恢复
-    await db.execute(delete(Relationship).where(Relationship.project_id == project_id))
-    for r_data in data.get("relationships", []):
-        old_source_id = r_data.get("source_id")
-        old_target_id = r_data.get("target_id")
-        new_source_id = character_id_map.get(old_source_id)
-        new_target_id = character_id_map.get(old_target_id)
-        
-        if new_source_id and new_target_id:
-            relationship = Relationship(
-                project_id=project_id,
-                source_id=new_source_id,
-                target_id=new_target_id,
-                relation_type=r_data.get("relation_type", ""),
-                description=r_data.get("description"),
-            )
-            db.add(relationship)
-    
-    # 删除现有数据表并恢复
-    await db.execute(delete(DataTable).where(DataTable.project_id == project_id))
-    for dt_data in data.get("data_tables", []):
-        data_table = DataTable(
-            project_id=project_id,
-            table_type=dt_data.get("table_type", 0),
-            rows=dt_data.get("rows", []),
-        )
-        db.add(data_table)
+    # 只重写与快照不一致的行（批量执行）
+    stats = await restore_project_snapshot(db, project, snapshot.id)
+    bump_context_version(db, project_id)
     
     await db.commit()
+    invalidate_word_count(project_id)
     
-    return {"success": True, "message": f"已恢复到快照: {snapshot.name}"}
+    return {"success": True, "message": f"已恢复到快照: {snapshot.name}", **stats}
 
 
 @router.delete("/{snapshot_id}")
@@ -274,7 +186,7 @@ async def delete_snapshot(snapshot_id: int, db: AsyncSession = Depends(get_db)):
     if not snapshot:
         raise HTTPException(status_code=404, detail="Snapshot not found")
     
-    await db.delete(snapshot)
+    await delete_snapshot_record(db, snapshot)
     await db.commit()
     
     return {"success": True, "message": "快照已删除"}
@@ -3,32 +3,63 @@ AI 服务 - OpenAI/Ollama 集成
 支持 SSE 流式续写
 """
 
+import asyncio
+import logging
 import os
 import re
 from typing import AsyncGenerator
 from openai import AsyncOpenAI
 
+from config import settings
+from logging_config import log_fields, truncate
+from services.client_pool import client_registry
+from services.json_parser import parse_llm_json
+from services.response_cache import make_cache_key, response_cache
+from services.text_service import split_chunks
+
+logger = logging.getLogger(__name__)
+
 # 配置：优先使用 Ollama，否则使用 OpenAI
 DEFAULT_OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
 DEFAULT_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
+# 提示模板版本：修改对应提示词时递增，使旧的缓存响应失效
+SUMMARY_TEMPLATE_VERSION = 1
+MODIFY_TEMPLATE_VERSION = 1
+EXTRACT_TEMPLATE_VERSION = 1
+ROLLUP_TEMPLATE_VERSION = 1
+
+# 摘要树汇总提示：level -> (系统提示, max_tokens)
+ROLLUP_PROMPTS = {
+    "arc": ("以下是小说中连续若干章节的摘要，请合并为一段连贯的阶段概要，保留关键情节转折、人物变化与伏笔，控制在200字以内。", 400),
+    "book": ("以下是小说各阶段的概要，请合并为全书的故事梗概，保留主线、主要人物关系与尚未解决的悬念，控制在400字以内。", 800),
+}
+
 
 def get_client(api_base: str = None, api_key: str = None) -> AsyncOpenAI:
-    """获取 OpenAI 客户端"""
+    """获取 OpenAI 客户端（从客户端池复用，同一服务地址共享连接）"""
     if api_base or api_key:
-        return AsyncOpenAI(
-            base_url=api_base or DEFAULT_OLLAMA_BASE_URL,
-            api_key=api_key or "ollama"
-        )
+        return client_registry.get(api_base or DEFAULT_OLLAMA_BASE_URL, api_key or "ollama")
     
     if DEFAULT_OPENAI_API_KEY:
-        return AsyncOpenAI(api_key=DEFAULT_OPENAI_API_KEY)
+        return client_registry.get(None, DEFAULT_OPENAI_API_KEY)
     else:
-        return AsyncOpenAI(base_url=DEFAULT_OLLAMA_BASE_URL, api_key="ollama")
+        return client_registry.get(DEFAULT_OLLAMA_BASE_URL, "ollama")
 
 
-async def generate_continuation(
-    context: str,
+# 续写用户消息的固定前缀（强化指令：严禁任何前言，直接输出正文）
+CONTINUE_INSTRUCTION = "请续写。要求：直接输出续写内容，严禁任何前言、引导语或解释。上下文如下：\n\n"
+
+
+def format_relationship(r: dict) -> str:
+    """角色关系在系统提示中的一行"""
+    return (
+        f"- {r['source_name']} 与 {r['target_name']}: {r['relation_type']}"
+        + (f" ({r['description']})" if r.get('description') else "")
+    )
+
+
+def build_continuation_prompt(
     world_view: str = "",
     style: str = "",
     relationships: list[dict] = None,
@@ -36,19 +67,13 @@ async def generate_continuation(
     outline: str = "",
     chapter_outline: str = "",
     perspective: str = "third",
-    model: str = "gpt-4o-mini",
-    temperature: float = 0.7,
-    max_tokens: int = 1000,
-    api_base: str = None,
-    api_key: str = None,
-) -> AsyncGenerator[str, None]:
+    related_passages: str = "",
+) -> str:
     """
-    AI 续写生成器（流式输出）
-    专注于生成干净的小说正文
+    构建续写系统提示
+    按变化频率排序：规则、世界观、风格、角色关系、剧情大纲在前，章节相关内容在后，
+    使服务端的前缀缓存在切换章节时仍能命中
     """
-    print(f"[AI_CONTINUE] model={model}, api_base={api_base}")
-    client = get_client(api_base, api_key)
-
     # 人称视角说明
     perspective_desc = {
         "first": "第一人称视角（使用「我」来叙述）",
@@ -58,7 +83,6 @@ async def generate_continuation(
     perspective_text = perspective_desc.get(perspective, perspective_desc["third"])
 
     # 构建系统提示 - 只要求生成纯正文，不要任何代码或标签
-    print(f"[DEBUG] generate_continuation called with model: '{model}', api_base: '{api_base}'")
     system_parts = [
         "你是一位专业的小说作家。请根据上下文直接续写故事内容。",
         "",
@@ -70,41 +94,75 @@ async def generate_continuation(
         "5. 情节连贯，人物性格一致",
     ]
     
+    if world_view:
+        system_parts.append(f"\n\n【世界观设定】\n{world_view}")
+    
+    if style:
+        system_parts.append(f"\n\n【写作风格】\n{style}")
+    
+    if relationships:
+        rel_text = "\n".join(format_relationship(r) for r in relationships)
+        system_parts.append(f"\n\n【角色关系】\n{rel_text}")
+    
     # 添加剧情大纲
     if outline:
         system_parts.append(f"\n\n【剧情大纲】\n{outline}")
     
-    # 添加章节大纲
-    if chapter_outline:
-        system_parts.append(f"\n\n【本章大纲】\n{chapter_outline}")
-    
     # 添加前面章节摘要（用于上下文连贯性）
     if previous_summaries:
         system_parts.append(f"\n\n【前情提要】\n{previous_summaries}")
     
-    if world_view:
-        system_parts.append(f"\n\n【世界观设定】\n{world_view}")
+    # 添加与前文相关的之前章节片段（检索结果）
+    if related_passages:
+        system_parts.append(f"\n\n【相关片段】\n{related_passages}")
     
-    if style:
-        system_parts.append(f"\n\n【写作风格】\n{style}")
-    
-    if relationships:
-        rel_text = "\n".join([
-            f"- {r['source_name']} 与 {r['target_name']}: {r['relation_type']}"
-            + (f" ({r['description']})" if r.get('description') else "")
-            for r in relationships
-        ])
-        system_parts.append(f"\n\n【角色关系】\n{rel_text}")
+    # 添加章节大纲
+    if chapter_outline:
+        system_parts.append(f"\n\n【本章大纲】\n{chapter_outline}")
     
-    system_prompt = "".join(system_parts)
+    return "".join(system_parts)
+
+
+async def generate_continuation(
+    context: str,
+    world_view: str = "",
+    style: str = "",
+    relationships: list[dict] = None,
+    previous_summaries: str = "",
+    outline: str = "",
+    chapter_outline: str = "",
+    perspective: str = "third",
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.7,
+    max_tokens: int = 1000,
+    api_base: str = None,
+    api_key: str = None,
+    system_prompt: str = None,
+) -> AsyncGenerator[str, None]:
+    """
+    AI 续写生成器（流式输出）
+    专注于生成干净的小说正文；传入 system_prompt 时直接使用（已缓存的上下文）
+    """
+    logger.debug("generate_continuation model=%s api_base=%s", model, api_base)
+    client = get_client(api_base, api_key)
+
+    if system_prompt is None:
+        system_prompt = build_continuation_prompt(
+            world_view=world_view,
+            style=style,
+            relationships=relationships,
+            previous_summaries=previous_summaries,
+            outline=outline,
+            chapter_outline=chapter_outline,
+            perspective=perspective,
+        )
     
     # 流式请求
     stream = await client.chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
-            # 强化指令：严禁任何前言，直接输出正文
-            {"role": "user", "content": f"请续写。要求：直接输出续写内容，严禁任何前言、引导语或解释。上下文如下：\n\n{context}"},
+            {"role": "user", "content": CONTINUE_INSTRUCTION + context},
         ],
         temperature=temperature,
         max_tokens=max_tokens,
@@ -112,11 +170,13 @@ async def generate_continuation(
     )
     
     chunk_index = 0
+    debug = logger.isEnabledFor(logging.DEBUG)
     async for chunk in stream:
         if chunk.choices and chunk.choices[0].delta.content:
             raw_content = chunk.choices[0].delta.content
-            # DEBUG: 观察原始 chunk，用竖线包围便于识别空格/缺失
-            print(f"[CHUNK_{chunk_index:03d}]: |{raw_content}|")
+            if debug:
+                # 观察原始 chunk，用竖线包围便于识别空格/缺失
+                logger.debug("chunk %03d: |%s|", chunk_index, raw_content)
             chunk_index += 1
             yield raw_content
 
@@ -136,25 +196,87 @@ def clean_ai_output(content: str) -> str:
     return content
 
 
+async def cached_completion(
+    kind: str,
+    messages: list[dict],
+    model: str,
+    api_base: str = None,
+    api_key: str = None,
+    template_version: int = 1,
+    use_cache: bool = True,
+    timeout: float = None,
+    **params,
+) -> str:
+    """
+    非流式补全（经响应缓存），返回模型原始输出
+    use_cache=False 时不读取缓存、直接请求模型，结果仍写回缓存；
+    空响应与请求异常不缓存
+    """
+    client = get_client(api_base, api_key)
+    key = make_cache_key(kind, model, str(client.base_url), template_version, params, messages)
+    if use_cache and settings.ai_cache_enabled:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            logger.debug("Response cache hit", extra=log_fields(kind=kind, model=model))
+            return cached
+
+    request = client.chat.completions.create(model=model, messages=messages, **params)
+    response = await (asyncio.wait_for(request, timeout=timeout) if timeout else request)
+    content = response.choices[0].message.content or ""
+    if content and settings.ai_cache_enabled:
+        await response_cache.put(key, kind, model, content)
+    return content
+
+
 async def generate_summary(
     content: str, 
     model: str = "gpt-4o-mini",
     api_base: str = None,
     api_key: str = None,
+    use_cache: bool = True,
 ) -> str:
     """生成章节摘要"""
-    client = get_client(api_base, api_key)
-    
-    response = await client.chat.completions.create(
-        model=model,
+    return await cached_completion(
+        "summary",
         messages=[
             {"role": "system", "content": "请用简洁的语言总结以下内容，突出主要情节和人物行动，控制在100字以内。"},
             {"role": "user", "content": content},
         ],
+        model=model,
+        api_base=api_base,
+        api_key=api_key,
+        template_version=SUMMARY_TEMPLATE_VERSION,
+        use_cache=use_cache,
         temperature=0.3,
         max_tokens=200,
     )
-    return response.choices[0].message.content or ""
+
+
+async def generate_rollup(
+    summaries: list[str],
+    level: str,
+    model: str = "gpt-4o-mini",
+    api_base: str = None,
+    api_key: str = None,
+    use_cache: bool = True,
+) -> str:
+    """将多段摘要汇总为上一级摘要（level: arc / book）"""
+    prompt, max_tokens = ROLLUP_PROMPTS[level]
+    result = await cached_completion(
+        "rollup",
+        messages=[
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": "\n\n".join(summaries)},
+        ],
+        model=model,
+        api_base=api_base,
+        api_key=api_key,
+        template_version=ROLLUP_TEMPLATE_VERSION,
+        use_cache=use_cache,
+        temperature=0.3,
+        max_tokens=max_tokens,
+    )
+    return result.strip()
 
 
 async def modify_text(
@@ -163,6 +285,7 @@ async def modify_text(
     model: str = "gpt-4o-mini",
     api_base: str = None,
     api_key: str = None,
+    use_cache: bool = True,
 ) -> str:
     """
     AI 修改文字
@@ -170,8 +293,6 @@ async def modify_text(
             formal(正式), casual(轻松), serious(严肃),
             custom:xxx(自定义指令)
     """
-    client = get_client(api_base, api_key)
-    
     action_prompts = {
         "rewrite": "请重写以下文字，保持原意但使用不同的表达方式，使其更加流畅优美：",
         "shorten": "请精简以下文字，去除冗余，保留核心意思，使其更加简洁有力：",
@@ -189,19 +310,23 @@ async def modify_text(
         prompt = action_prompts.get(action, action_prompts["rewrite"])
     
     try:
-        response = await client.chat.completions.create(
-            model=model,
+        result = await cached_completion(
+            "modify",
             messages=[
                 {"role": "system", "content": f"{prompt}\n\n请只返回修改后的文字，不要包含任何解释或其他内容。"},
                 {"role": "user", "content": text},
             ],
+            model=model,
+            api_base=api_base,
+            api_key=api_key,
+            template_version=MODIFY_TEMPLATE_VERSION,
+            use_cache=use_cache,
             temperature=0.7,
             max_tokens=2000,
         )
-        result = response.choices[0].message.content or text
-        return result.strip()
+        return (result or text).strip()
     except Exception as e:
-        print(f"[ERROR] modify_text failed: {e}")
+        logger.error("modify_text failed: %s", e)
         raise e
 
 
@@ -212,24 +337,38 @@ async def list_models(api_base: str = None, api_key: str = None) -> list[str]:
         models = await client.models.list()
         return [model.id for model in models.data]
     except Exception as e:
-        print(f"Error listing models: {e}")
+        logger.error("Error listing models: %s", e)
         raise e
 
 
-async def extract_all_data(
+# 提取结果的各表键 -> 去重字段（合并分块结果时，同一表中去重字段相同的条目视为同一条）
+EXTRACT_TABLES = {
+    "spacetime": ("date", "time", "location"),
+    "characters": ("name",),
+    "relationships": ("name",),
+    "tasks": ("character", "task"),
+    "events": ("character", "event"),
+    "items": ("owner", "name"),
+}
+
+
+def empty_extraction() -> dict:
+    """空的提取结果（各表均为空数组）"""
+    return {key: [] for key in EXTRACT_TABLES}
+
+
+async def _extract_chunk(
     content: str,
     existing_characters: list[str] = None,
     model: str = "gpt-4o-mini",
     api_base: str = None,
     api_key: str = None,
+    use_cache: bool = True,
 ) -> dict:
     """
-    从内容中提取结构化数据（独立请求）
-    返回包含所有表格数据的字典
+    单次提取请求：从一段内容中提取结构化数据
+    请求失败时抛出异常；响应无法解析时返回空结果
     """
-    print(f"[AI_SERVICE] extract_all_data called, model={model}, api_base={api_base}")
-    client = get_client(api_base, api_key)
-    
     existing_chars_hint = ""
     if existing_characters:
         existing_chars_hint = f"\n\n已知角色列表：{', '.join(existing_characters)}"
@@ -261,97 +400,156 @@ async def extract_all_data(
 
 只返回JSON，不要其他文字。只提取内容中明确提到的信息，不要推测。"""
 
-    print(f"[AI_SERVICE] Sending request to AI...")
+    logger.debug("Sending extraction request")
     
     # 对于提取任务，使用更简单的模型名称（去掉流式前缀）
     extract_model = model
     if "/" in model:
         # 如果模型名包含/，可能是流式模型，尝试用简单名称
         extract_model = model.split("/")[-1]
-        print(f"[AI_SERVICE] Using simplified model name: {extract_model}")
+        logger.debug("Using simplified model name: %s", extract_model)
     
-    try:
-        import asyncio
-        # 设置 60 秒超时
-        response = await asyncio.wait_for(
-            client.chat.completions.create(
-                model=extract_model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的内容分析助手。请从小说内容中提取结构化信息。"},
-                    {"role": "user", "content": f"{prompt}\n\n小说内容：\n{content}"},
-                ],
-                temperature=0.2,
-                max_tokens=2000,
-            ),
-            timeout=120.0
-        )
-        print(f"[AI_SERVICE] Response received")
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"[AI_SERVICE] AI request failed: {e}")
-        return {
-            "spacetime": [],
-            "characters": [],
-            "relationships": [],
-            "tasks": [],
-            "events": [],
-            "items": []
-        }
+    # 缓存的是模型原始输出，解析逻辑变化不需要使缓存失效；请求失败时向上抛出
+    result = await cached_completion(
+        "extract",
+        messages=[
+            {"role": "system", "content": "你是一个专业的内容分析助手。请从小说内容中提取结构化信息。"},
+            {"role": "user", "content": f"{prompt}\n\n小说内容：\n{content}"},
+        ],
+        model=extract_model,
+        api_base=api_base,
+        api_key=api_key,
+        template_version=EXTRACT_TEMPLATE_VERSION,
+        use_cache=use_cache,
+        timeout=120.0,
+        temperature=0.2,
+        max_tokens=2000,
+    )
+    logger.debug("Extraction response received")
     
-    try:
-        import json
-        import re
-        result = response.choices[0].message.content or "{}"
-        print(f"[AI_SERVICE] Raw AI response: {result}")
-        
-        # 移除 <think>...</think> 标签 (DeepSeek Reasoner)
-        result = re.sub(r'<think>.*?</think>', '', result, flags=re.DOTALL)
-        
-        # 移除 markdown 代码块标记
-        result = re.sub(r'^```json\s*', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^```\s*$', '', result, flags=re.MULTILINE)
-        result = result.strip()
-        
-        # 尝试提取 JSON
-        if "{" in result:
-            start = result.index("{")
-            # 找到最后一个完整的 }
-            end = result.rfind("}")
-            if end > start:
-                json_str = result[start:end+1]
-                try:
-                    parsed = json.loads(json_str)
-                    print(f"[AI_SERVICE] Parsed JSON successfully")
-                    return parsed
-                except json.JSONDecodeError as e:
-                    print(f"[AI_SERVICE] JSON decode error: {e}")
-                    # 尝试修复不完整的 JSON
-                    # 逐步尝试在不同位置截断
-                    for i in range(len(json_str) - 1, 0, -1):
-                        if json_str[i] in '}]':
-                            try:
-                                # 尝试补全 JSON
-                                fixed = json_str[:i+1]
-                                # 计算缺少的括号
-                                open_braces = fixed.count('{') - fixed.count('}')
-                                open_brackets = fixed.count('[') - fixed.count(']')
-                                fixed += ']' * open_brackets + '}' * open_braces
-                                parsed = json.loads(fixed)
-                                print(f"[AI_SERVICE] Parsed truncated JSON successfully")
-                                return parsed
-                            except:
-                                continue
-    except Exception as e:
-        print(f"[AI_SERVICE] Failed to parse extracted data: {e}")
+    result = result or "{}"
+    logger.debug("Raw extraction response", extra=log_fields(chars=len(result), response=result))
     
-    return {
-        "spacetime": [],
-        "characters": [],
-        "relationships": [],
-        "tasks": [],
-        "events": [],
-        "items": []
+    # 容忍推理内容、代码块标记、说明文字与截断，保留最长的有效前缀
+    parsed = parse_llm_json(result)
+    if isinstance(parsed, dict):
+        logger.debug("Parsed extraction JSON")
+        return parsed
+    logger.warning("Failed to parse extracted data", extra=log_fields(response=truncate(result, 500)))
+    return empty_extraction()
+
+
+def _normalize_field(value) -> str:
+    return "".join(str(value).split()).lower() if value is not None else ""
+
+
+def merge_extractions(parts: list[dict]) -> dict:
+    """
+    按块顺序合并分块提取结果
+    每个表按去重字段（忽略空白与大小写）去重，去重字段都为空时按整条内容去重；
+    重复条目保留先出现的非空字段，只用后出现的条目补全空字段，结果与块完成的先后无关
+    """
+    merged = empty_extraction()
+    for key, fields in EXTRACT_TABLES.items():
+        index: dict[tuple, dict] = {}
+        for part in parts:
+            items = part.get(key) if isinstance(part, dict) else None
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                identity = tuple(_normalize_field(item.get(field)) for field in fields)
+                if not any(identity):
+                    identity = tuple(sorted((k, _normalize_field(v)) for k, v in item.items()))
+                existing = index.get(identity)
+                if existing is None:
+                    index[identity] = dict(item)
+                    merged[key].append(index[identity])
+                    continue
+                for field, value in item.items():
+                    if value and not existing.get(field):
+                        existing[field] = value
+    return merged
+
+
+async def iter_extractions(
+    content: str,
+    existing_characters: list[str] = None,
+    model: str = "gpt-4o-mini",
+    api_base: str = None,
+    api_key: str = None,
+    use_cache: bool = True,
+    chunk_chars: int = None,
+    concurrency: int = None,
+) -> AsyncGenerator[dict, None]:
+    """
+    分块并发提取（map-reduce），按块完成顺序产出事件:
+    - {"type": "start", "chunks": 块数}
+    - {"type": "chunk", "index": 块序号, "data": 该块结果} 或 {"type": "chunk", "index", "error"}
+    - {"type": "done", "data": 合并结果, "failed": [失败的块序号]}
+    内容按段落边界切分并重叠，信号量限制同时进行的请求数；
+    每块单独缓存，修改后部内容时前面未变化的块直接命中缓存
+    """
+    chunk_chars = chunk_chars or settings.ai_extract_chunk_chars
+    chunks = split_chunks(content, chunk_chars, min(settings.ai_extract_overlap_chars, chunk_chars // 4)) or [""]
+    semaphore = asyncio.Semaphore(concurrency or settings.ai_extract_concurrency)
+    logger.debug("Extraction started", extra=log_fields(
+        model=model, api_base=api_base, content_chars=len(content), chunks=len(chunks),
+    ))
+
+    async def run(index: int, chunk: str) -> tuple[int, dict | None, str | None]:
+        async with semaphore:
+            try:
+                return index, await _extract_chunk(chunk, existing_characters, model, api_base, api_key, use_cache), None
+            except Exception as e:
+                logger.exception("Extraction request failed", extra=log_fields(chunk=index, error=str(e)))
+                return index, None, str(e) or type(e).__name__
+
+    yield {"type": "start", "chunks": len(chunks)}
+    tasks = [asyncio.create_task(run(index, chunk)) for index, chunk in enumerate(chunks)]
+    results: list[dict | None] = [None] * len(chunks)
+    try:
+        for future in asyncio.as_completed(tasks):
+            index, data, error = await future
+            results[index] = data
+            if error is None:
+                yield {"type": "chunk", "index": index, "data": data}
+            else:
+                yield {"type": "chunk", "index": index, "error": truncate(error, 200)}
+    finally:
+        # 客户端断开等提前结束时取消未完成的请求
+        for task in tasks:
+            task.cancel()
+
+    failed = [index for index, data in enumerate(results) if data is None]
+    yield {
+        "type": "done",
+        "data": merge_extractions([data for data in results if data is not None]),
+        "failed": failed,
     }
 
 
+async def extract_all_data(
+    content: str,
+    existing_characters: list[str] = None,
+    model: str = "gpt-4o-mini",
+    api_base: str = None,
+    api_key: str = None,
+    use_cache: bool = True,
+    chunk_chars: int = None,
+    concurrency: int = None,
+) -> dict:
+    """
+    从内容中提取结构化数据（长内容分块并发提取后合并）
+    返回包含所有表格数据的字典；全部块失败时各表为空
+    部分块失败时记录警告（需要失败块列表时使用 iter_extractions）
+    """
+    async for event in iter_extractions(
+        content, existing_characters, model, api_base, api_key, use_cache, chunk_chars, concurrency,
+    ):
+        if event["type"] == "done":
+            if event["failed"]:
+                logger.warning("Extraction incomplete", extra=log_fields(failed_chunks=event["failed"]))
+            return event["data"]
+    return empty_extraction()
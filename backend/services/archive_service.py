@@ -0,0 +1,290 @@
+"""
+项目归档服务 (zip)
+归档包含 manifest.json、每章一个正文文件、角色/关系/数据表 JSON 以及角色缩略图；
+导出时在工作线程中逐成员压缩并立即输出，导入时按需读取单个成员
+"""
+
+import asyncio
+import io
+import json
+import os
+import time
+import zipfile
+from typing import AsyncGenerator
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import async_session
+from models.schemas import Project, Character, Relationship, Chapter, DataTable
+from services.export_service import (
+    EXPORT_VERSION, project_record, character_record, relationship_record, data_table_record, iter_batches,
+)
+from services.import_service import ImportFormatError, ImportLimitError, import_records
+from services.text_service import content_hash, count_words
+
+ARCHIVE_FORMAT = "novel-copilot-archive"
+MANIFEST_NAME = "manifest.json"
+CHARACTERS_NAME = "characters.json"
+RELATIONSHIPS_NAME = "relationships.json"
+DATA_TABLES_NAME = "data_tables.json"
+
+THUMBNAILS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "thumbnails")
+
+_COMPRESS_LEVEL = 6
+
+
+def chapter_member(index: int) -> str:
+    return f"chapters/{index:05d}.txt"
+
+
+def _thumbnail_file(thumbnail_path: str | None) -> str | None:
+    """/thumbnails/{id}.jpg -> 本地文件路径（文件不存在时返回 None）"""
+    if not thumbnail_path:
+        return None
+    path = os.path.join(THUMBNAILS_DIR, os.path.basename(thumbnail_path))
+    return path if os.path.isfile(path) else None
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+class _DrainBuffer(io.RawIOBase):
+    """zip 的输出目标：只追加、不可回写，写入的数据由 drain() 取走"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ArchiveWriter:
+    """逐成员写入 zip：压缩在工作线程中进行，每个成员写完即可取出对应字节"""
+
+    def __init__(self):
+        self._buffer = _DrainBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=_COMPRESS_LEVEL)
+
+    def _write_file(self, name: str, path: str) -> None:
+        # 缩略图本身已是 JPEG，不再压缩
+        self._zip.write(path, name, compress_type=zipfile.ZIP_STORED)
+
+    async def add(self, name: str, data: bytes) -> bytes:
+        await asyncio.to_thread(self._zip.writestr, name, data)
+        return self._buffer.drain()
+
+    async def add_file(self, name: str, path: str) -> bytes:
+        await asyncio.to_thread(self._write_file, name, path)
+        return self._buffer.drain()
+
+    async def close(self) -> bytes:
+        await asyncio.to_thread(self._zip.close)
+        return self._buffer.drain()
+
+
+async def stream_project_archive(project_id: int) -> AsyncGenerator[bytes, None]:
+    """逐成员生成项目 zip 归档"""
+    writer = _ArchiveWriter()
+    async with async_session() as session:
+        result = await session.execute(select(Project).where(Project.id == project_id))
+        project = result.scalar_one()
+
+        # 章节元数据（不含正文）用于清单
+        result = await session.execute(
+            select(Chapter.id, Chapter.title, Chapter.rank, Chapter.summary, Chapter.characters_mentioned)
+            .where(Chapter.project_id == project_id)
+            .order_by(Chapter.rank)
+        )
+        chapters, members = [], {}
+        for index, row in enumerate(result.all(), start=1):
+            members[row.id] = chapter_member(index)
+            chapters.append({
+                "file": members[row.id],
+                "title": row.title,
+                "rank": row.rank,
+                "summary": row.summary,
+                "characters_mentioned": row.characters_mentioned,
+            })
+
+        result = await session.execute(select(Character).where(Character.project_id == project_id))
+        characters, thumbnails = [], []
+        for c in result.scalars().all():
+            record = {**character_record(c), "avatar_url": c.avatar_url}
+            path = _thumbnail_file(c.thumbnail_path)
+            if path:
+                record["thumbnail"] = f"thumbnails/{c.id}.jpg"
+                thumbnails.append((record["thumbnail"], path))
+            characters.append(record)
+
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "version": EXPORT_VERSION,
+            "project": project_record(project),
+            "chapters": chapters,
+            "characters": CHARACTERS_NAME,
+            "relationships": RELATIONSHIPS_NAME,
+            "data_tables": DATA_TABLES_NAME,
+        }
+        yield await writer.add(MANIFEST_NAME, _dumps(manifest))
+        yield await writer.add(CHARACTERS_NAME, _dumps(characters))
+
+        result = await session.execute(select(Relationship).where(Relationship.project_id == project_id))
+        yield await writer.add(RELATIONSHIPS_NAME, _dumps([relationship_record(r) for r in result.scalars().all()]))
+        result = await session.execute(select(DataTable).where(DataTable.project_id == project_id))
+        yield await writer.add(DATA_TABLES_NAME, _dumps([data_table_record(dt) for dt in result.scalars().all()]))
+
+        stmt = select(Chapter.id, Chapter.content).where(Chapter.project_id == project_id).order_by(Chapter.rank)
+        async for batch in iter_batches(session, stmt):
+            for row in batch:
+                if row.id in members:
+                    yield await writer.add(members[row.id], (row.content or "").encode("utf-8"))
+
+    for name, path in thumbnails:
+        yield await writer.add_file(name, path)
+    yield await writer.close()
+
+
+class ProjectArchive:
+    """按需读取的 zip 归档（上传文件已落盘，可随机访问）"""
+
+    def __init__(self, fileobj):
+        fileobj.seek(0, os.SEEK_END)
+        if fileobj.tell() > settings.import_max_bytes:
+            raise ImportLimitError(f"File exceeds {settings.import_max_bytes} bytes")
+        fileobj.seek(0)
+        try:
+            self.zip = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile as e:
+            raise ImportFormatError(f"Invalid zip archive: {e}") from e
+        self.manifest = self.read_json(MANIFEST_NAME)
+        if not isinstance(self.manifest, dict) or self.manifest.get("format") != ARCHIVE_FORMAT:
+            raise ImportFormatError("Not a project archive")
+
+    def read(self, name: str) -> bytes:
+        try:
+            info = self.zip.getinfo(name)
+        except KeyError as e:
+            raise ImportFormatError(f"Missing archive member: {name}") from e
+        if info.file_size > settings.import_max_record_bytes:
+            raise ImportLimitError(f"Archive member {name} exceeds {settings.import_max_record_bytes} bytes")
+        try:
+            return self.zip.read(info)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise ImportFormatError(f"Corrupt archive member {name}: {e}") from e
+
+    def read_json(self, name: str):
+        try:
+            return json.loads(self.read(name))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ImportFormatError(f"Invalid JSON in {name}: {e}") from e
+
+    def read_text(self, name: str) -> str:
+        try:
+            return self.read(name).decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise ImportFormatError(f"Invalid UTF-8 in {name}: {e}") from e
+
+    def chapter(self, index: int) -> dict:
+        """读取第 index 章（从 1 开始，按清单顺序）的元数据与正文"""
+        chapters = self.manifest.get("chapters") or []
+        if not 1 <= index <= len(chapters):
+            raise ImportFormatError(f"Chapter index out of range: {index}")
+        meta = chapters[index - 1]
+        if not isinstance(meta, dict) or not isinstance(meta.get("file"), str):
+            raise ImportFormatError(f"Chapter {index} has no 'file' entry in manifest")
+        return {**meta, "content": self.read_text(meta["file"])}
+
+
+async def _iter_archive(archive: ProjectArchive, thumbnails: dict[int, str]) -> AsyncGenerator[tuple[str, object], None]:
+    """按导入顺序逐个读取归档成员；缩略图只记录成员名，入库后再解压"""
+    manifest = archive.manifest
+    yield "version", manifest.get("version")
+    yield "project", manifest.get("project")
+    for record in await asyncio.to_thread(archive.read_json, manifest.get("characters", CHARACTERS_NAME)):
+        if isinstance(record, dict) and record.get("id") and record.get("thumbnail"):
+            thumbnails[record["id"]] = record["thumbnail"]
+        yield "characters", record
+    for record in await asyncio.to_thread(archive.read_json, manifest.get("relationships", RELATIONSHIPS_NAME)):
+        yield "relationships", record
+    for index in range(1, len(manifest.get("chapters") or []) + 1):
+        yield "chapters", await asyncio.to_thread(archive.chapter, index)
+    for record in await asyncio.to_thread(archive.read_json, manifest.get("data_tables", DATA_TABLES_NAME)):
+        yield "data_tables", record
+
+
+def _extract_thumbnail(archive: ProjectArchive, member: str, character_id: int) -> str:
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    filename = f"{character_id}.jpg"
+    with open(os.path.join(THUMBNAILS_DIR, filename), "wb") as f:
+        f.write(archive.read(member))
+    return f"/thumbnails/{filename}"
+
+
+async def import_project_archive(db: AsyncSession, fileobj) -> dict:
+    """从 zip 归档导入新项目（含缩略图）"""
+    started = time.perf_counter()
+    archive = await asyncio.to_thread(ProjectArchive, fileobj)
+    thumbnails: dict[int, str] = {}
+    importer = await import_records(db, _iter_archive(archive, thumbnails))
+
+    rows = []
+    for old_id, member in thumbnails.items():
+        new_id = importer.char_id_map.get(old_id)
+        if new_id:
+            path = await asyncio.to_thread(_extract_thumbnail, archive, member, new_id)
+            rows.append({"id": new_id, "thumbnail_path": path})
+    if rows:
+        await db.execute(update(Character), rows)
+
+    return {
+        **importer.report(),
+        "thumbnails": len(rows),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+async def restore_archive_chapter(
+    db: AsyncSession, fileobj, project_id: int, index: int, chapter: Chapter | None = None
+) -> Chapter:
+    """
+    从归档中只读取一章：传入 chapter 时覆盖该章节，否则作为新章节加入项目
+    """
+    archive = await asyncio.to_thread(ProjectArchive, fileobj)
+    data = await asyncio.to_thread(archive.chapter, index)
+    text = data["content"]
+
+    if chapter is None:
+        # 与新建章节一致，追加到项目末尾（归档中的 rank 可能与现有章节重复）
+        result = await db.execute(
+            select(Chapter.rank).where(Chapter.project_id == project_id).order_by(Chapter.rank.desc()).limit(1)
+        )
+        chapter = Chapter(project_id=project_id, rank=(result.scalar() or 0) + 1)
+        db.add(chapter)
+    chapter.title = data.get("title") or "Untitled"
+    chapter.content = text
+    chapter.content_hash = content_hash(text)
+    chapter.word_count = count_words(text)
+    chapter.summary = data.get("summary")
+    # 归档不记录摘要对应的正文版本
+    chapter.summary_hash = None
+    chapter.characters_mentioned = data.get("characters_mentioned") or []
+    await db.flush()
+    await db.refresh(chapter)
+    return chapter
@@ -0,0 +1,160 @@
+"""
+续写 token 预算
+按模型上下文窗口确定输入预算，在前文（编辑器上下文）与系统提示各部分之间分配，
+超出分配的部分在句子边界处截断：前文保留结尾，前情提要保留最近部分，其余保留开头
+"""
+
+from dataclasses import dataclass, field
+
+from config import settings
+from services.ai_service import CONTINUE_INSTRUCTION, build_continuation_prompt
+from services.context_service import PromptSections
+from services.token_service import count_tokens, trim_head, trim_tail
+
+# 预算不足时各部分的分配权重（按权重比例分配，需求小于份额的部分多出的预算再分给其他部分）
+SECTION_WEIGHTS = {
+    "context": 4.0,
+    "summaries": 2.0,
+    "passages": 1.5,
+    "chapter_outline": 2.0,
+    "outline": 1.5,
+    "relationships": 1.0,
+    "world_view": 1.0,
+    "style": 0.5,
+}
+
+# 每个非空部分的标题（如 "\n\n【世界观设定】\n"）
+_HEADING_TOKENS = 8
+
+
+class BudgetError(ValueError):
+    """输出长度过大，模型窗口内放不下最低限度的输入"""
+
+
+def model_context_window(model: str) -> int:
+    """按模型名前缀（取最长匹配，忽略大小写和 "provider/" 前缀）查找上下文窗口"""
+    name = model.lower().rsplit("/", 1)[-1]
+    matches = [prefix for prefix in settings.model_context_windows if name.startswith(prefix.lower())]
+    if not matches:
+        return settings.model_context_window_default
+    return settings.model_context_windows[max(matches, key=len)]
+
+
+def input_budget(model: str, max_tokens: int) -> int:
+    """输入 token 预算: 模型窗口 - 输出长度 - 额外开销，并受 context_max_input_tokens 限制"""
+    budget = model_context_window(model) - max_tokens - settings.context_reserve_tokens
+    if settings.context_max_input_tokens:
+        budget = min(budget, settings.context_max_input_tokens)
+    return max(budget, 0)
+
+
+def allocate(total: int, demands: dict[str, int], weights: dict[str, float]) -> dict[str, int]:
+    """
+    按权重分配预算（注水算法）
+    需求不超过按权重应得份额的部分全额满足，剩余预算在其余部分间重新按权重分配
+    """
+    allocation = {name: 0 for name in demands}
+    active = {name for name, demand in demands.items() if demand > 0}
+    remaining = max(total, 0)
+    while active and remaining > 0:
+        weight_sum = sum(weights.get(name, 1.0) for name in active)
+        share = {name: remaining * weights.get(name, 1.0) / weight_sum for name in active}
+        satisfied = {name for name in active if demands[name] <= share[name]}
+        if not satisfied:
+            for name in active:
+                allocation[name] = int(share[name])
+            break
+        for name in satisfied:
+            allocation[name] = demands[name]
+            remaining -= demands[name]
+        active -= satisfied
+    return allocation
+
+
+@dataclass
+class BudgetReport:
+    """预算分配结果: 各部分 (分配, 需求) 的 token 数"""
+    model: str
+    budget: int
+    fixed: int
+    sections: dict[str, tuple[int, int]] = field(default_factory=dict)
+
+    @property
+    def used(self) -> int:
+        return self.fixed + sum(min(alloc, demand) for alloc, demand in self.sections.values())
+
+    @property
+    def trimmed(self) -> list[str]:
+        return [name for name, (alloc, demand) in self.sections.items() if alloc < demand]
+
+    def header(self) -> str:
+        """响应头格式: budget=12000; used=3456; fixed=180; context=2000/2000; summaries=800/1200"""
+        parts = [f"budget={self.budget}", f"used={self.used}", f"fixed={self.fixed}"]
+        parts += [f"{name}={alloc}/{demand}" for name, (alloc, demand) in self.sections.items() if demand]
+        return "; ".join(parts)
+
+
+def _trim_relationships(sections: PromptSections, limit: int) -> list[dict]:
+    """按顺序保留不超过预算的关系行"""
+    kept, used = [], 0
+    for relationship, cost in zip(sections.relationships, sections.relationship_tokens):
+        if used + cost > limit:
+            break
+        kept.append(relationship)
+        used += cost
+    return kept
+
+
+def plan_continuation(
+    sections: PromptSections,
+    context: str,
+    model: str,
+    max_tokens: int,
+    passages: str = "",
+) -> tuple[str, str, BudgetReport]:
+    """
+    在模型预算内组装续写请求
+    passages: 检索到的相关片段（按相关度排序，超出预算时保留靠前的片段）
+    返回: (系统提示, 截断后的前文, 预算报告)
+    扣除输出长度后放不下最低限度的前文时抛出 BudgetError
+    全部内容都在预算内时系统提示与不做预算时完全一致
+    """
+    budget = input_budget(model, max_tokens)
+    demands = {"context": count_tokens(context), **sections.demands, "passages": count_tokens(passages)}
+    # 固定部分：规则、各部分标题、用户消息前缀
+    fixed = count_tokens(build_continuation_prompt(perspective=sections.perspective)) + count_tokens(CONTINUE_INSTRUCTION)
+    fixed += _HEADING_TOKENS * sum(1 for name, demand in demands.items() if demand and name != "context")
+
+    available = budget - fixed
+    if available < settings.context_min_tokens:
+        raise BudgetError(
+            f"max_tokens={max_tokens} 对模型 {model} 过大：上下文窗口 {model_context_window(model)} token，"
+            f"扣除输出长度与固定提示后仅剩 {max(available, 0)} token，至少需要 {settings.context_min_tokens} token 的前文"
+        )
+
+    # 前文先保留 context_min_tokens（前文更短时保留全部），其余预算再按权重分配
+    floor = min(demands["context"], settings.context_min_tokens)
+    allocation = allocate(available - floor, {**demands, "context": demands["context"] - floor}, SECTION_WEIGHTS)
+    allocation["context"] += floor
+    report = BudgetReport(
+        model=model,
+        budget=budget,
+        fixed=fixed,
+        sections={name: (min(allocation[name], demands[name]), demands[name]) for name in demands},
+    )
+
+    fields = {**sections.prompt_fields(), "related_passages": passages}
+    for name in report.trimmed:
+        limit = allocation[name]
+        if name == "context":
+            context = trim_tail(context, limit)
+        elif name == "summaries":
+            fields["previous_summaries"] = trim_tail(sections.previous_summaries, limit)
+        elif name == "passages":
+            fields["related_passages"] = trim_head(passages, limit)
+        elif name == "relationships":
+            fields["relationships"] = _trim_relationships(sections, limit)
+        else:
+            fields[name] = trim_head(fields[name], limit)
+
+    return build_continuation_prompt(**fields), context, report
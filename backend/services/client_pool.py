@@ -0,0 +1,124 @@
+"""
+AI 客户端池
+按 (api_base, api_key 哈希) 复用 AsyncOpenAI 客户端及其 HTTP 连接池，
+避免每次调用都重新建立 TCP/TLS 连接
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout, DEFAULT_CONNECTION_LIMITS
+
+from config import settings
+
+# 与 openai 所用的 httpx 版本保持一致（不直接依赖 httpx 包）
+_Limits = type(DEFAULT_CONNECTION_LIMITS)
+
+
+@dataclass
+class _Entry:
+    client: AsyncOpenAI
+    last_used: float
+
+
+class ClientRegistry:
+    """
+    有上限的 LRU 客户端注册表
+    - 超过 max_clients 或空闲超过 idle_timeout 的客户端被移出注册表
+    - 被移出的客户端可能仍有进行中的流式请求，等待 retire_grace 秒后再关闭
+    """
+
+    def __init__(self, max_clients: int, idle_timeout: float, retire_grace: float):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.retire_grace = retire_grace
+        self._clients: OrderedDict[tuple[str | None, str], _Entry] = OrderedDict()
+        self._retired: list[tuple[AsyncOpenAI, float]] = []
+        self._closing: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(base_url: str | None, api_key: str) -> tuple[str | None, str]:
+        # 不在内存中以明文作为键保存 API Key
+        return base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _create(base_url: str | None, api_key: str) -> AsyncOpenAI:
+        http_client = DefaultAsyncHttpxClient(
+            limits=_Limits(
+                max_connections=settings.ai_max_connections,
+                max_keepalive_connections=settings.ai_max_keepalive_connections,
+                keepalive_expiry=settings.ai_keepalive_expiry,
+            ),
+            timeout=Timeout(settings.ai_request_timeout, connect=settings.ai_connect_timeout),
+        )
+        return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+
+    def get(self, base_url: str | None, api_key: str) -> AsyncOpenAI:
+        now = time.monotonic()
+        self._sweep(now)
+        key = self._key(base_url, api_key)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry.last_used = now
+            self._clients.move_to_end(key)
+            return entry.client
+
+        self.misses += 1
+        client = self._create(base_url, api_key)
+        self._clients[key] = _Entry(client, now)
+        while len(self._clients) > self.max_clients:
+            _, evicted = self._clients.popitem(last=False)
+            self._retire(evicted.client, now)
+        return client
+
+    def _retire(self, client: AsyncOpenAI, now: float) -> None:
+        self.evictions += 1
+        self._retired.append((client, now))
+
+    def _sweep(self, now: float) -> None:
+        """移出空闲客户端，并关闭已过宽限期的旧客户端"""
+        for key in [k for k, e in self._clients.items() if now - e.last_used > self.idle_timeout]:
+            self._retire(self._clients.pop(key).client, now)
+
+        expired = [c for c, retired_at in self._retired if now - retired_at > self.retire_grace]
+        if not expired:
+            return
+        self._retired = [(c, t) for c, t in self._retired if now - t <= self.retire_grace]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for client in expired:
+            task = loop.create_task(client.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "retired": len(self._retired),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    async def aclose(self) -> None:
+        """关闭全部客户端（应用关闭时调用）"""
+        clients = [e.client for e in self._clients.values()] + [c for c, _ in self._retired]
+        self._clients.clear()
+        self._retired.clear()
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+
+client_registry = ClientRegistry(
+    max_clients=settings.ai_client_max_clients,
+    idle_timeout=settings.ai_client_idle_timeout,
+    retire_grace=settings.ai_client_retire_grace,
+)
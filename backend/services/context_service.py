@@ -0,0 +1,304 @@
+"""
+AI 续写上下文组装
+以固定数量的查询读取项目、角色关系、前文摘要与章节大纲，
+查询次数不随关系数量增长；组装好的提示各部分（及其 token 数）按版本号缓存
+前文摘要按 token 预算从摘要树中选取：最近的章节用章节摘要，更早的用阶段概要/全书概要
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from config import settings
+from models.schemas import Project, Character, Relationship, Chapter, SummaryNode
+from services.ai_service import format_relationship
+from services.token_service import count_tokens
+
+# 前文章节摘要最多读取的章节数（更早的章节由阶段概要覆盖）
+FINE_SCAN_CHAPTERS = 50
+
+# session.info 中待提交的版本递增
+_PENDING_BUMPS = "context_version_bumps"
+
+
+@dataclass
+class ContinuationContext:
+    project: Project
+    relationships: list[dict]
+    previous_summaries: str = ""
+    chapter_outline: str = ""
+
+
+async def load_relationships(db: AsyncSession, project_id: int) -> list[dict]:
+    """一次查询读取关系及两端角色名（源/目标角色各自连接一次）"""
+    source = aliased(Character)
+    target = aliased(Character)
+    result = await db.execute(
+        select(Relationship.relation_type, Relationship.description, source.name, target.name)
+        .join(source, Relationship.source_id == source.id)
+        .join(target, Relationship.target_id == target.id)
+        .where(Relationship.project_id == project_id)
+        .order_by(Relationship.id)
+    )
+    return [
+        {
+            "source_name": source_name,
+            "target_name": target_name,
+            "relation_type": relation_type,
+            "description": description,
+        }
+        for relation_type, description, source_name, target_name in result.all()
+    ]
+
+
+def select_summaries(
+    previous: list,
+    nodes: list[SummaryNode],
+    current_rank: int,
+    budget: int,
+) -> str:
+    """
+    在 token 预算内选取前文摘要
+    previous: 当前章节之前的 (title, summary, rank)，按 rank 倒序
+    1. 从最近的章节往前取章节摘要，最多占预算的 context_fine_share
+    2. 更早的部分由近及远补充阶段概要
+    3. 仍有阶段未能放入时，用全书概要概括
+    只使用完全位于当前章节之前的概要节点，避免把后文情节带入续写
+    """
+    fine_budget = int(budget * settings.context_fine_share)
+    used = 0
+    fine: list[str] = []
+    covered_from = current_rank
+    for title, summary, rank in previous:
+        if not summary:
+            continue
+        text = f"【{title}】{summary}"
+        cost = count_tokens(text)
+        if used + cost > fine_budget:
+            break
+        fine.append(text)
+        used += cost
+        covered_from = rank
+
+    arcs = sorted(
+        (n for n in nodes if n.level == "arc" and n.end_rank < current_rank and n.start_rank < covered_from),
+        key=lambda n: n.position,
+        reverse=True,
+    )
+    coarse: list[str] = []
+    for arc in arcs:
+        text = f"【前情概要·第{arc.position + 1}阶段】{arc.summary}"
+        cost = count_tokens(text)
+        if used + cost > budget:
+            break
+        coarse.append(text)
+        used += cost
+        covered_from = arc.start_rank
+
+    book = next((n for n in nodes if n.level == "book"), None)
+    if book is not None and book.end_rank < current_rank and book.start_rank < covered_from:
+        text = f"【全书梗概】{book.summary}"
+        if used + count_tokens(text) <= budget:
+            coarse.append(text)
+
+    return "\\n\\n".join([*reversed(coarse), *reversed(fine)])
+
+
+async def load_continuation_context(
+    db: AsyncSession,
+    project_id: int,
+    chapter_id: int | None = None,
+    summary_tokens: int | None = None,
+) -> ContinuationContext | None:
+    """
+    组装续写上下文，项目不存在时返回 None
+    查询: 项目 1 次 + 关系 1 次 + (指定章节时) 当前章节 1 次 + 前文摘要 1 次 + 摘要树 1 次
+    summary_tokens: 前文摘要的 token 预算，为空时使用配置默认值
+    """
+    result = await db.execute(select(Project).where(Project.id == project_id))
+    project = result.scalar_one_or_none()
+    if not project:
+        return None
+
+    context = ContinuationContext(project=project, relationships=await load_relationships(db, project_id))
+    if not chapter_id:
+        return context
+
+    # 当前章节只取排序与大纲，不读取正文
+    result = await db.execute(select(Chapter.rank, Chapter.chapter_outline).where(Chapter.id == chapter_id))
+    current = result.one_or_none()
+    if current is None:
+        return context
+    context.chapter_outline = current.chapter_outline or ""
+
+    # 排序在当前章节之前的章节摘要（由近及远）
+    result = await db.execute(
+        select(Chapter.title, Chapter.summary, Chapter.rank)
+        .where(Chapter.project_id == project_id)
+        .where(Chapter.rank < current.rank)
+        .order_by(Chapter.rank.desc())
+        .limit(FINE_SCAN_CHAPTERS)
+    )
+    previous = result.all()
+    result = await db.execute(select(SummaryNode).where(SummaryNode.project_id == project_id))
+    nodes = list(result.scalars().all())
+
+    budget = settings.context_summary_tokens if summary_tokens is None else summary_tokens
+    context.previous_summaries = select_summaries(previous, nodes, current.rank, budget)
+    return context
+
+
+@dataclass
+class PromptSections:
+    """续写系统提示的各部分，demands 为各部分的 token 数（relationship_tokens 为逐行）"""
+    world_view: str
+    style: str
+    relationships: list[dict]
+    outline: str
+    previous_summaries: str
+    chapter_outline: str
+    perspective: str
+    demands: dict[str, int] = field(default_factory=dict)
+    relationship_tokens: list[int] = field(default_factory=list)
+
+    def prompt_fields(self) -> dict:
+        """build_continuation_prompt 的参数"""
+        return {
+            "world_view": self.world_view,
+            "style": self.style,
+            "relationships": self.relationships,
+            "outline": self.outline,
+            "previous_summaries": self.previous_summaries,
+            "chapter_outline": self.chapter_outline,
+            "perspective": self.perspective,
+        }
+
+
+def build_prompt_sections(context: ContinuationContext) -> PromptSections:
+    """由续写上下文生成提示各部分并计算 token 数"""
+    project = context.project
+    sections = PromptSections(
+        world_view=project.world_view or "",
+        style=project.style or "",
+        relationships=context.relationships,
+        outline=project.outline or "",
+        previous_summaries=context.previous_summaries,
+        chapter_outline=context.chapter_outline,
+        perspective=project.perspective or "third",
+    )
+    sections.relationship_tokens = [count_tokens(format_relationship(r)) + 1 for r in context.relationships]
+    sections.demands = {
+        "world_view": count_tokens(sections.world_view),
+        "style": count_tokens(sections.style),
+        "relationships": sum(sections.relationship_tokens),
+        "outline": count_tokens(sections.outline),
+        "summaries": count_tokens(sections.previous_summaries),
+        "chapter_outline": count_tokens(sections.chapter_outline),
+    }
+    return sections
+
+
+class ContextCache:
+    """
+    续写提示缓存: (project_id, chapter_id, 摘要预算) -> (版本号, PromptSections)
+    项目、角色、关系、章节的写操作递增项目版本号，旧版本的缓存项自然失效
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._versions: dict[int, int] = {}
+        self._entries: OrderedDict[tuple[int, int | None, int], tuple[int, PromptSections]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.assembly_count = 0
+        self.assembly_ms_total = 0.0
+        self.last_assembly_ms = 0.0
+
+    def version(self, project_id: int) -> int:
+        return self._versions.get(project_id, 0)
+
+    def bump(self, project_id: int) -> None:
+        self._versions[project_id] = self.version(project_id) + 1
+
+    def get(self, project_id: int, chapter_id: int | None, budget: int) -> PromptSections | None:
+        key = (project_id, chapter_id, budget)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.version(project_id):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(
+        self, project_id: int, chapter_id: int | None, budget: int, version: int,
+        sections: PromptSections, elapsed_ms: float,
+    ) -> None:
+        self.assembly_count += 1
+        self.assembly_ms_total += elapsed_ms
+        self.last_assembly_ms = elapsed_ms
+        key = (project_id, chapter_id, budget)
+        self._entries[key] = (version, sections)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "assemblies": self.assembly_count,
+            "avg_assembly_ms": round(self.assembly_ms_total / self.assembly_count, 3) if self.assembly_count else 0.0,
+            "last_assembly_ms": round(self.last_assembly_ms, 3),
+        }
+
+
+context_cache = ContextCache(settings.context_cache_size)
+
+
+def bump_context_version(db: AsyncSession, project_id: int) -> None:
+    """
+    登记项目上下文的变更，在事务提交后才递增版本号，
+    避免并发的续写请求在提交前读到旧数据却以新版本号缓存
+    """
+    db.sync_session.info.setdefault(_PENDING_BUMPS, set()).add(project_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_context_bumps(session: Session) -> None:
+    for project_id in session.info.pop(_PENDING_BUMPS, ()):
+        context_cache.bump(project_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_context_bumps(session: Session) -> None:
+    session.info.pop(_PENDING_BUMPS, None)
+
+
+async def get_continuation_sections(
+    db: AsyncSession,
+    project_id: int,
+    chapter_id: int | None = None,
+    summary_tokens: int | None = None,
+) -> PromptSections | None:
+    """获取续写提示各部分（优先使用缓存），项目不存在时返回 None"""
+    budget = settings.context_summary_tokens if summary_tokens is None else summary_tokens
+    cached = context_cache.get(project_id, chapter_id, budget)
+    if cached is not None:
+        return cached
+
+    version = context_cache.version(project_id)
+    started = time.perf_counter()
+    context = await load_continuation_context(db, project_id, chapter_id, budget)
+    if context is None:
+        return None
+    sections = build_prompt_sections(context)
+    context_cache.put(project_id, chapter_id, budget, version, sections, (time.perf_counter() - started) * 1000)
+    return sections
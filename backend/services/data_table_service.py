@@ -0,0 +1,35 @@
+"""
+数据表（AI 提取的结构化数据）
+表格类型定义，以及把数据表行格式化为检索用的文本
+"""
+
+from models.schemas import DataTable
+
+# 表格类型定义
+TABLE_TYPES = {
+    0: {"name": "时空表", "columns": ["日期", "时间", "地点", "此地角色"]},
+    1: {"name": "角色特征表", "columns": ["角色名", "身体特征", "性格", "职业", "爱好", "喜欢的事物", "住所", "其他重要信息"]},
+    2: {"name": "社交关系表", "columns": ["角色名", "对主角关系", "对主角态度", "对主角好感"]},
+    3: {"name": "任务表", "columns": ["角色", "任务", "地点", "持续时间"]},
+    4: {"name": "重要事件表", "columns": ["角色", "事件简述", "日期", "地点", "情绪"]},
+    5: {"name": "物品表", "columns": ["拥有人", "物品描述", "物品名", "重要原因"]},
+}
+
+
+def format_facts(tables: list[DataTable]) -> list[str]:
+    """数据表的每一行格式化为一条文本（用于语义检索），如 "【物品表】拥有人: 林远；物品名: 青云剑" """
+    facts = []
+    for table in tables:
+        info = TABLE_TYPES.get(table.table_type)
+        if not info:
+            continue
+        for row in table.rows or []:
+            # JSON 列中的列序号键为字符串
+            cells = [
+                f"{info['columns'][int(col)]}: {value}"
+                for col, value in row.items()
+                if value and str(col).isdigit() and int(col) < len(info["columns"])
+            ]
+            if cells:
+                facts.append(f"【{info['name']}】" + "；".join(cells))
+    return facts
@@ -0,0 +1,119 @@
+"""
+文本向量化（embedding）
+- hashing: 离线特征哈希向量，把检索词项带符号地哈希到固定维度，无需模型服务
+- openai: OpenAI 兼容的 /embeddings 接口，沿用 AI 客户端池与服务地址配置
+返回的向量均为 L2 归一化的 float32 矩阵（点积即余弦相似度）
+"""
+
+import asyncio
+import logging
+import re
+import zlib
+
+import numpy as np
+
+from config import settings
+from logging_config import log_fields
+from services.ai_service import get_client
+
+logger = logging.getLogger(__name__)
+
+# 与 search_service 切词相同的中日韩码位范围（假名、扩展 A、基本区、韩文音节）
+_CJK_RANGES = ((0x3040, 0x30FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xAC00, 0xD7AF))
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+# 64 位整数混合常数（黄金分割 / MurmurHash3）
+_MIX_A = np.uint64(0x9E3779B97F4A7C15)
+_MIX_B = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化（零向量保持为零）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """
+    特征哈希向量：词项与 BM25 检索一致（中日韩相邻二字、单字、英文/数字单词），
+    按码位做整数混合哈希映射到维度与符号，权重 1 + log(tf)
+    哈希与进程无关，重启后与已保存的向量一致；中文词项用 NumPy 整段计算
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _term_hashes(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        cjk = np.zeros(len(codes), dtype=bool)
+        for low, high in _CJK_RANGES:
+            cjk |= (codes >= low) & (codes <= high)
+        pair = cjk[:-1] & cjk[1:]
+        single = cjk & ~np.r_[False, pair] & ~np.r_[pair, False]
+        parts = [
+            codes[:-1][pair] * _MIX_A ^ codes[1:][pair] * _MIX_B,
+            codes[single] * _MIX_A,
+        ]
+        words = _WORD_PATTERN.findall(text)
+        if words:
+            crc = [zlib.crc32(word.lower()[:32].encode("ascii")) for word in words]
+            parts.append(np.asarray(crc, dtype=np.uint64) * _MIX_B + np.uint64(1))
+        hashes = np.concatenate(parts)
+        return hashes ^ (hashes >> np.uint64(29))
+
+    def _embed_sync(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms, tf = np.unique(self._term_hashes(text), return_counts=True)
+            if not len(terms):
+                continue
+            signs = np.where(terms >> np.uint64(63), 1.0, -1.0)
+            slots = (terms % np.uint64(self.dim)).astype(np.intp)
+            matrix[row] = np.bincount(slots, weights=signs * (1.0 + np.log(tf)), minlength=self.dim)
+        return normalize_rows(matrix)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_sync, texts)
+
+
+class OpenAIEmbedder:
+    """OpenAI 兼容的 /embeddings 接口（按 embedding_batch_size 分批请求）"""
+
+    def __init__(self, model: str, api_base: str | None = None, api_key: str | None = None):
+        self.model = model
+        self.api_base = api_base
+        self.api_key = api_key
+        self.name = f"openai:{model}"
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        client = get_client(self.api_base, self.api_key)
+        batch_size = settings.embedding_batch_size
+        parts = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            response = await client.embeddings.create(model=self.model, input=batch)
+            data = sorted(response.data, key=lambda item: item.index)
+            parts.append(np.asarray([item.embedding for item in data], dtype=np.float32))
+        logger.debug("Embedded texts", extra=log_fields(model=self.model, count=len(texts)))
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize_rows(np.concatenate(parts))
+
+
+_embedder = None
+
+
+def get_embedder():
+    """按配置创建（并复用）向量化实现"""
+    global _embedder
+    if _embedder is None:
+        if settings.embedding_provider == "openai":
+            _embedder = OpenAIEmbedder(
+                settings.embedding_model,
+                api_base=settings.embedding_api_base,
+                api_key=settings.embedding_api_key,
+            )
+        else:
+            _embedder = HashingEmbedder(settings.embedding_dim)
+    return _embedder
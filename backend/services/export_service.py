@@ -0,0 +1,139 @@
+"""
+项目导出服务
+从服务端游标分批读取数据，逐块生成 JSON / NDJSON，内存占用与项目大小无关
+"""
+
+import json
+from typing import AsyncGenerator
+
+from sqlalchemy import select
+
+from database import async_session
+from models.schemas import Project, Character, Relationship, Chapter, DataTable
+
+EXPORT_VERSION = "1.0"
+
+# 每批从游标读取的行数
+EXPORT_BATCH_SIZE = 20
+
+
+def project_record(project) -> dict:
+    return {
+        "title": project.title,
+        "description": project.description,
+        "world_view": project.world_view,
+        "style": project.style,
+    }
+
+
+def character_record(c) -> dict:
+    return {
+        "id": c.id,
+        "name": c.name,
+        "bio": c.bio,
+        "attributes": c.attributes,
+        "position_x": c.position_x,
+        "position_y": c.position_y,
+    }
+
+
+def relationship_record(r) -> dict:
+    return {
+        "source_id": r.source_id,
+        "target_id": r.target_id,
+        "relation_type": r.relation_type,
+        "description": r.description,
+    }
+
+
+def chapter_record(ch) -> dict:
+    return {
+        "title": ch.title,
+        "content": ch.content,
+        "rank": ch.rank,
+        "summary": ch.summary,
+        "characters_mentioned": ch.characters_mentioned,
+    }
+
+
+def data_table_record(dt) -> dict:
+    return {
+        "table_type": dt.table_type,
+        "rows": dt.rows,
+    }
+
+
+# 导出分区: (JSON 字段名 / NDJSON 记录类型, 查询, 记录转换函数)
+def _sections(project_id: int):
+    return (
+        (
+            "characters", "character",
+            select(Character.id, Character.name, Character.bio, Character.attributes,
+                   Character.position_x, Character.position_y)
+            .where(Character.project_id == project_id),
+            character_record,
+        ),
+        (
+            "relationships", "relationship",
+            select(Relationship.source_id, Relationship.target_id, Relationship.relation_type, Relationship.description)
+            .where(Relationship.project_id == project_id),
+            relationship_record,
+        ),
+        (
+            "chapters", "chapter",
+            select(Chapter.title, Chapter.content, Chapter.rank, Chapter.summary, Chapter.characters_mentioned)
+            .where(Chapter.project_id == project_id)
+            .order_by(Chapter.rank),
+            chapter_record,
+        ),
+        (
+            "data_tables", "data_table",
+            select(DataTable.table_type, DataTable.rows).where(DataTable.project_id == project_id),
+            data_table_record,
+        ),
+    )
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+async def iter_batches(session, stmt) -> AsyncGenerator[list, None]:
+    """以服务端游标分批读取（不经过 ORM 标识映射）"""
+    result = await session.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    async for partition in result.partitions():
+        yield partition
+
+
+async def stream_project_json(project_id: int) -> AsyncGenerator[str, None]:
+    """逐块生成与普通导出格式一致的 JSON 文档"""
+    async with async_session() as session:
+        result = await session.execute(select(Project).where(Project.id == project_id))
+        project = result.scalar_one()
+        yield f'{{"version": {_dumps(EXPORT_VERSION)}, "project": {_dumps(project_record(project))}'
+
+        for key, _, stmt, to_record in _sections(project_id):
+            yield f', {_dumps(key)}: ['
+            first = True
+            async for batch in iter_batches(session, stmt):
+                items = ", ".join(_dumps(to_record(row)) for row in batch)
+                yield items if first else ", " + items
+                first = False
+            yield "]"
+        yield "}"
+
+
+async def stream_project_ndjson(project_id: int) -> AsyncGenerator[str, None]:
+    """逐块生成 NDJSON：每行一条记录 {"type": ..., "data": ...}"""
+    async with async_session() as session:
+        result = await session.execute(select(Project).where(Project.id == project_id))
+        project = result.scalar_one()
+        yield _dumps({"type": "header", "version": EXPORT_VERSION}) + "\n"
+        yield _dumps({"type": "project", "data": project_record(project)}) + "\n"
+
+        for _, record_type, stmt, to_record in _sections(project_id):
+            async for batch in iter_batches(session, stmt):
+                yield "".join(
+                    _dumps({"type": record_type, "data": to_record(row)}) + "\n"
+                    for row in batch
+                )
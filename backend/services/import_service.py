@@ -0,0 +1,383 @@
+"""
+项目导入服务
+增量解析上传文件（普通 JSON 导出或 NDJSON 导出），边解析边分批写入；
+角色 ID 预先分配，关系按映射后的 ID 批量插入，不再逐条 flush
+"""
+
+import codecs
+import json
+import re
+import time
+from typing import AsyncGenerator
+
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.schemas import Project, Character, Relationship, Chapter, DataTable
+from services.text_service import content_hash, count_words
+
+# 每次从上传文件读取的字节数
+_READ_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# NDJSON 导出的首行为 {"type": "header", ...}，普通 JSON 导出的首个字段为 version / project
+_NDJSON_HEAD = re.compile(r'\s*\{\s*"type"\s*:')
+_json_decoder = json.JSONDecoder()
+
+# JSON 字段名 / NDJSON 记录类型 -> 导入分区
+_SECTIONS = {
+    "characters": "characters",
+    "character": "characters",
+    "relationships": "relationships",
+    "relationship": "relationships",
+    "chapters": "chapters",
+    "chapter": "chapters",
+    "data_tables": "data_tables",
+    "data_table": "data_tables",
+}
+
+
+class ImportFormatError(ValueError):
+    """上传文件格式错误"""
+
+
+class ImportLimitError(ValueError):
+    """上传文件超出大小限制"""
+
+
+class _UploadReader:
+    """按块读取上传文件并增量解码为文本，已消费的部分会被丢弃"""
+
+    def __init__(self, file, max_bytes: int, max_record_bytes: int):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.max_record_bytes = max_record_bytes
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    async def fill(self, hint: int = 0) -> bool:
+        """读取更多数据，返回是否读到了新内容；hint 为当前未完成记录的长度，用于倍增读取量"""
+        if self.eof:
+            return False
+        # 缓冲区是已解码的文本：每个字符最多 4 字节，可能超限时才编码计算实际字节数
+        pending = len(self.buf) - self.pos
+        if pending * 4 > self.max_record_bytes and len(self.buf[self.pos:].encode("utf-8")) > self.max_record_bytes:
+            raise ImportLimitError(f"Single record exceeds {self.max_record_bytes} bytes")
+        chunk = await self.file.read(max(_READ_SIZE, hint))
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.max_bytes:
+            raise ImportLimitError(f"File exceeds {self.max_bytes} bytes")
+        try:
+            text = self._decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            raise ImportFormatError(f"Invalid UTF-8: {e}") from e
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(text)
+
+    async def peek(self) -> str:
+        """跳过空白并返回下一个字符（文件结束时返回空串）"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self.fill() and self.eof:
+                return ""
+
+    async def expect(self, chars: str) -> str:
+        ch = await self.peek()
+        if not ch or ch not in chars:
+            raise ImportFormatError(f"Expected one of {chars!r}, got {ch or 'EOF'!r}")
+        self.pos += 1
+        return ch
+
+    async def value(self):
+        """
+        解析下一个完整的 JSON 值
+        值后面必须已读到至少一个字符（或文件结束），避免数字等被截断在块边界上
+        """
+        await self.peek()
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ImportFormatError(f"Invalid JSON: {e}") from e
+                await self.fill(len(self.buf) - self.pos)
+                continue
+            if end >= len(self.buf) and not self.eof:
+                await self.fill(len(self.buf) - self.pos)
+                continue
+            self.pos = end
+            return value
+
+    async def line(self) -> str | None:
+        """读取下一行（不含换行符），文件结束时返回 None"""
+        while True:
+            end = self.buf.find("\n", self.pos)
+            if end >= 0:
+                line = self.buf[self.pos:end]
+                self.pos = end + 1
+                return line
+            if self.eof:
+                if self.pos >= len(self.buf):
+                    return None
+                line = self.buf[self.pos:]
+                self.pos = len(self.buf)
+                return line
+            await self.fill(len(self.buf) - self.pos)
+
+
+async def _iter_json(reader: _UploadReader) -> AsyncGenerator[tuple[str, object], None]:
+    """
+    增量解析普通 JSON 导出：顶层对象逐字段读取，
+    数据数组逐元素产出，整个文档不会一次性载入内存
+    """
+    await reader.expect("{")
+    if await reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = await reader.value()
+        if not isinstance(key, str):
+            raise ImportFormatError("Object key must be a string")
+        await reader.expect(":")
+        section = _SECTIONS.get(key)
+        if section and await reader.peek() == "[":
+            reader.pos += 1
+            if await reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield section, await reader.value()
+                    if await reader.expect(",]") == "]":
+                        break
+        else:
+            yield key, await reader.value()
+        if await reader.expect(",}") == "}":
+            return
+
+
+async def _iter_ndjson(reader: _UploadReader) -> AsyncGenerator[tuple[str, object], None]:
+    """逐行解析 NDJSON 导出：{"type": ..., "data": ...}"""
+    while (line := await reader.line()) is not None:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"Invalid NDJSON line: {e}") from e
+        record_type = record.get("type") if isinstance(record, dict) else None
+        if record_type == "header":
+            yield "version", record.get("version")
+        elif record_type == "project":
+            yield "project", record.get("data")
+        elif record_type in _SECTIONS:
+            yield _SECTIONS[record_type], record.get("data")
+        else:
+            raise ImportFormatError(f"Unknown record type: {record_type!r}")
+
+
+async def iter_import_records(reader: _UploadReader) -> AsyncGenerator[tuple[str, object], None]:
+    """根据文件开头自动识别 JSON / NDJSON，产出 (分区, 记录)"""
+    while len(reader.buf) - reader.pos < 64 and not reader.eof:
+        await reader.fill()
+    records = _iter_ndjson(reader) if _NDJSON_HEAD.match(reader.buf, reader.pos) else _iter_json(reader)
+    async for item in records:
+        yield item
+    if await reader.peek():
+        raise ImportFormatError("Unexpected data after end of document")
+
+
+class _Phase:
+    def __init__(self):
+        self.records = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    def report(self) -> dict:
+        return {"records": self.records, "batches": self.batches, "elapsed_ms": round(self.elapsed * 1000, 2)}
+
+
+class ProjectImporter:
+    """
+    分批导入项目数据
+    项目行写入后本事务即持有 SQLite 写锁，角色 ID 可安全地从 max(id)+1 起预先分配
+    """
+
+    def __init__(self, db: AsyncSession, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.project: Project | None = None
+        self.warnings: list[str] = []
+        self.char_id_map: dict[int, int] = {}
+        self._next_character_id = 0
+        self._pending: dict[str, list[dict]] = {"characters": [], "relationships": [], "chapters": [], "data_tables": []}
+        self.phases = {name: _Phase() for name in ("parse", "project", *self._pending)}
+
+    async def add(self, section: str, value) -> None:
+        if section == "project":
+            await self._create_project(value)
+            return
+        if section not in self._pending:
+            return  # version 等元数据
+        if not isinstance(value, dict):
+            raise ImportFormatError(f"Invalid {section} record")
+        pending = self._pending[section]
+        pending.append(value)
+        self.phases[section].records += 1
+        # project 出现之前的记录先缓存（导出文件的键顺序不固定）；关系依赖全部角色的 ID 映射，留到最后插入
+        if self.project is not None and section != "relationships" and len(pending) >= self.batch_size:
+            await self._flush(section)
+
+    async def finish(self) -> None:
+        if self.project is None:
+            raise ImportFormatError("Missing 'project' field")
+        for section in self._pending:
+            await self._flush(section)
+
+    def report(self) -> dict:
+        return {
+            "project_id": self.project.id,
+            "warnings": self.warnings,
+            "phases": {name: phase.report() for name, phase in self.phases.items()},
+        }
+
+    async def _create_project(self, data) -> None:
+        if self.project is not None or not isinstance(data, dict):
+            raise ImportFormatError("Invalid or duplicate 'project' field")
+        started = time.perf_counter()
+        if not data.get("style"):
+            self.warnings.append("缺少写作风格(style)")
+        if not data.get("world_view"):
+            self.warnings.append("缺少世界观(world_view)")
+        self.project = Project(
+            title=data.get("title", "Imported Project"),
+            description=data.get("description"),
+            world_view=data.get("world_view"),
+            style=data.get("style"),
+        )
+        self.db.add(self.project)
+        await self.db.flush()
+        result = await self.db.execute(select(func.max(Character.id)))
+        self._next_character_id = (result.scalar() or 0) + 1
+        phase = self.phases["project"]
+        phase.records = phase.batches = 1
+        phase.elapsed += time.perf_counter() - started
+
+    async def _flush(self, section: str) -> None:
+        pending = self._pending[section]
+        if not pending:
+            return
+        started = time.perf_counter()
+        for i in range(0, len(pending), self.batch_size):
+            rows = getattr(self, f"_{section}_rows")(pending[i:i + self.batch_size])
+            if rows:
+                await self.db.execute(insert(_MODELS[section]), rows)
+            self.phases[section].batches += 1
+        pending.clear()
+        self.phases[section].elapsed += time.perf_counter() - started
+
+    def _characters_rows(self, records: list[dict]) -> list[dict]:
+        rows = []
+        for data in records:
+            new_id = self._next_character_id
+            self._next_character_id += 1
+            old_id = data.get("id")
+            if old_id:
+                self.char_id_map[old_id] = new_id
+            rows.append({
+                "id": new_id,
+                "project_id": self.project.id,
+                "name": data.get("name", "Unknown"),
+                "bio": data.get("bio"),
+                "avatar_url": data.get("avatar_url"),
+                "attributes": data.get("attributes", {}),
+                "position_x": data.get("position_x", 0),
+                "position_y": data.get("position_y", 0),
+            })
+        return rows
+
+    def _relationships_rows(self, records: list[dict]) -> list[dict]:
+        rows = []
+        for data in records:
+            source_id = self.char_id_map.get(data.get("source_id"))
+            target_id = self.char_id_map.get(data.get("target_id"))
+            if source_id and target_id:
+                rows.append({
+                    "project_id": self.project.id,
+                    "source_id": source_id,
+                    "target_id": target_id,
+                    "relation_type": data.get("relation_type", "unknown"),
+                    "description": data.get("description"),
+                })
+        return rows
+
+    def _chapters_rows(self, records: list[dict]) -> list[dict]:
+        rows = []
+        for data in records:
+            text = data.get("content", "")
+            rows.append({
+                "project_id": self.project.id,
+                "title": data.get("title", "Untitled"),
+                "content": text,
+                "content_hash": content_hash(text),
+                "word_count": count_words(text),
+                "rank": data.get("rank", 0),
+                "summary": data.get("summary"),
+                "characters_mentioned": data.get("characters_mentioned", []),
+            })
+        return rows
+
+    def _data_tables_rows(self, records: list[dict]) -> list[dict]:
+        return [
+            {"project_id": self.project.id, "table_type": data.get("table_type", 0), "rows": data.get("rows", [])}
+            for data in records
+        ]
+
+
+_MODELS = {
+    "characters": Character,
+    "relationships": Relationship,
+    "chapters": Chapter,
+    "data_tables": DataTable,
+}
+
+
+async def import_records(db: AsyncSession, records: AsyncGenerator[tuple[str, object], None]) -> ProjectImporter:
+    """消费 (分区, 记录) 流并分批写入，解析耗时单独计入 parse 阶段"""
+    importer = ProjectImporter(db, settings.import_batch_size)
+    parse = importer.phases["parse"]
+    while True:
+        parse_started = time.perf_counter()
+        try:
+            section, value = await anext(records)
+        except StopAsyncIteration:
+            parse.elapsed += time.perf_counter() - parse_started
+            break
+        parse.elapsed += time.perf_counter() - parse_started
+        parse.records += 1
+        await importer.add(section, value)
+    await importer.finish()
+    return importer
+
+
+async def import_project_file(db: AsyncSession, file) -> dict:
+    """
+    从上传文件导入项目
+    返回: 新项目 ID、警告、各阶段记录数/批次数/耗时
+    """
+    started = time.perf_counter()
+    reader = _UploadReader(file, settings.import_max_bytes, settings.import_max_record_bytes)
+    importer = await import_records(db, iter_import_records(reader))
+    return {
+        **importer.report(),
+        "bytes": reader.bytes_read,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -0,0 +1,202 @@
+"""
+模型输出的 JSON 解析
+单遍扫描、可增量输入的容错解析器：
+- 跳过 JSON 之前的 <think>...</think> 推理内容、代码块标记与说明文字，从第一个 { 开始
+- 用栈跟踪未闭合的括号，记录可截断位置（元素之间、容器开闭处）
+- 完整对象直接解码；被截断或中途格式错误时退回到错误之前的可截断位置并补全括号，保留最长的有效前缀
+每个字符只扫描一次，解码次数有固定上限（不会逐个位置反复尝试）
+"""
+
+import json
+import re
+from bisect import bisect_left
+from typing import Any
+
+# 完整的字符串（一次匹配跳过）、未在本块结束的字符串开头、或结构字符
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|["{}\[\],]', re.DOTALL)
+_STRING_SPECIAL = re.compile(r'["\\]')
+_CLOSERS = {"{": "}", "[": "]"}
+
+# strict=False: 允许字符串中出现未转义的换行等控制字符
+_decoder = json.JSONDecoder(strict=False)
+
+# 解码失败后按错误位置退回重试的最多次数
+_MAX_RETRIES = 4
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 解析器：feed() 逐块输入（如流式响应的增量文本），result() 随时取当前可解析的值
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._length = 0
+        self._text: str | None = None  # 拼接后的文本（result() 时按需生成）
+        # JSON 开始前保留的末尾文本，用于识别跨块的 <think> 标签
+        self._pending = ""
+        self._in_think = False
+        self._start: int | None = None
+        self._end: int | None = None
+        self._broken = False
+        self._stack: list[str] = []
+        self._closers = ""  # 补全未闭合括号所需的闭合字符
+        self._in_string = False
+        self._escape = False
+        # 可截断位置（递增）及对应的补全闭合括号
+        self._safe_positions: list[int] = []
+        self._safe_closers: list[str] = []
+        self._value: Any = None  # 快速路径解码出的完整值
+
+    @property
+    def started(self) -> bool:
+        return self._start is not None
+
+    @property
+    def complete(self) -> bool:
+        """是否已读到完整的顶层对象"""
+        return self._end is not None
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        offset = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        self._text = None
+        if self._end is not None or self._broken:
+            return
+        if self._start is None:
+            chunk, offset = self._find_start(chunk, offset)
+            if chunk is None:
+                return
+            # 起点所在的块已包含完整对象时（如一次性解析完整响应）直接解码
+            try:
+                self._value, end = _decoder.raw_decode(chunk)
+                self._end = offset + end
+                return
+            except json.JSONDecodeError:
+                pass
+        self._scan(chunk, offset)
+
+    def _find_start(self, chunk: str, offset: int) -> tuple[str | None, int]:
+        """跳过推理内容与说明文字，找到第一个 {；返回从 { 开始的文本及其位置"""
+        text = self._pending + chunk
+        base = offset - len(self._pending)
+        self._pending = ""
+        while True:
+            if self._in_think:
+                index = text.find(_THINK_CLOSE)
+                if index < 0:
+                    self._pending = text[-(len(_THINK_CLOSE) - 1):]
+                    return None, 0
+                text, base = text[index + len(_THINK_CLOSE):], base + index + len(_THINK_CLOSE)
+                self._in_think = False
+            brace = text.find("{")
+            think = text.find(_THINK_OPEN)
+            if think >= 0 and (brace < 0 or think < brace):
+                text, base = text[think + len(_THINK_OPEN):], base + think + len(_THINK_OPEN)
+                self._in_think = True
+                continue
+            if brace < 0:
+                self._pending = text[-(len(_THINK_OPEN) - 1):]
+                return None, 0
+            self._start = base + brace
+            return text[brace:], base + brace
+
+    def _scan(self, text: str, base: int) -> None:
+        # 热循环使用局部变量，结束时写回
+        stack, closers = self._stack, self._closers
+        safe_positions, safe_closers = self._safe_positions, self._safe_closers
+        position, length = 0, len(text)
+        try:
+            while position < length:
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                        position += 1
+                        continue
+                    match = _STRING_SPECIAL.search(text, position)
+                    if match is None:
+                        return
+                    position = match.end()
+                    if match.group() == "\\":
+                        self._escape = True
+                    else:
+                        self._in_string = False
+                    continue
+
+                match = _TOKEN.search(text, position)
+                if match is None:
+                    return
+                char, position = match.group(), match.end()
+                if char[0] == '"':
+                    # 单个引号：字符串在本块内没有结束，逐段扫描到下一块
+                    self._in_string = len(char) == 1
+                elif char == ",":
+                    safe_positions.append(base + position - 1)
+                    safe_closers.append(closers)
+                elif char in _CLOSERS:
+                    # 数组中的对象刚开始时不作为截断位置，避免恢复出空对象元素
+                    element = char == "{" and bool(stack) and stack[-1] == "["
+                    stack.append(char)
+                    closers = _CLOSERS[char] + closers
+                    if not element:
+                        safe_positions.append(base + position)
+                        safe_closers.append(closers)
+                else:
+                    if not stack or _CLOSERS[stack[-1]] != char:
+                        # 括号不匹配：之后的内容无法使用
+                        self._broken = True
+                        return
+                    stack.pop()
+                    closers = closers[1:]
+                    if not stack:
+                        self._end = base + position
+                        return
+                    safe_positions.append(base + position)
+                    safe_closers.append(closers)
+        finally:
+            self._closers = closers
+
+    def result(self) -> Any | None:
+        """
+        当前能解析出的值：完整对象，或补全括号后的最长有效前缀；没有可用内容时返回 None
+        解码失败时按错误位置退回到其前的可截断位置重试（次数有上限）
+        """
+        if self._start is None:
+            return None
+        if self._value is not None:
+            return self._value
+        if self._text is None:
+            self._text = "".join(self._chunks)
+            self._chunks = [self._text]
+        text, start = self._text, self._start
+
+        if self._end is not None:
+            candidate, limit = text[start:self._end], self._end
+        elif self._safe_positions:
+            candidate, limit = text[start:self._safe_positions[-1]] + self._safe_closers[-1], self._safe_positions[-1]
+        else:
+            return None
+        for _ in range(_MAX_RETRIES):
+            try:
+                return _decoder.decode(candidate)
+            except json.JSONDecodeError as e:
+                # 取错误位置之前最近的可截断位置
+                index = bisect_left(self._safe_positions, min(start + e.pos, limit)) - 1
+                if index < 0:
+                    return None
+                limit = self._safe_positions[index]
+                candidate = text[start:limit] + self._safe_closers[index]
+        return None
+
+
+def parse_llm_json(text: str | None) -> Any | None:
+    """解析模型返回的 JSON 对象（容忍推理内容、代码块、前后说明文字与截断），无法解析时返回 None"""
+    parser = IncrementalJSONParser()
+    parser.feed(text or "")
+    return parser.result()
@@ -0,0 +1,180 @@
+"""
+AI 响应缓存
+摘要、改写、数据提取等非流式调用的两级缓存：进程内 LRU + SQLite 表，
+相同的模型、服务地址、提示模板版本、参数与内容不再重复请求模型
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, update
+
+from config import settings
+from database import async_session
+from models.schemas import AIResponseCache
+
+logger = logging.getLogger(__name__)
+
+# 每写入多少条清理一次过期/超量的表记录
+_PRUNE_EVERY = 50
+
+
+def _utcnow() -> datetime:
+    """与 SQLite CURRENT_TIMESTAMP 一致的无时区 UTC 时间"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def make_cache_key(
+    kind: str,
+    model: str,
+    api_base: str | None,
+    template_version: int,
+    params: dict,
+    messages: list[dict],
+) -> str:
+    """缓存键: 调用类型、模型、服务地址、模板版本、参数与消息内容哈希"""
+    content = hashlib.sha256(
+        json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    material = json.dumps(
+        [kind, model, api_base or "", template_version, params, content],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    两级响应缓存
+    - 内存层: 最多 memory_entries 条，LRU 淘汰
+    - 表层: ai_response_cache，超过 ttl 秒过期，超过 max_rows 条时按最近访问时间淘汰
+    表层读写失败（如数据库被锁）只记录警告，不影响 AI 调用本身
+    """
+
+    def __init__(self, memory_entries: int, max_rows: int, ttl: int):
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        # key -> (写入时间 time.time(), 类型, 响应)
+        self._memory: OrderedDict[str, tuple[float, str, str]] = OrderedDict()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, created: float, kind: str, response: str) -> None:
+        self._memory[key] = (created, kind, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> str | None:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[0] < self.ttl:
+                self.memory_hits += 1
+                self._memory.move_to_end(key)
+                return entry[2]
+            del self._memory[key]
+
+        try:
+            async with async_session() as session:
+                row = (await session.execute(
+                    select(AIResponseCache.kind, AIResponseCache.response, AIResponseCache.created_at)
+                    .where(AIResponseCache.key == key)
+                    .where(AIResponseCache.created_at > _utcnow() - timedelta(seconds=self.ttl))
+                )).one_or_none()
+                if row is not None:
+                    await session.execute(
+                        update(AIResponseCache)
+                        .where(AIResponseCache.key == key)
+                        .values(hits=AIResponseCache.hits + 1, accessed_at=_utcnow())
+                    )
+                    await session.commit()
+        except Exception as e:
+            logger.warning("Response cache read failed: %s", e)
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        created = row.created_at.replace(tzinfo=timezone.utc).timestamp()
+        self._remember(key, created, row.kind, row.response)
+        return row.response
+
+    async def put(self, key: str, kind: str, model: str, response: str) -> None:
+        self._remember(key, time.time(), kind, response)
+        now = _utcnow()
+        try:
+            async with async_session() as session:
+                await session.merge(AIResponseCache(
+                    key=key, kind=kind, model=model, response=response,
+                    hits=0, created_at=now, accessed_at=now,
+                ))
+                self._writes += 1
+                if self._writes % _PRUNE_EVERY == 0:
+                    await self._prune(session)
+                await session.commit()
+        except Exception as e:
+            logger.warning("Response cache write failed: %s", e)
+
+    async def _prune(self, session) -> None:
+        """删除过期条目，并只保留最近访问的 max_rows 条"""
+        result = await session.execute(
+            delete(AIResponseCache)
+            .where(AIResponseCache.created_at <= _utcnow() - timedelta(seconds=self.ttl))
+        )
+        removed = result.rowcount or 0
+        total = (await session.execute(select(func.count()).select_from(AIResponseCache))).scalar_one()
+        if total > self.max_rows:
+            keep = (
+                select(AIResponseCache.key)
+                .order_by(AIResponseCache.accessed_at.desc())
+                .limit(self.max_rows)
+            )
+            result = await session.execute(
+                delete(AIResponseCache).where(AIResponseCache.key.not_in(keep))
+            )
+            removed += result.rowcount or 0
+        self.evictions += removed
+
+    async def purge(self, kind: str | None = None) -> int:
+        """清空缓存（可只清某一类型），返回删除的表记录数"""
+        if kind is None:
+            self._memory.clear()
+        else:
+            for key in [k for k, entry in self._memory.items() if entry[1] == kind]:
+                del self._memory[key]
+        async with async_session() as session:
+            stmt = delete(AIResponseCache)
+            if kind is not None:
+                stmt = stmt.where(AIResponseCache.kind == kind)
+            result = await session.execute(stmt)
+            await session.commit()
+        return result.rowcount or 0
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+response_cache = ResponseCache(
+    memory_entries=settings.ai_cache_memory_entries,
+    max_rows=settings.ai_cache_max_rows,
+    ttl=settings.ai_cache_ttl,
+)
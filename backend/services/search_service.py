@@ -0,0 +1,331 @@
+"""
+章节片段检索 (BM25)
+- 章节正文按段落切分为片段，中日韩文本按相邻二字（bigram）切词，英文/数字按单词
+- 倒排索引持久化在 SQLite（search_passages / search_postings），保存章节时按片段增量更新
+- 导入、恢复等未经保存接口写入的章节在检索前补建索引
+"""
+
+import heapq
+import logging
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import async_session
+from models.schemas import Chapter, SearchChapter, SearchPassage, SearchPosting
+from services.text_service import content_hash
+from services.token_service import split_sentences
+from services.vector_store import search_passage_vectors
+
+logger = logging.getLogger(__name__)
+
+# 片段长度（字符）：短段落合并到至少 MIN，长段落按句子拆分到不超过 MAX
+PASSAGE_MIN_CHARS = 80
+PASSAGE_MAX_CHARS = 400
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 查询最多使用的词项数（保留文档频率最低、区分度最高的词项）
+MAX_QUERY_TERMS = 64
+
+_TERM_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+|[A-Za-z0-9]+")
+_PARAGRAPH_PATTERN = re.compile(r"\n+")
+
+
+def tokenize(text: str) -> list[str]:
+    """切词：中日韩连续文字取相邻二字（单字成词），英文/数字取小写单词"""
+    terms = []
+    for run in _TERM_PATTERN.findall(text):
+        if run.isascii():
+            terms.append(run.lower()[:32])
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def split_passages(text: str) -> list[str]:
+    """按段落切分正文：短段落合并，超长段落在句子边界拆分"""
+    passages: list[str] = []
+    buffer = ""
+    for paragraph in _PARAGRAPH_PATTERN.split(text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > PASSAGE_MAX_CHARS:
+            if buffer:
+                passages.append(buffer)
+                buffer = ""
+            for sentence in split_sentences(paragraph):
+                if buffer and len(buffer) + len(sentence) > PASSAGE_MAX_CHARS:
+                    passages.append(buffer)
+                    buffer = ""
+                buffer += sentence
+            continue
+        if buffer and len(buffer) + len(paragraph) + 1 > PASSAGE_MAX_CHARS:
+            passages.append(buffer)
+            buffer = ""
+        buffer = f"{buffer}\n{paragraph}" if buffer else paragraph
+        if len(buffer) >= PASSAGE_MIN_CHARS:
+            passages.append(buffer)
+            buffer = ""
+    if buffer:
+        passages.append(buffer)
+    return passages
+
+
+async def index_chapter(db: AsyncSession, project_id: int, chapter_id: int, content: str | None, chapter_hash: str | None = None) -> dict:
+    """
+    增量更新章节索引：只删除/插入内容变化的片段，未变化的片段仅更新序号
+    返回: {"added", "removed", "kept"}
+    """
+    chapter_hash = chapter_hash or content_hash(content)
+    state = await db.get(SearchChapter, chapter_id)
+    if state is not None and state.content_hash == chapter_hash:
+        return {"added": 0, "removed": 0, "kept": 0}
+
+    existing: dict[str, list[tuple[int, int]]] = {}
+    result = await db.execute(
+        select(SearchPassage.id, SearchPassage.text_hash, SearchPassage.position)
+        .where(SearchPassage.chapter_id == chapter_id)
+    )
+    for passage_id, text_hash, position in result.all():
+        existing.setdefault(text_hash, []).append((passage_id, position))
+
+    passages = split_passages(content or "")
+    new_rows, moved = [], []
+    for position, text in enumerate(passages):
+        text_hash = content_hash(text)
+        matches = existing.get(text_hash)
+        if matches:
+            passage_id, old_position = matches.pop()
+            if old_position != position:
+                moved.append({"id": passage_id, "position": position})
+            continue
+        new_rows.append((position, text, text_hash))
+
+    removed = [passage_id for matches in existing.values() for passage_id, _ in matches]
+    if removed:
+        await db.execute(delete(SearchPosting).where(SearchPosting.passage_id.in_(removed)))
+        await db.execute(delete(SearchPassage).where(SearchPassage.id.in_(removed)))
+    if moved:
+        # 按主键批量更新
+        await db.execute(update(SearchPassage), moved)
+
+    if new_rows:
+        term_counts = [Counter(tokenize(text)) for _, text, _ in new_rows]
+        result = await db.execute(
+            insert(SearchPassage).returning(SearchPassage.id, sort_by_parameter_order=True),
+            [
+                {
+                    "project_id": project_id, "chapter_id": chapter_id, "position": position,
+                    "text": text, "text_hash": text_hash, "length": sum(counts.values()),
+                }
+                for (position, text, text_hash), counts in zip(new_rows, term_counts)
+            ],
+        )
+        postings = [
+            {"project_id": project_id, "term": term, "passage_id": passage_id, "tf": tf}
+            for passage_id, counts in zip(result.scalars().all(), term_counts)
+            for term, tf in counts.items()
+        ]
+        if postings:
+            # Core executemany，跳过 ORM 批量插入的逐行处理（倒排项数量约为片段字数）
+            await db.execute(insert(SearchPosting.__table__), postings)
+
+    if state is None:
+        db.add(SearchChapter(chapter_id=chapter_id, project_id=project_id, content_hash=chapter_hash))
+    else:
+        state.content_hash = chapter_hash
+    await db.flush()
+    return {"added": len(new_rows), "removed": len(removed), "kept": len(passages) - len(new_rows)}
+
+
+async def remove_chapter(db: AsyncSession, chapter_id: int) -> None:
+    """删除章节的全部索引"""
+    passage_ids = select(SearchPassage.id).where(SearchPassage.chapter_id == chapter_id)
+    await db.execute(delete(SearchPosting).where(SearchPosting.passage_id.in_(passage_ids)))
+    await db.execute(delete(SearchPassage).where(SearchPassage.chapter_id == chapter_id))
+    await db.execute(delete(SearchChapter).where(SearchChapter.chapter_id == chapter_id))
+
+
+async def remove_project(db: AsyncSession, project_id: int) -> None:
+    """删除项目的全部索引"""
+    await db.execute(delete(SearchPosting).where(SearchPosting.project_id == project_id))
+    await db.execute(delete(SearchPassage).where(SearchPassage.project_id == project_id))
+    await db.execute(delete(SearchChapter).where(SearchChapter.project_id == project_id))
+
+
+async def ensure_project_index(db: AsyncSession, project_id: int, limit: int | None = None) -> int:
+    """
+    补建索引：正文哈希与索引状态不一致的章节重新索引，已删除章节的索引被清除
+    limit: 本次最多处理的章节数（为空时全部处理）；返回处理的章节数
+    """
+    result = await db.execute(
+        select(Chapter.id, Chapter.content_hash, SearchChapter.content_hash)
+        .outerjoin(SearchChapter, SearchChapter.chapter_id == Chapter.id)
+        .where(Chapter.project_id == project_id)
+    )
+    stale = [chapter_id for chapter_id, current, indexed in result.all() if current != indexed]
+
+    orphans = (await db.execute(
+        select(SearchChapter.chapter_id)
+        .outerjoin(Chapter, Chapter.id == SearchChapter.chapter_id)
+        .where(SearchChapter.project_id == project_id)
+        .where(Chapter.id.is_(None))
+    )).scalars().all()
+    for chapter_id in orphans:
+        await remove_chapter(db, chapter_id)
+
+    for chapter_id in stale[:limit] if limit else stale:
+        row = (await db.execute(
+            select(Chapter.content, Chapter.content_hash).where(Chapter.id == chapter_id)
+        )).one()
+        await index_chapter(db, project_id, chapter_id, row.content, row.content_hash)
+    return len(stale[:limit] if limit else stale) + len(orphans)
+
+
+@dataclass
+class SearchHit:
+    passage_id: int
+    chapter_id: int
+    chapter_title: str
+    position: int
+    text: str
+    score: float
+
+
+async def search_passages(
+    db: AsyncSession,
+    project_id: int,
+    query: str,
+    k: int = 5,
+    exclude_chapter_ids: set[int] | None = None,
+    max_rank: int | None = None,
+) -> list[SearchHit]:
+    """
+    BM25 检索与查询文本最相关的 k 个片段
+    exclude_chapter_ids: 排除的章节；max_rank: 只返回排序小于该值的章节中的片段
+    """
+    terms = set(tokenize(query))
+    if not terms or k <= 0:
+        return []
+
+    total, avg_length = (await db.execute(
+        select(func.count(), func.avg(SearchPassage.length)).where(SearchPassage.project_id == project_id)
+    )).one()
+    if not total:
+        return []
+
+    result = await db.execute(
+        select(SearchPosting.term, func.count())
+        .where(SearchPosting.project_id == project_id)
+        .where(SearchPosting.term.in_(terms))
+        .group_by(SearchPosting.term)
+    )
+    df = dict(result.all())
+    query_terms = sorted(df, key=df.get)[:MAX_QUERY_TERMS]
+    if not query_terms:
+        return []
+    idf = {t: math.log(1 + (total - df[t] + 0.5) / (df[t] + 0.5)) for t in query_terms}
+
+    stmt = (
+        select(SearchPosting.passage_id, SearchPosting.term, SearchPosting.tf, SearchPassage.length)
+        .join(SearchPassage, SearchPassage.id == SearchPosting.passage_id)
+        .where(SearchPosting.project_id == project_id)
+        .where(SearchPosting.term.in_(query_terms))
+    )
+    if max_rank is not None:
+        stmt = stmt.where(SearchPassage.chapter_id.in_(
+            select(Chapter.id).where(Chapter.project_id == project_id).where(Chapter.rank < max_rank)
+        ))
+    if exclude_chapter_ids:
+        stmt = stmt.where(SearchPassage.chapter_id.not_in(exclude_chapter_ids))
+    result = await db.execute(stmt)
+    scores: dict[int, float] = {}
+    norm = BM25_K1 * (1 - BM25_B)
+    length_factor = BM25_K1 * BM25_B / (avg_length or 1)
+    for passage_id, term, tf, length in result.all():
+        scores[passage_id] = scores.get(passage_id, 0.0) + idf[term] * tf * (BM25_K1 + 1) / (
+            tf + norm + length_factor * length
+        )
+
+    top = heapq.nlargest(k, scores, key=scores.get)
+    return await load_hits(db, {passage_id: scores[passage_id] for passage_id in top})
+
+
+async def load_hits(
+    db: AsyncSession,
+    scores: dict[int, float],
+    exclude_chapter_ids: set[int] | None = None,
+    max_rank: int | None = None,
+) -> list[SearchHit]:
+    """按 {片段 ID: 得分} 读取片段与章节标题，按得分降序返回（可再按章节过滤）"""
+    if not scores:
+        return []
+    stmt = (
+        select(SearchPassage.id, SearchPassage.chapter_id, Chapter.title, SearchPassage.position, SearchPassage.text)
+        .join(Chapter, Chapter.id == SearchPassage.chapter_id)
+        .where(SearchPassage.id.in_(list(scores)))
+    )
+    if max_rank is not None:
+        stmt = stmt.where(Chapter.rank < max_rank)
+    if exclude_chapter_ids:
+        stmt = stmt.where(SearchPassage.chapter_id.not_in(exclude_chapter_ids))
+    result = await db.execute(stmt)
+    hits = [
+        SearchHit(row.id, row.chapter_id, row.title, row.position, row.text, scores[row.id])
+        for row in result.all()
+    ]
+    hits.sort(key=lambda hit: hit.score, reverse=True)
+    return hits
+
+
+async def retrieve_related_passages(
+    project_id: int,
+    chapter_id: int | None,
+    context: str,
+    k: int,
+) -> str:
+    """
+    续写用：以前文结尾为查询检索之前章节中的相关片段，格式化为提示文本
+    配置 semantic_recall_k 时追加关键词检索未命中的语义相似片段
+    使用独立会话并立即提交补建的索引，不占用流式响应期间的请求事务
+    """
+    query = context[-settings.retrieval_query_chars:]
+    if k <= 0 or not query.strip():
+        return ""
+    async with async_session() as session:
+        await ensure_project_index(session, project_id, limit=settings.retrieval_catchup_chapters)
+        await session.commit()
+
+        max_rank = None
+        if chapter_id:
+            max_rank = (await session.execute(
+                select(Chapter.rank).where(Chapter.id == chapter_id)
+            )).scalar_one_or_none()
+        exclude = {chapter_id} if chapter_id else None
+        hits = await search_passages(session, project_id, query, k, exclude_chapter_ids=exclude, max_rank=max_rank)
+
+        if settings.semantic_recall_k:
+            # 向量检索不能按章节过滤，多取一些候选；向量服务不可用时只用关键词检索结果
+            try:
+                scores = await search_passage_vectors(session, project_id, query, (k + settings.semantic_recall_k) * 4)
+            except Exception as e:
+                logger.warning("Semantic recall failed: %s", e)
+                scores = {}
+            seen = {hit.passage_id for hit in hits}
+            extra = await load_hits(
+                session, {passage_id: score for passage_id, score in scores.items() if passage_id not in seen and score > 0},
+                exclude_chapter_ids=exclude, max_rank=max_rank,
+            )
+            hits += extra[:settings.semantic_recall_k]
+    return "\n\n".join(f"【{hit.chapter_title}】{hit.text}" for hit in hits)
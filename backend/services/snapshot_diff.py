@@ -0,0 +1,275 @@
+"""
+快照对比服务
+在服务端比较两个快照（或快照与当前项目），按哈希跳过未改动的章节，
+以 NDJSON 逐条输出章节/段落、角色、关系、数据表行的变化
+"""
+
+import difflib
+import json
+import time
+from typing import AsyncGenerator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+
+from models.schemas import Project, Chapter, Character, Relationship, DataTable
+from services.snapshot_service import load_manifest, load_blobs, is_manifest, dump_record
+from services.text_service import content_hash
+
+# 参与比较的章节元数据字段（正文单独按哈希比较）
+CHAPTER_FIELDS = ("title", "rank", "summary", "chapter_outline", "characters_mentioned")
+CHARACTER_FIELDS = ("name", "bio", "attributes", "position_x", "position_y")
+RELATIONSHIP_FIELDS = ("source_id", "target_id", "relation_type", "description")
+PROJECT_FIELDS = ("title", "description", "world_view", "style", "outline", "perspective")
+
+
+class DiffSource:
+    """
+    对比的一侧：快照清单、旧版完整快照或当前项目
+    章节元数据与内容哈希预先加载，正文只在哈希不同时按需读取
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.project: dict = {}
+        self.chapters: dict[int, dict] = {}  # id -> 元数据 + content_hash
+        self.characters: dict[int, dict] = {}
+        self.relationships: dict[int, dict] = {}
+        self.tables: dict[int, list[str]] = {}  # table_type -> 行哈希列表
+        self._contents: dict[int, str] = {}  # 已内联的正文（旧版快照）
+        self._rows: dict[str, dict] = {}  # 已内联的数据表行
+
+    async def get_contents(self, db: AsyncSession, chapter_ids: list[int]) -> dict[int, str]:
+        return {cid: self._contents.get(cid, "") for cid in chapter_ids}
+
+    async def get_rows(self, db: AsyncSession, hashes: set[str]) -> dict[str, dict]:
+        return {h: self._rows[h] for h in hashes if h in self._rows}
+
+    def _add_inline_table(self, table_type: int, rows: list[dict]) -> None:
+        hashes = []
+        for row in rows or []:
+            h = content_hash(dump_record(row))
+            self._rows[h] = row
+            hashes.append(h)
+        self.tables[table_type] = hashes
+
+
+class ManifestSource(DiffSource):
+    """内容寻址快照清单：正文和数据表行从内容块按需读取"""
+
+    def __init__(self, label: str, manifest: dict, characters: dict[int, dict]):
+        super().__init__(label)
+        self.project = manifest.get("project", {})
+        self.chapters = {
+            ch["id"]: {**{k: ch.get(k) for k in CHAPTER_FIELDS}, "content_hash": ch["content"]}
+            for ch in manifest.get("chapters", [])
+        }
+        self.characters = characters
+        self.relationships = {r["id"]: r for r in manifest.get("relationships", [])}
+        self.tables = {dt["table_type"]: dt.get("rows", []) for dt in manifest.get("data_tables", [])}
+
+    async def get_contents(self, db: AsyncSession, chapter_ids: list[int]) -> dict[int, str]:
+        hashes = {cid: self.chapters[cid]["content_hash"] for cid in chapter_ids}
+        blobs = await load_blobs(db, hashes.values())
+        return {cid: blobs[h] for cid, h in hashes.items()}
+
+    async def get_rows(self, db: AsyncSession, hashes: set[str]) -> dict[str, dict]:
+        blobs = await load_blobs(db, hashes)
+        return {h: json.loads(data) for h, data in blobs.items()}
+
+
+class CurrentSource(DiffSource):
+    """当前项目：正文从章节表按需读取"""
+
+    async def get_contents(self, db: AsyncSession, chapter_ids: list[int]) -> dict[int, str]:
+        result = await db.execute(select(Chapter.id, Chapter.content).where(Chapter.id.in_(chapter_ids)))
+        return {row.id: row.content or "" for row in result.all()}
+
+
+async def load_snapshot_source(db: AsyncSession, snapshot_id: int, label: str) -> DiffSource:
+    """加载快照一侧（只读取清单和角色记录，不读取正文）"""
+    manifest = await load_manifest(db, snapshot_id)
+    if is_manifest(manifest):
+        blobs = await load_blobs(db, manifest.get("characters", []))
+        characters = {}
+        for h in manifest.get("characters", []):
+            record = json.loads(blobs[h])
+            characters[record.get("id")] = record
+        return ManifestSource(label, manifest, characters)
+
+    # 旧版快照：数据全部内联
+    source = DiffSource(label)
+    source.project = manifest.get("project", {})
+    for ch in manifest.get("chapters", []):
+        source.chapters[ch.get("id")] = {
+            **{k: ch.get(k) for k in CHAPTER_FIELDS},
+            "content_hash": content_hash(ch.get("content")),
+        }
+        source._contents[ch.get("id")] = ch.get("content") or ""
+    source.characters = {c.get("id"): c for c in manifest.get("characters", [])}
+    source.relationships = {r.get("id"): r for r in manifest.get("relationships", [])}
+    for dt in manifest.get("data_tables", []):
+        source._add_inline_table(dt.get("table_type"), dt.get("rows", []))
+    return source
+
+
+async def load_current_source(db: AsyncSession, project_id: int) -> DiffSource:
+    """加载当前项目一侧（章节只读取元数据和内容哈希）"""
+    source = CurrentSource("current")
+    result = await db.execute(select(Project).where(Project.id == project_id))
+    project = result.scalar_one()
+    source.project = {field: getattr(project, field) for field in PROJECT_FIELDS}
+
+    result = await db.execute(
+        select(Chapter).options(defer(Chapter.content)).where(Chapter.project_id == project_id)
+    )
+    missing_hash = []
+    for ch in result.scalars().all():
+        source.chapters[ch.id] = {
+            **{k: getattr(ch, k) for k in CHAPTER_FIELDS},
+            "content_hash": ch.content_hash,
+        }
+        if not ch.content_hash:
+            missing_hash.append(ch.id)
+    if missing_hash:
+        contents = await source.get_contents(db, missing_hash)
+        for cid, text in contents.items():
+            source.chapters[cid]["content_hash"] = content_hash(text)
+
+    result = await db.execute(select(Character).where(Character.project_id == project_id))
+    source.characters = {
+        c.id: {"id": c.id, **{k: getattr(c, k) for k in CHARACTER_FIELDS}}
+        for c in result.scalars().all()
+    }
+    result = await db.execute(select(Relationship).where(Relationship.project_id == project_id))
+    source.relationships = {
+        r.id: {"id": r.id, **{k: getattr(r, k) for k in RELATIONSHIP_FIELDS}}
+        for r in result.scalars().all()
+    }
+    result = await db.execute(select(DataTable).where(DataTable.project_id == project_id))
+    for dt in result.scalars().all():
+        source._add_inline_table(dt.table_type, dt.rows)
+    return source
+
+
+def _field_changes(old: dict, new: dict, fields: tuple[str, ...]) -> dict:
+    """字段级变化: { field: [旧值, 新值] }"""
+    return {f: [old.get(f), new.get(f)] for f in fields if old.get(f) != new.get(f)}
+
+
+def diff_paragraphs(old_text: str, new_text: str) -> list[dict]:
+    """段落级差异（按换行分段）"""
+    old_paragraphs = old_text.split("\n")
+    new_paragraphs = new_text.split("\n")
+    matcher = difflib.SequenceMatcher(None, old_paragraphs, new_paragraphs, autojunk=False)
+    return [
+        {
+            "op": tag,
+            "old_start": i1,
+            "old_end": i2,
+            "new_start": j1,
+            "new_end": j2,
+            "old": old_paragraphs[i1:i2],
+            "new": new_paragraphs[j1:j2],
+        }
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+async def stream_diff(db: AsyncSession, old: DiffSource, new: DiffSource) -> AsyncGenerator[str, None]:
+    """
+    逐条输出 NDJSON 差异记录
+    type: header / project / chapter / character / relationship / data_table / end
+    """
+    started = time.perf_counter()
+    stats = {"chapters_compared": 0, "chapters_skipped": 0, "changes": 0}
+    yield _line({"type": "header", "from": old.label, "to": new.label})
+
+    project_changes = _field_changes(old.project, new.project, PROJECT_FIELDS)
+    if project_changes:
+        stats["changes"] += 1
+        yield _line({"type": "project", "changes": project_changes})
+
+    # 章节：哈希相同的正文直接跳过，只读取改动章节的正文
+    changed_ids = []
+    for cid in sorted(old.chapters.keys() | new.chapters.keys(), key=lambda x: (x is None, x)):
+        before, after = old.chapters.get(cid), new.chapters.get(cid)
+        if before is None:
+            stats["changes"] += 1
+            yield _line({"type": "chapter", "status": "added", "id": cid, "title": after.get("title")})
+            continue
+        if after is None:
+            stats["changes"] += 1
+            yield _line({"type": "chapter", "status": "removed", "id": cid, "title": before.get("title")})
+            continue
+        if before["content_hash"] == after["content_hash"]:
+            stats["chapters_skipped"] += 1
+            meta = _field_changes(before, after, CHAPTER_FIELDS)
+            if meta:
+                stats["changes"] += 1
+                yield _line({"type": "chapter", "status": "modified", "id": cid, "title": after.get("title"), "changes": meta})
+            continue
+        changed_ids.append(cid)
+
+    for cid in changed_ids:
+        stats["chapters_compared"] += 1
+        stats["changes"] += 1
+        before_text = (await old.get_contents(db, [cid]))[cid]
+        after_text = (await new.get_contents(db, [cid]))[cid]
+        yield _line({
+            "type": "chapter",
+            "status": "modified",
+            "id": cid,
+            "title": new.chapters[cid].get("title"),
+            "changes": _field_changes(old.chapters[cid], new.chapters[cid], CHAPTER_FIELDS),
+            "paragraphs": diff_paragraphs(before_text, after_text),
+        })
+
+    # 角色与关系：按 ID 对比字段
+    for kind, before_map, after_map, fields in (
+        ("character", old.characters, new.characters, CHARACTER_FIELDS),
+        ("relationship", old.relationships, new.relationships, RELATIONSHIP_FIELDS),
+    ):
+        for item_id in sorted(before_map.keys() | after_map.keys(), key=lambda x: (x is None, x)):
+            before, after = before_map.get(item_id), after_map.get(item_id)
+            if before is None:
+                record = {"type": kind, "status": "added", "id": item_id, "record": after}
+            elif after is None:
+                record = {"type": kind, "status": "removed", "id": item_id, "record": before}
+            else:
+                changes = _field_changes(before, after, fields)
+                if not changes:
+                    continue
+                record = {"type": kind, "status": "modified", "id": item_id, "changes": changes}
+            stats["changes"] += 1
+            yield _line(record)
+
+    # 数据表：按行哈希比较，只读取变化的行
+    for table_type in sorted(old.tables.keys() | new.tables.keys()):
+        before_rows = old.tables.get(table_type, [])
+        after_rows = new.tables.get(table_type, [])
+        removed = set(before_rows) - set(after_rows)
+        added = set(after_rows) - set(before_rows)
+        if not removed and not added:
+            continue
+        removed_rows = await old.get_rows(db, removed)
+        added_rows = await new.get_rows(db, added)
+        stats["changes"] += 1
+        yield _line({
+            "type": "data_table",
+            "table_type": table_type,
+            "removed": [removed_rows[h] for h in before_rows if h in removed and h in removed_rows],
+            "added": [added_rows[h] for h in after_rows if h in added and h in added_rows],
+        })
+
+    yield _line({
+        "type": "end",
+        "stats": stats,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
@@ -0,0 +1,291 @@
+"""
+快照恢复服务
+与当前项目按 ID 和内容哈希比较，只重写有差异的行；
+增删改均使用批量语句 (executemany)，尽量保留原 ID
+"""
+
+import time
+
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+
+from models.schemas import Project, Chapter, Character, Relationship, DataTable
+from services.snapshot_diff import (
+    load_snapshot_source, DiffSource, CHAPTER_FIELDS, CHARACTER_FIELDS, RELATIONSHIP_FIELDS, PROJECT_FIELDS,
+)
+from services.snapshot_service import dump_record, chunked
+from services.text_service import content_hash, count_words
+
+
+class _PhaseTimer:
+    """记录各阶段耗时（毫秒）"""
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._last = self._started
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.timings[phase] = round((now - self._last) * 1000, 2)
+        self._last = now
+
+    def total(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+
+async def _used_ids(db: AsyncSession, model, ids: list[int]) -> set[int]:
+    """查询已被占用的 ID（可能属于其他项目）"""
+    used = set()
+    for chunk in chunked([i for i in ids if i is not None]):
+        result = await db.execute(select(model.id).where(model.id.in_(chunk)))
+        used.update(result.scalars().all())
+    return used
+
+
+async def _allocate_ids(db: AsyncSession, model, wanted: list[int]) -> dict[int, int]:
+    """
+    为待插入的行分配 ID：原 ID 空闲则保留，否则在当前最大 ID 之后顺序分配
+    调用前本事务应已持有写锁，避免并发插入冲突
+    返回: 原 ID -> 新 ID
+    """
+    used = await _used_ids(db, model, wanted)
+    result = await db.execute(select(func.max(model.id)))
+    next_id = max([result.scalar() or 0] + [i for i in wanted if i is not None]) + 1
+    mapping = {}
+    for old_id in wanted:
+        if old_id is not None and old_id not in used:
+            mapping[old_id] = old_id
+            used.add(old_id)
+        else:
+            mapping[old_id] = next_id
+            next_id += 1
+    return mapping
+
+
+async def _bulk_delete(db: AsyncSession, model, ids: list[int]) -> None:
+    for chunk in chunked(ids):
+        await db.execute(delete(model).where(model.id.in_(chunk)))
+
+
+async def _bulk_update(db: AsyncSession, model, rows: list[dict]) -> None:
+    if rows:
+        await db.execute(update(model), rows)
+
+
+async def _bulk_insert(db: AsyncSession, model, rows: list[dict]) -> None:
+    if rows:
+        await db.execute(insert(model), rows)
+
+
+async def _restore_project(db: AsyncSession, project: Project, source: DiffSource) -> bool:
+    """恢复项目基本信息，返回是否有改动"""
+    changed = False
+    for field in PROJECT_FIELDS:
+        value = source.project.get(field)
+        if field == "title" and not value:
+            continue
+        if getattr(project, field) != value:
+            setattr(project, field, value)
+            changed = True
+    if changed:
+        await db.flush()
+    return changed
+
+
+def _chapter_values(meta: dict) -> dict:
+    values = {f: meta.get(f) for f in CHAPTER_FIELDS}
+    values["title"] = values["title"] or ""
+    values["rank"] = values["rank"] or 0
+    return values
+
+
+async def _restore_chapters(db: AsyncSession, project_id: int, source: DiffSource) -> dict:
+    result = await db.execute(
+        select(Chapter).options(defer(Chapter.content)).where(Chapter.project_id == project_id)
+    )
+    current = {ch.id: ch for ch in result.scalars().all()}
+
+    to_delete = [cid for cid in current if cid not in source.chapters]
+    to_update, to_insert, unchanged = [], [], 0
+    for cid, meta in source.chapters.items():
+        existing = current.get(cid)
+        if existing is None:
+            to_insert.append(cid)
+            continue
+        content_changed = (existing.content_hash or "") != meta["content_hash"]
+        meta_changed = any(getattr(existing, f) != meta.get(f) for f in CHAPTER_FIELDS)
+        if content_changed or meta_changed:
+            to_update.append((cid, content_changed))
+        else:
+            unchanged += 1
+
+    # 只读取正文变化的章节
+    need_content = [cid for cid, content_changed in to_update if content_changed] + to_insert
+    contents = await source.get_contents(db, need_content) if need_content else {}
+
+    await _bulk_delete(db, Chapter, to_delete)
+
+    update_rows = []
+    for cid, content_changed in to_update:
+        row = {"id": cid, **_chapter_values(source.chapters[cid])}
+        if content_changed:
+            text = contents.get(cid, "")
+            row.update(content=text, content_hash=content_hash(text), word_count=count_words(text))
+        update_rows.append(row)
+    await _bulk_update(db, Chapter, update_rows)
+
+    id_map = await _allocate_ids(db, Chapter, to_insert) if to_insert else {}
+    insert_rows = []
+    for cid in to_insert:
+        text = contents.get(cid, "")
+        insert_rows.append({
+            "id": id_map[cid],
+            "project_id": project_id,
+            **_chapter_values(source.chapters[cid]),
+            "content": text,
+            "content_hash": content_hash(text),
+            "word_count": count_words(text),
+        })
+    await _bulk_insert(db, Chapter, insert_rows)
+
+    return {"inserted": len(insert_rows), "updated": len(update_rows), "deleted": len(to_delete), "unchanged": unchanged}
+
+
+async def _restore_characters(db: AsyncSession, project_id: int, source: DiffSource) -> tuple[dict, dict[int, int]]:
+    """恢复角色，返回 (统计, 快照角色 ID -> 当前角色 ID)"""
+    result = await db.execute(select(Character).where(Character.project_id == project_id))
+    current = {c.id: c for c in result.scalars().all()}
+
+    to_delete = [cid for cid in current if cid not in source.characters]
+    to_update, to_insert, unchanged = [], [], 0
+    for cid, record in source.characters.items():
+        existing = current.get(cid)
+        if existing is None:
+            to_insert.append(cid)
+        elif any(getattr(existing, f) != record.get(f) for f in CHARACTER_FIELDS):
+            to_update.append({"id": cid, **{f: record.get(f) for f in CHARACTER_FIELDS}})
+        else:
+            unchanged += 1
+
+    await _bulk_delete(db, Character, to_delete)
+    await _bulk_update(db, Character, to_update)
+
+    id_map = {cid: cid for cid in current if cid in source.characters}
+    if to_insert:
+        id_map.update(await _allocate_ids(db, Character, to_insert))
+    await _bulk_insert(db, Character, [
+        {
+            "id": id_map[cid],
+            "project_id": project_id,
+            "name": source.characters[cid].get("name") or "",
+            "bio": source.characters[cid].get("bio"),
+            "attributes": source.characters[cid].get("attributes") or {},
+            "position_x": source.characters[cid].get("position_x") or 0,
+            "position_y": source.characters[cid].get("position_y") or 0,
+        }
+        for cid in to_insert
+    ])
+
+    stats = {"inserted": len(to_insert), "updated": len(to_update), "deleted": len(to_delete), "unchanged": unchanged}
+    return stats, id_map
+
+
+async def _restore_relationships(db: AsyncSession, project_id: int, source: DiffSource, character_map: dict[int, int]) -> dict:
+    # 角色删除可能已级联删除部分关系，此处重新读取
+    result = await db.execute(select(Relationship).where(Relationship.project_id == project_id))
+    current = {r.id: r for r in result.scalars().all()}
+
+    wanted = {}
+    for rid, record in source.relationships.items():
+        source_id = character_map.get(record.get("source_id"))
+        target_id = character_map.get(record.get("target_id"))
+        if source_id and target_id:
+            wanted[rid] = {**{f: record.get(f) for f in RELATIONSHIP_FIELDS}, "source_id": source_id, "target_id": target_id}
+
+    to_delete = [rid for rid in current if rid not in wanted]
+    to_update, to_insert, unchanged = [], [], 0
+    for rid, values in wanted.items():
+        existing = current.get(rid)
+        if existing is None:
+            to_insert.append(rid)
+        elif any(getattr(existing, f) != values.get(f) for f in RELATIONSHIP_FIELDS):
+            to_update.append({"id": rid, **values})
+        else:
+            unchanged += 1
+
+    await _bulk_delete(db, Relationship, to_delete)
+    await _bulk_update(db, Relationship, to_update)
+    id_map = await _allocate_ids(db, Relationship, to_insert) if to_insert else {}
+    await _bulk_insert(db, Relationship, [
+        {"id": id_map[rid], "project_id": project_id, **{**wanted[rid], "relation_type": wanted[rid].get("relation_type") or ""}}
+        for rid in to_insert
+    ])
+    return {"inserted": len(to_insert), "updated": len(to_update), "deleted": len(to_delete), "unchanged": unchanged}
+
+
+async def _restore_data_tables(db: AsyncSession, project_id: int, source: DiffSource) -> dict:
+    result = await db.execute(select(DataTable).where(DataTable.project_id == project_id))
+    current: dict[int, DataTable] = {}
+    to_delete = []
+    for table in result.scalars().all():
+        # 同类型的重复表只保留一个
+        if table.table_type in current or table.table_type not in source.tables:
+            to_delete.append(table.id)
+        else:
+            current[table.table_type] = table
+
+    changed_types, unchanged = [], 0
+    for table_type, row_hashes in source.tables.items():
+        existing = current.get(table_type)
+        if existing is not None:
+            existing_hashes = [content_hash(dump_record(row)) for row in (existing.rows or [])]
+            if existing_hashes == row_hashes:
+                unchanged += 1
+                continue
+        changed_types.append(table_type)
+
+    rows = await source.get_rows(db, {h for t in changed_types for h in source.tables[t]})
+    to_update, to_insert = [], []
+    for table_type in changed_types:
+        table_rows = [rows[h] for h in source.tables[table_type] if h in rows]
+        if table_type in current:
+            to_update.append({"id": current[table_type].id, "rows": table_rows})
+        else:
+            to_insert.append({"project_id": project_id, "table_type": table_type, "rows": table_rows})
+
+    await _bulk_delete(db, DataTable, to_delete)
+    await _bulk_update(db, DataTable, to_update)
+    await _bulk_insert(db, DataTable, to_insert)
+    return {"inserted": len(to_insert), "updated": len(to_update), "deleted": len(to_delete), "unchanged": unchanged}
+
+
+async def restore_project_snapshot(db: AsyncSession, project: Project, snapshot_id: int) -> dict:
+    """
+    将项目恢复到快照状态
+    返回: 各类数据的增删改统计与各阶段耗时
+    """
+    timer = _PhaseTimer()
+    source = await load_snapshot_source(db, snapshot_id, f"snapshot:{snapshot_id}")
+    timer.mark("load")
+
+    project_changed = await _restore_project(db, project, source)
+    timer.mark("project")
+    chapters = await _restore_chapters(db, project.id, source)
+    timer.mark("chapters")
+    characters, character_map = await _restore_characters(db, project.id, source)
+    timer.mark("characters")
+    relationships = await _restore_relationships(db, project.id, source, character_map)
+    timer.mark("relationships")
+    data_tables = await _restore_data_tables(db, project.id, source)
+    timer.mark("data_tables")
+
+    return {
+        "project_changed": project_changed,
+        "chapters": chapters,
+        "characters": characters,
+        "relationships": relationships,
+        "data_tables": data_tables,
+        "timings_ms": {**timer.timings, "total": timer.total()},
+    }
@@ -0,0 +1,427 @@
+"""
+快照服务 - 内容寻址的快照存储
+章节正文、角色记录、数据表行按内容哈希存入 snapshot_blobs，多个快照共享；
+每个快照只保存引用这些内容块的清单。清单与内容块均压缩存储
+"""
+
+import json
+import zlib
+from typing import Iterable
+
+from fastapi import HTTPException
+from sqlalchemy import select, delete, false, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+
+from models.schemas import Project, Chapter, Character, Relationship, DataTable, Snapshot, SnapshotBlob, SnapshotBlobRef
+from services.text_service import content_hash
+
+# 快照清单格式版本（无 format 字段的旧快照保存的是完整数据）
+MANIFEST_FORMAT = 2
+
+# 单条 IN 查询的最大参数数量
+_IN_CHUNK_SIZE = 500
+
+# 压缩格式（存储数据的首字节）
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+_ZLIB_LEVEL = 6
+
+
+def chunked(items: list, size: int = _IN_CHUNK_SIZE) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def compress_payload(raw: bytes) -> bytes:
+    """压缩数据并加上格式字节；压缩无收益时原样存储"""
+    compressed = zlib.compress(raw, _ZLIB_LEVEL)
+    if len(compressed) < len(raw):
+        return bytes([CODEC_ZLIB]) + compressed
+    return bytes([CODEC_RAW]) + raw
+
+
+def decompress_payload(stored: bytes | str) -> bytes:
+    """按格式字节解压数据"""
+    if isinstance(stored, str):
+        # 未压缩的旧数据
+        return stored.encode("utf-8")
+    codec, body = stored[0], stored[1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_RAW:
+        return bytes(body)
+    raise ValueError(f"Unknown snapshot codec: {codec}")
+
+
+def encode_manifest(manifest: dict) -> tuple[bytes, int]:
+    """序列化并压缩快照清单，返回 (存储数据, 原始字节数)"""
+    raw = json.dumps(manifest, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return compress_payload(raw), len(raw)
+
+
+def decode_manifest(payload: bytes) -> dict:
+    """解压并解析快照清单"""
+    return json.loads(decompress_payload(payload))
+
+
+def dump_record(record) -> str:
+    """规范化 JSON 序列化，保证相同内容得到相同哈希"""
+    return json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+async def _existing_blob_hashes(db: AsyncSession, hashes: list[str]) -> set[str]:
+    """查询已存在的内容块"""
+    existing = set()
+    for chunk in chunked(hashes):
+        result = await db.execute(select(SnapshotBlob.hash).where(SnapshotBlob.hash.in_(chunk)))
+        existing.update(result.scalars().all())
+    return existing
+
+
+async def load_blobs(db: AsyncSession, hashes: Iterable[str]) -> dict[str, str]:
+    """批量读取内容块；缺少任何一块时报错（不能当作空内容，否则恢复时会清空章节）"""
+    unique = list(set(hashes))
+    blobs = {}
+    for chunk in chunked(unique):
+        result = await db.execute(select(SnapshotBlob.hash, SnapshotBlob.data).where(SnapshotBlob.hash.in_(chunk)))
+        blobs.update({row.hash: decompress_payload(row.data).decode("utf-8") for row in result.all()})
+    if len(blobs) < len(unique):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Snapshot data is incomplete: {len(unique) - len(blobs)} content block(s) missing",
+        )
+    return blobs
+
+
+async def _acquire_write_lock(db: AsyncSession) -> None:
+    """
+    让本事务立即持有 SQLite 写锁（相当于 BEGIN IMMEDIATE）
+    pysqlite 在第一条写语句前才开启事务，执行一条不影响任何行的 DELETE 即可
+    """
+    await db.execute(delete(SnapshotBlobRef).where(false()))
+
+
+async def _store_blobs(db: AsyncSession, blobs: dict[str, str]) -> int:
+    """写入内容块（已存在的跳过），返回写入的压缩字节数"""
+    values = []
+    for h, text in blobs.items():
+        raw = text.encode("utf-8")
+        stored = compress_payload(raw)
+        values.append({"hash": h, "data": stored, "size": len(raw), "stored_size": len(stored)})
+    for chunk in chunked(values):
+        await db.execute(sqlite_insert(SnapshotBlob).values(chunk).on_conflict_do_nothing())
+    return sum(v["stored_size"] for v in values)
+
+
+async def _blob_raw_size(db: AsyncSession, hashes: Iterable[str]) -> int:
+    """内容块原始大小之和"""
+    total = 0
+    for chunk in chunked(list(hashes)):
+        result = await db.execute(select(func.sum(SnapshotBlob.size)).where(SnapshotBlob.hash.in_(chunk)))
+        total += result.scalar() or 0
+    return total
+
+
+async def capture_project_snapshot(db: AsyncSession, project_id: int) -> tuple[dict, set[str], int]:
+    """
+    捕获项目快照清单，并写入新增的内容块
+    返回: (清单, 清单引用的内容块哈希集合, 新写入内容块的压缩字节数)
+    只有快照中尚不存在的章节正文会被读取和写入
+    """
+    # 获取项目
+    result = await db.execute(select(Project).where(Project.id == project_id))
+    project = result.scalar_one_or_none()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    # 获取章节（不加载正文，使用已存储的内容哈希）
+    chapters_result = await db.execute(
+        select(Chapter)
+        .options(defer(Chapter.content))
+        .where(Chapter.project_id == project_id)
+        .order_by(Chapter.rank)
+    )
+    chapters = chapters_result.scalars().all()
+
+    # 获取角色
+    characters_result = await db.execute(
+        select(Character).where(Character.project_id == project_id)
+    )
+    characters = characters_result.scalars().all()
+
+    # 获取关系
+    relationships_result = await db.execute(
+        select(Relationship).where(Relationship.project_id == project_id)
+    )
+    relationships = relationships_result.scalars().all()
+
+    # 获取数据表
+    data_tables_result = await db.execute(
+        select(DataTable).where(DataTable.project_id == project_id)
+    )
+    data_tables = data_tables_result.scalars().all()
+
+    # 小型记录直接序列化并计算哈希
+    record_blobs: dict[str, str] = {}
+
+    def add_record(record) -> str:
+        data = dump_record(record)
+        h = content_hash(data)
+        record_blobs[h] = data
+        return h
+
+    character_hashes = [
+        add_record({
+            "id": c.id,
+            "name": c.name,
+            "bio": c.bio,
+            "attributes": c.attributes,
+            "position_x": c.position_x,
+            "position_y": c.position_y,
+        })
+        for c in characters
+    ]
+
+    table_entries = [
+        {
+            "id": dt.id,
+            "table_type": dt.table_type,
+            "rows": [add_record(row) for row in (dt.rows or [])],
+        }
+        for dt in data_tables
+    ]
+
+    # 章节正文按内容哈希引用；缺少哈希的旧数据需要读取正文计算
+    chapter_hashes = {}
+    missing_hash_ids = [ch.id for ch in chapters if not ch.content_hash]
+    for chunk in chunked(missing_hash_ids):
+        result = await db.execute(select(Chapter.id, Chapter.content).where(Chapter.id.in_(chunk)))
+        for row in result.all():
+            chapter_hashes[row.id] = content_hash(row.content)
+    for ch in chapters:
+        chapter_hashes.setdefault(ch.id, ch.content_hash)
+
+    # 检查已有内容块到写入引用之间持有写锁：并发删除快照时回收的内容块不会在这期间被删除
+    await _acquire_write_lock(db)
+
+    # 只读取并写入尚未存储的章节正文
+    existing = await _existing_blob_hashes(db, list(set(chapter_hashes.values())))
+    new_chapter_ids = []
+    seen = set(existing)
+    for ch in chapters:
+        h = chapter_hashes[ch.id]
+        if h not in seen:
+            seen.add(h)
+            new_chapter_ids.append(ch.id)
+
+    chapter_blobs = {}
+    for chunk in chunked(new_chapter_ids):
+        result = await db.execute(select(Chapter.id, Chapter.content).where(Chapter.id.in_(chunk)))
+        for row in result.all():
+            chapter_blobs[chapter_hashes[row.id]] = row.content or ""
+
+    new_bytes = await _store_blobs(db, chapter_blobs)
+    existing_records = await _existing_blob_hashes(db, list(record_blobs))
+    new_bytes += await _store_blobs(db, {h: d for h, d in record_blobs.items() if h not in existing_records})
+
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "project": {
+            "title": project.title,
+            "description": project.description,
+            "world_view": project.world_view,
+            "style": project.style,
+            "outline": project.outline,
+            "perspective": project.perspective,
+        },
+        "chapters": [
+            {
+                "id": ch.id,
+                "title": ch.title,
+                "content": chapter_hashes[ch.id],
+                "rank": ch.rank,
+                "word_count": ch.word_count,
+                "summary": ch.summary,
+                "chapter_outline": ch.chapter_outline,
+                "characters_mentioned": ch.characters_mentioned,
+            }
+            for ch in chapters
+        ],
+        "characters": character_hashes,
+        "relationships": [
+            {
+                "id": r.id,
+                "source_id": r.source_id,
+                "target_id": r.target_id,
+                "relation_type": r.relation_type,
+                "description": r.description,
+            }
+            for r in relationships
+        ],
+        "data_tables": table_entries,
+    }
+    refs = set(chapter_hashes.values()) | set(record_blobs)
+    return manifest, refs, new_bytes
+
+
+async def create_snapshot_record(
+    db: AsyncSession,
+    project_id: int,
+    name: str,
+    description: str | None = None,
+    snapshot_type: str = "manual",
+) -> Snapshot:
+    """捕获项目快照并保存快照记录与内容块引用"""
+    manifest, refs, new_bytes = await capture_project_snapshot(db, project_id)
+    payload, manifest_size = encode_manifest(manifest)
+    snapshot = Snapshot(
+        project_id=project_id,
+        name=name,
+        description=description,
+        snapshot_type=snapshot_type,
+        payload=payload,
+        raw_size=manifest_size + await _blob_raw_size(db, refs),
+        stored_size=len(payload) + new_bytes,
+    )
+    db.add(snapshot)
+    await db.flush()
+
+    ref_values = [{"snapshot_id": snapshot.id, "blob_hash": h} for h in refs]
+    for chunk in chunked(ref_values):
+        await db.execute(sqlite_insert(SnapshotBlobRef).values(chunk).on_conflict_do_nothing())
+    return snapshot
+
+
+def manifest_blob_hashes(manifest: dict) -> set[str]:
+    """清单引用的所有内容块哈希"""
+    hashes = {ch["content"] for ch in manifest.get("chapters", [])}
+    hashes.update(manifest.get("characters", []))
+    for dt in manifest.get("data_tables", []):
+        hashes.update(dt.get("rows", []))
+    return hashes
+
+
+async def load_manifest(db: AsyncSession, snapshot_id: int) -> dict:
+    """读取并解压快照清单（旧版快照返回完整数据）"""
+    result = await db.execute(
+        select(Snapshot.payload, Snapshot.legacy_data).where(Snapshot.id == snapshot_id)
+    )
+    row = result.one()
+    if row.payload is not None:
+        return decode_manifest(row.payload)
+    return row.legacy_data or {}
+
+
+def is_manifest(data: dict) -> bool:
+    """是否为内容寻址清单（否则为旧版完整数据）"""
+    return data.get("format") == MANIFEST_FORMAT
+
+
+async def load_snapshot_data(db: AsyncSession, snapshot: Snapshot) -> dict:
+    """
+    将快照清单还原为完整数据
+    返回格式与旧版快照一致: { project, chapters, characters, relationships, data_tables }
+    """
+    manifest = await load_manifest(db, snapshot.id)
+    if not is_manifest(manifest):
+        # 旧版快照直接保存完整数据
+        return manifest
+
+    blobs = await load_blobs(db, manifest_blob_hashes(manifest))
+    return {
+        "project": manifest.get("project", {}),
+        "chapters": [
+            {**ch, "content": blobs[ch["content"]]}
+            for ch in manifest.get("chapters", [])
+        ],
+        "characters": [
+            json.loads(blobs[h]) for h in manifest.get("characters", [])
+        ],
+        "relationships": manifest.get("relationships", []),
+        "data_tables": [
+            {
+                "id": dt.get("id"),
+                "table_type": dt.get("table_type"),
+                "rows": [json.loads(blobs[h]) for h in dt.get("rows", [])],
+            }
+            for dt in manifest.get("data_tables", [])
+        ],
+    }
+
+
+async def collect_orphan_blobs(db: AsyncSession, candidates: Iterable[str] | None = None) -> int:
+    """
+    回收不再被任何快照引用的内容块
+    candidates: 只检查这些哈希；为 None 时检查全部内容块
+    返回: 删除的内容块数量
+    """
+    unreferenced = ~SnapshotBlob.hash.in_(select(SnapshotBlobRef.blob_hash))
+    if candidates is None:
+        result = await db.execute(delete(SnapshotBlob).where(unreferenced))
+        return result.rowcount or 0
+
+    removed = 0
+    for chunk in chunked(list(candidates)):
+        result = await db.execute(
+            delete(SnapshotBlob).where(SnapshotBlob.hash.in_(chunk)).where(unreferenced)
+        )
+        removed += result.rowcount or 0
+    return removed
+
+
+async def delete_snapshot_record(db: AsyncSession, snapshot: Snapshot) -> int:
+    """删除快照及其引用，并回收无引用的内容块；返回回收的内容块数量"""
+    result = await db.execute(
+        select(SnapshotBlobRef.blob_hash).where(SnapshotBlobRef.snapshot_id == snapshot.id)
+    )
+    hashes = result.scalars().all()
+    await db.execute(delete(SnapshotBlobRef).where(SnapshotBlobRef.snapshot_id == snapshot.id))
+    await db.delete(snapshot)
+    await db.flush()
+    return await collect_orphan_blobs(db, hashes)
+
+
+async def delete_project_snapshots(db: AsyncSession, project_id: int) -> int:
+    """删除项目的全部快照并回收无引用的内容块；返回回收的内容块数量"""
+    snapshot_ids = select(Snapshot.id).where(Snapshot.project_id == project_id)
+    await db.execute(delete(SnapshotBlobRef).where(SnapshotBlobRef.snapshot_id.in_(snapshot_ids)))
+    await db.execute(delete(Snapshot).where(Snapshot.project_id == project_id))
+    return await collect_orphan_blobs(db)
+
+
+async def get_project_storage(db: AsyncSession, project_id: int) -> dict:
+    """
+    统计项目快照的存储占用（不读取快照数据）
+    total_stored: 清单 + 项目快照引用的去重内容块的实际占用
+    """
+    result = await db.execute(
+        select(Snapshot.id, Snapshot.name, Snapshot.raw_size, Snapshot.stored_size, func.length(Snapshot.payload))
+        .where(Snapshot.project_id == project_id)
+        .order_by(Snapshot.created_at.desc())
+    )
+    rows = result.all()
+
+    blob_hashes = (
+        select(SnapshotBlobRef.blob_hash)
+        .join(Snapshot, Snapshot.id == SnapshotBlobRef.snapshot_id)
+        .where(Snapshot.project_id == project_id)
+        .distinct()
+    )
+    blob_result = await db.execute(
+        select(func.count(), func.sum(SnapshotBlob.stored_size))
+        .where(SnapshotBlob.hash.in_(blob_hashes))
+    )
+    blob_count, blob_stored = blob_result.one()
+
+    return {
+        "project_id": project_id,
+        "snapshots": [
+            {"id": row[0], "name": row[1], "raw_size": row[2] or 0, "stored_size": row[3] or 0}
+            for row in rows
+        ],
+        "blob_count": blob_count or 0,
+        "total_raw": sum(row[2] or 0 for row in rows),
+        "total_stored": sum(row[4] or 0 for row in rows) + (blob_stored or 0),
+    }
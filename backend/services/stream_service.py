@@ -0,0 +1,67 @@
+"""
+流式输出工具
+将模型逐 token 返回的增量文本按时间窗口和字节数合并，减少 SSE 帧数
+"""
+
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator
+
+
+async def coalesce_deltas(
+    source: AsyncIterator[str],
+    window_ms: int,
+    max_bytes: int,
+) -> AsyncGenerator[str, None]:
+    """
+    合并增量文本
+    - 自缓冲区收到第一段文本起超过 window_ms 毫秒，或累计超过 max_bytes 字节时输出一次
+    - 上游暂停时也会按时间窗口输出，不会把已收到的文本一直压在缓冲区
+    - window_ms <= 0 时不合并，逐段输出
+    """
+    if window_ms <= 0:
+        async for delta in source:
+            yield delta
+        return
+
+    window = window_ms / 1000
+    iterator = source.__aiter__()
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    pending: asyncio.Future | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(deadline - time.monotonic(), 0) if buffer else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                # 时间窗口到期，上游仍未返回
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                continue
+
+            try:
+                delta = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            if not delta:
+                continue
+            if not buffer:
+                deadline = time.monotonic() + window
+            buffer.append(delta)
+            size += len(delta.encode("utf-8"))
+            if size >= max_bytes or time.monotonic() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # 客户端断开时取消仍在等待的上游读取
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,439 @@
+"""
+章节摘要服务
+- 批量摘要：并发生成多个章节的摘要（信号量限制并发数），分批提交，逐章节报告进度；
+  失败的章节按指数退避重试，最终失败的章节在结束时汇总，不中断整个批次
+- 摘要树：章节摘要按固定章节数汇总为阶段概要，再汇总为全书概要，增量更新
+"""
+
+import asyncio
+import json
+import logging
+import random
+from dataclasses import dataclass
+from typing import AsyncGenerator
+
+from sqlalchemy import or_, select, update
+
+from config import settings
+from database import async_session
+from logging_config import log_fields, truncate
+from models.schemas import Chapter, SummaryNode
+from services.ai_service import generate_rollup, generate_summary
+from services.context_service import bump_context_version
+from services.text_service import content_hash
+
+logger = logging.getLogger(__name__)
+
+_EMPTY_HASH = content_hash("")
+
+
+@dataclass
+class _Job:
+    chapter_id: int
+    title: str
+    content_hash: str
+
+
+@dataclass
+class _Result:
+    job: _Job
+    summary: str | None = None
+    error: str | None = None
+    attempts: int = 0
+
+
+async def _select_jobs(session, project_id: int, chapter_ids: list[int] | None, force: bool) -> tuple[list[_Job], list[int]]:
+    """
+    确定需要生成摘要的章节（按 rank 排序），返回 (任务, 跳过的章节 ID)
+    chapter_ids 为空时取摘要缺失或过期的章节；force 时不跳过摘要已是最新的章节
+    """
+    stmt = (
+        select(Chapter.id, Chapter.title, Chapter.content_hash, Chapter.summary_hash, Chapter.summary)
+        .where(Chapter.project_id == project_id)
+        .order_by(Chapter.rank)
+    )
+    if chapter_ids is not None:
+        stmt = stmt.where(Chapter.id.in_(chapter_ids))
+    else:
+        stmt = stmt.where(or_(
+            Chapter.summary_hash.is_(None),
+            Chapter.summary_hash != Chapter.content_hash,
+            Chapter.summary.is_(None),
+            Chapter.summary == "",
+        ))
+
+    jobs, skipped = [], []
+    for row in (await session.execute(stmt)).all():
+        if not row.content_hash or row.content_hash == _EMPTY_HASH:
+            skipped.append(row.id)
+        elif row.summary and row.summary_hash == row.content_hash and not force:
+            skipped.append(row.id)
+        else:
+            jobs.append(_Job(row.id, row.title, row.content_hash))
+    return jobs, skipped
+
+
+async def _summarize_one(
+    job: _Job,
+    semaphore: asyncio.Semaphore,
+    events: asyncio.Queue,
+    ai_options: dict,
+    max_retries: int,
+    retry_delay: float,
+) -> _Result:
+    """生成单个章节的摘要，失败时指数退避重试"""
+    result = _Result(job)
+    async with semaphore:
+        try:
+            async with async_session() as session:
+                content = (await session.execute(
+                    select(Chapter.content).where(Chapter.id == job.chapter_id)
+                )).scalar_one_or_none()
+        except Exception as e:
+            result.error = f"Failed to read chapter: {str(e) or type(e).__name__}"
+            return result
+        if not content:
+            result.error = "Chapter has no content"
+            return result
+
+        for attempt in range(max_retries + 1):
+            result.attempts = attempt + 1
+            try:
+                result.summary = await generate_summary(content, **ai_options)
+                result.error = None
+                return result
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+                if attempt == max_retries:
+                    break
+                delay = retry_delay * 2 ** attempt
+                delay += random.uniform(0, delay / 2)
+                await events.put({
+                    "type": "retry",
+                    "chapter_id": job.chapter_id,
+                    "attempt": result.attempts,
+                    "delay": round(delay, 2),
+                    "error": truncate(result.error, 200),
+                })
+                await asyncio.sleep(delay)
+    return result
+
+
+async def _commit_batch(project_id: int, results: list[_Result]) -> set[int]:
+    """
+    写入一批摘要，返回实际写入的章节 ID
+    生成期间正文又被修改的章节（content_hash 已变化）不写入，避免以新版本标记旧摘要
+    """
+    written = set()
+    async with async_session() as session:
+        for r in results:
+            outcome = await session.execute(
+                update(Chapter)
+                .where(Chapter.id == r.job.chapter_id)
+                .where(Chapter.content_hash == r.job.content_hash)
+                .values(summary=r.summary, summary_hash=r.job.content_hash)
+            )
+            if outcome.rowcount:
+                written.add(r.job.chapter_id)
+        if written:
+            bump_context_version(session, project_id)
+        await session.commit()
+    return written
+
+
+async def summarize_chapters(
+    project_id: int,
+    chapter_ids: list[int] | None = None,
+    model: str = "gpt-4o-mini",
+    api_base: str = None,
+    api_key: str = None,
+    force: bool = False,
+    concurrency: int | None = None,
+) -> AsyncGenerator[dict, None]:
+    """
+    批量生成章节摘要，逐个产出进度事件:
+        {"type": "start", "total", "skipped"}
+        {"type": "retry", "chapter_id", "attempt", "delay", "error"}
+        {"type": "chapter", "chapter_id", "title", "status": "done"/"failed", "summary"/"error", "attempts", "completed", "total"}
+        {"type": "done", "succeeded", "failed": [...], "changed": [...], "skipped"}
+    changed: 生成期间正文被修改、摘要未写入的章节
+    客户端中途断开时取消未完成的请求，已生成的摘要仍会提交
+    """
+    async with async_session() as session:
+        jobs, skipped = await _select_jobs(session, project_id, chapter_ids, force)
+    yield {"type": "start", "total": len(jobs), "skipped": skipped}
+
+    semaphore = asyncio.Semaphore(concurrency or settings.ai_batch_concurrency)
+    events: asyncio.Queue = asyncio.Queue()
+    ai_options = {"model": model, "api_base": api_base, "api_key": api_key, "use_cache": not force}
+
+    async def run(job: _Job) -> None:
+        # 任何异常都要放入一个结果，否则下面的事件循环会一直等待
+        try:
+            result = await _summarize_one(
+                job, semaphore, events, ai_options,
+                settings.ai_batch_max_retries, settings.ai_batch_retry_delay,
+            )
+        except Exception as e:
+            logger.exception("Summary job failed", extra=log_fields(chapter_id=job.chapter_id))
+            result = _Result(job, error=str(e) or type(e).__name__)
+        await events.put(result)
+
+    tasks = [asyncio.create_task(run(job)) for job in jobs]
+    pending: list[_Result] = []
+    succeeded: list[int] = []
+    failed: list[dict] = []
+    changed: list[int] = []
+    completed = 0
+
+    async def flush() -> None:
+        batch = list(pending)
+        pending.clear()
+        written = await _commit_batch(project_id, batch)
+        for r in batch:
+            (succeeded if r.job.chapter_id in written else changed).append(r.job.chapter_id)
+
+    try:
+        while completed < len(jobs):
+            event = await events.get()
+            if isinstance(event, dict):
+                yield event
+                continue
+
+            completed += 1
+            job = event.job
+            if event.error is None:
+                pending.append(event)
+                yield {
+                    "type": "chapter", "chapter_id": job.chapter_id, "title": job.title,
+                    "status": "done", "summary": event.summary, "attempts": event.attempts,
+                    "completed": completed, "total": len(jobs),
+                }
+            else:
+                failed.append({"chapter_id": job.chapter_id, "title": job.title, "error": event.error, "attempts": event.attempts})
+                logger.warning("Batch summarize failed", extra=log_fields(
+                    project_id=project_id, chapter_id=job.chapter_id, attempts=event.attempts, error=event.error,
+                ))
+                yield {
+                    "type": "chapter", "chapter_id": job.chapter_id, "title": job.title,
+                    "status": "failed", "error": truncate(event.error, 200), "attempts": event.attempts,
+                    "completed": completed, "total": len(jobs),
+                }
+
+            if len(pending) >= settings.ai_batch_commit_size:
+                await flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # 已完成但尚未取出的结果同样提交
+        while not events.empty():
+            event = events.get_nowait()
+            if isinstance(event, _Result) and event.error is None:
+                pending.append(event)
+        if pending:
+            await flush()
+
+    logger.info("Batch summarize finished", extra=log_fields(
+        project_id=project_id, succeeded=len(succeeded), failed=len(failed), changed=len(changed), skipped=len(skipped),
+    ))
+    yield {"type": "done", "succeeded": len(succeeded), "failed": failed, "changed": changed, "skipped": skipped}
+
+
+@dataclass
+class _ArcPlan:
+    position: int
+    node_id: int | None  # 沿用的已有阶段节点
+    chapter_ids: list[int]
+    start_rank: int
+    end_rank: int
+    chapter_count: int
+    summaries: list[str]
+    source_hash: str
+
+
+def _source_hash(items: list) -> str:
+    return content_hash(json.dumps(items, ensure_ascii=False))
+
+
+def _arc_members(arc: SummaryNode, chapters: list) -> set[int]:
+    """阶段节点记录的章节；旧数据没有记录时按排序范围推断"""
+    if arc.chapter_ids is not None:
+        return set(arc.chapter_ids)
+    return {c.id for c in chapters if arc.start_rank <= c.rank <= arc.end_rank}
+
+
+def _group_arcs(chapters: list, arcs: list[SummaryNode], arc_size: int) -> list[tuple[int | None, list]]:
+    """
+    按章节顺序划分阶段，返回 [(沿用的节点 ID, 章节)]
+    已有阶段保留原有章节（仍然连续时）；新章节或被移到别处的章节并入前一阶段，前一阶段已满时开始新阶段
+    因此插入或删除章节只影响所在的阶段，其后的阶段不变
+    """
+    owner: dict[int, int] = {}
+    for arc in arcs:
+        for chapter_id in _arc_members(arc, chapters):
+            owner.setdefault(chapter_id, arc.id)
+
+    groups: list[tuple[int | None, list]] = []
+    closed: set[int] = set()  # 已被其他阶段隔开的节点，之后出现的成员视为移动过的章节
+    for chapter in chapters:
+        node_id = owner.get(chapter.id)
+        current = groups[-1] if groups else None
+        if node_id is not None and node_id not in closed:
+            if current is not None and current[0] == node_id:
+                current[1].append(chapter)
+                continue
+        elif current is not None and len(current[1]) < arc_size:
+            current[1].append(chapter)
+            continue
+        else:
+            node_id = None
+        if current is not None and current[0] is not None:
+            closed.add(current[0])
+        groups.append((node_id, [chapter]))
+    return groups
+
+
+async def rebuild_summary_tree(
+    project_id: int,
+    model: str = "gpt-4o-mini",
+    api_base: str = None,
+    api_key: str = None,
+    force: bool = False,
+) -> dict:
+    """
+    增量更新项目的摘要树：章节摘要 -> 阶段概要 (arc) -> 全书概要 (book)
+    只重新生成子节点摘要发生变化的节点；生成失败的节点保留旧内容与覆盖范围，下次更新时重试
+    """
+    arc_size = settings.summary_arc_size
+    async with async_session() as session:
+        chapters = (await session.execute(
+            select(Chapter.id, Chapter.rank, Chapter.title, Chapter.summary)
+            .where(Chapter.project_id == project_id)
+            .order_by(Chapter.rank)
+        )).all()
+        existing = list((await session.execute(
+            select(SummaryNode).where(SummaryNode.project_id == project_id).order_by(SummaryNode.position)
+        )).scalars())
+    arcs = {node.id: node for node in existing if node.level == "arc"}
+    book = next((node for node in existing if node.level == "book"), None)
+
+    plans = []
+    for position, (node_id, members) in enumerate(_group_arcs(chapters, list(arcs.values()), arc_size)):
+        # 节点的章节范围只计入已有摘要的章节，尚未摘要的新章节不算已覆盖
+        group = [c for c in members if c.summary]
+        plans.append(_ArcPlan(
+            position, node_id, [c.id for c in members],
+            group[0].rank if group else 0, group[-1].rank if group else 0, len(group),
+            [f"【{c.title}】{c.summary}" for c in group],
+            _source_hash([[c.id, c.summary] for c in group]) if group else "",
+        ))
+
+    semaphore = asyncio.Semaphore(settings.ai_batch_concurrency)
+    ai_options = {"model": model, "api_base": api_base, "api_key": api_key, "use_cache": not force}
+
+    async def rollup(summaries: list[str], level: str) -> str:
+        async with semaphore:
+            return await generate_rollup(summaries, level, **ai_options)
+
+    stale = [
+        plan for plan in plans
+        if plan.summaries and (force or plan.node_id is None or arcs[plan.node_id].source_hash != plan.source_hash)
+    ]
+    outcomes = await asyncio.gather(*(rollup(p.summaries, "arc") for p in stale), return_exceptions=True)
+    arc_summaries = {plan.position: arcs[plan.node_id].summary for plan in plans if plan.node_id is not None}
+    updated_arcs, failed = {}, []
+    for plan, outcome in zip(stale, outcomes):
+        if isinstance(outcome, BaseException):
+            failed.append({"level": "arc", "position": plan.position, "error": str(outcome) or type(outcome).__name__})
+        else:
+            updated_arcs[plan.position] = outcome
+            arc_summaries[plan.position] = outcome
+
+    # 全书概要由各阶段概要汇总，只有一个阶段时无需生成
+    live = [plan for plan in plans if plan.summaries and plan.position in arc_summaries]
+    book_sources = [arc_summaries[plan.position] for plan in live]
+    book_hash = _source_hash(book_sources)
+    book_summary = None
+    if len(live) > 1 and (force or book is None or book.source_hash != book_hash):
+        try:
+            book_summary = await rollup(book_sources, "book")
+        except Exception as e:
+            failed.append({"level": "book", "position": 0, "error": str(e) or type(e).__name__})
+
+    removed = 0
+    async with async_session() as session:
+        nodes = {
+            node.id: node
+            for node in (await session.execute(
+                select(SummaryNode).where(SummaryNode.project_id == project_id)
+            )).scalars()
+        }
+        kept: dict[int, SummaryNode] = {}
+        for plan in live:
+            node = nodes.get(plan.node_id) if plan.node_id is not None else None
+            if node is None and plan.position not in updated_arcs:
+                continue
+            if node is None:
+                node = SummaryNode(project_id=project_id, level="arc", position=plan.position)
+            kept[plan.position] = node
+
+        kept_ids = {node.id for node in kept.values() if node.id is not None}
+        for node in nodes.values():
+            if (node.level == "arc" and node.id not in kept_ids) or (node.level == "book" and len(live) <= 1):
+                await session.delete(node)
+                removed += 1
+        # 阶段序号可能整体移动：先改为临时的负数序号，避免唯一索引冲突
+        for node in kept.values():
+            if node.id is not None:
+                node.position = -node.id
+        await session.flush()
+
+        arc_changed = False
+        for plan in live:
+            node = kept.get(plan.position)
+            if node is None:
+                continue
+            if node.id is None:
+                session.add(node)
+            current = plan.position in updated_arcs or node.source_hash == plan.source_hash
+            arc_changed |= node.chapter_ids != plan.chapter_ids or (
+                current and (node.start_rank, node.end_rank, node.chapter_count)
+                != (plan.start_rank, plan.end_rank, plan.chapter_count)
+            )
+            node.position = plan.position
+            node.chapter_ids = plan.chapter_ids
+            # 覆盖范围只在概要与章节一致时更新（重新生成失败的阶段仍是旧章节的概要）
+            if current:
+                node.start_rank, node.end_rank, node.chapter_count = plan.start_rank, plan.end_rank, plan.chapter_count
+            if plan.position in updated_arcs:
+                node.summary = updated_arcs[plan.position]
+                node.source_hash = plan.source_hash
+
+        if len(live) > 1:
+            node = next((n for n in nodes.values() if n.level == "book"), None)
+            if node is None and book_summary is not None:
+                node = SummaryNode(project_id=project_id, level="book", position=0)
+                session.add(node)
+            if node is not None and (book_summary is not None or node.source_hash == book_hash):
+                covered = [kept[plan.position] for plan in live if plan.position in kept]
+                node.start_rank, node.end_rank = covered[0].start_rank, covered[-1].end_rank
+                node.chapter_count = sum(arc.chapter_count for arc in covered)
+                if book_summary is not None:
+                    node.summary = book_summary
+                    node.source_hash = book_hash
+
+        if updated_arcs or book_summary is not None or removed or arc_changed:
+            bump_context_version(session, project_id)
+        await session.commit()
+
+    logger.info("Summary tree rebuilt", extra=log_fields(
+        project_id=project_id, arcs=len(live), arcs_updated=len(updated_arcs),
+        book_updated=book_summary is not None, failed=len(failed),
+    ))
+    return {
+        "arcs": len(live),
+        "arcs_updated": len(updated_arcs),
+        "book_updated": book_summary is not None,
+        "removed": removed,
+        "failed": failed,
+    }
@@ -0,0 +1,134 @@
+"""
+文本处理服务
+内容哈希、增量文本操作、字数统计、长文本分块
+"""
+
+import hashlib
+import re
+
+from services.token_service import split_sentences
+
+# 字数统计：连续的中文字符段（按字计数）或空白分隔的纯英文单词（按词计数）
+_WORD_PATTERN = re.compile(r"[\u4e00-\u9fff]+|(?<!\S)[A-Za-z]+(?!\S)")
+
+
+class TextOperationError(ValueError):
+    """文本操作无法应用（位置越界等）"""
+    pass
+
+
+def content_hash(text: str | None) -> str:
+    """计算内容哈希（SHA-256 十六进制）"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def apply_text_operations(text: str, operations: list[dict]) -> str:
+    """
+    按顺序应用插入/删除操作，返回新文本
+    每个操作的位置基于前一个操作执行后的文本，位置单位为 Unicode 字符（code point）
+    operations 格式: [{"op": "insert", "pos": 0, "text": "..."}, {"op": "delete", "pos": 0, "length": 3}]
+    """
+    for index, op in enumerate(operations):
+        kind = op.get("op")
+        pos = op.get("pos", 0)
+        if pos < 0 or pos > len(text):
+            raise TextOperationError(f"Operation {index}: position {pos} out of range (length {len(text)})")
+
+        if kind == "insert":
+            insert_text = op.get("text") or ""
+            text = text[:pos] + insert_text + text[pos:]
+        elif kind == "delete":
+            length = op.get("length", 0)
+            if length < 0 or pos + length > len(text):
+                raise TextOperationError(f"Operation {index}: delete range {pos}+{length} out of range (length {len(text)})")
+            text = text[:pos] + text[pos + length:]
+        else:
+            raise TextOperationError(f"Operation {index}: unknown op '{kind}'")
+    return text
+
+
+def count_words(text: str | None) -> int:
+    """计算字数（中文字符 + 英文单词），单次正则扫描"""
+    if not text:
+        return 0
+    count = 0
+    for match in _WORD_PATTERN.findall(text):
+        # 中文字符段按字数计，英文单词计 1
+        count += len(match) if match[0] >= "\u4e00" else 1
+    return count
+
+
+def count_words_delta(old_text: str | None, new_text: str | None, old_count: int) -> int:
+    """
+    增量计算字数：按段落比较新旧文本，只重新统计改动的段落
+    要求 old_count 为 old_text 的准确字数
+    """
+    old_paragraphs = (old_text or "").split("\n")
+    new_paragraphs = (new_text or "").split("\n")
+
+    # 跳过首尾未改动的段落
+    limit = min(len(old_paragraphs), len(new_paragraphs))
+    prefix = 0
+    while prefix < limit and old_paragraphs[prefix] == new_paragraphs[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < limit - prefix
+        and old_paragraphs[-1 - suffix] == new_paragraphs[-1 - suffix]
+    ):
+        suffix += 1
+
+    removed = old_paragraphs[prefix:len(old_paragraphs) - suffix]
+    added = new_paragraphs[prefix:len(new_paragraphs) - suffix]
+    return old_count - sum(map(count_words, removed)) + sum(map(count_words, added))
+
+
+def split_chunks(text: str, chunk_chars: int, overlap_chars: int = 0) -> list[str]:
+    """
+    按段落边界把长文本切分为不超过 chunk_chars 的块（超长段落按句子切分）
+    相邻块重叠 overlap_chars 以内的完整段落，使跨块的信息至少在一个块中完整出现
+    切分只取决于文本本身，修改后部内容时前面的块保持不变
+    """
+    units: list[str] = []
+    for paragraph in (text or "").split("\n"):
+        if not paragraph.strip():
+            continue
+        if len(paragraph) <= chunk_chars:
+            units.append(paragraph)
+            continue
+        piece = ""
+        for sentence in split_sentences(paragraph):
+            while len(sentence) > chunk_chars:
+                if piece:
+                    units.append(piece)
+                    piece = ""
+                units.append(sentence[:chunk_chars])
+                sentence = sentence[chunk_chars:]
+            if piece and len(piece) + len(sentence) > chunk_chars:
+                units.append(piece)
+                piece = ""
+            piece += sentence
+        if piece:
+            units.append(piece)
+
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for unit in units:
+        if current and size + len(unit) + 1 > chunk_chars:
+            chunks.append("\n".join(current))
+            # 从上一块结尾取不超过 overlap_chars 的完整段落作为重叠
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            if overlap_size + len(unit) + 1 > chunk_chars:
+                overlap, overlap_size = [], 0
+            current, size = overlap, overlap_size
+        current.append(unit)
+        size += len(unit) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
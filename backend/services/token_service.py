@@ -0,0 +1,107 @@
+"""
+Token 计数与按句截断
+- 默认使用离线、无依赖的近似估算：中日韩字符约 1 token/字，其余文本约 4 字符/token
+- 配置 TOKEN_COUNTER=tiktoken 且已安装 tiktoken 时使用精确计数
+"""
+
+import logging
+import re
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 中日韩统一表意文字、假名、韩文音节及全角标点
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+# 句子：以句末标点（可带后引号/括号）或换行结尾，拼接后与原文完全一致
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?…\n]*(?:[。！？!?…]+[”’」』\"')）]*|\n+|$)")
+
+_encoder = None
+_encoder_loaded = False
+
+
+def estimate_tokens(text: str | None) -> int:
+    """估算文本的 token 数（偏保守，用于预算控制）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(_SPACE_PATTERN.sub(" ", text)) - cjk
+    return cjk + (other + 3) // 4
+
+
+def _get_encoder():
+    """加载 tiktoken 编码器（可选依赖，未安装或加载失败时返回 None）"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        if settings.token_counter == "tiktoken":
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding(settings.tiktoken_encoding)
+            except Exception as e:
+                logger.warning("tiktoken unavailable, using token estimate: %s", e)
+    return _encoder
+
+
+def count_tokens(text: str | None) -> int:
+    """计算文本的 token 数（按配置使用精确计数或估算）"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def split_sentences(text: str) -> list[str]:
+    """按句末标点与换行切分，各段拼接后等于原文"""
+    return [s for s in _SENTENCE_PATTERN.findall(text) if s]
+
+
+def _cut_chars(text: str, max_tokens: int, keep_tail: bool) -> str:
+    """在单个句子内按字符截断（二分查找满足预算的最长片段）"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        piece = text[-mid:] if keep_tail else text[:mid]
+        if count_tokens(piece) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    if not low:
+        return ""
+    return text[-low:] if keep_tail else text[:low]
+
+
+def trim_head(text: str, max_tokens: int) -> str:
+    """保留开头不超过 max_tokens 的完整句子（第一句就超出时按字符截断）"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        cost = count_tokens(sentence)
+        if used + cost > max_tokens:
+            if not kept:
+                return _cut_chars(sentence, max_tokens, keep_tail=False)
+            break
+        kept.append(sentence)
+        used += cost
+    return "".join(kept).rstrip()
+
+
+def trim_tail(text: str, max_tokens: int) -> str:
+    """保留结尾不超过 max_tokens 的完整句子（最后一句就超出时按字符截断）"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in reversed(split_sentences(text)):
+        cost = count_tokens(sentence)
+        if used + cost > max_tokens:
+            if not kept:
+                return _cut_chars(sentence, max_tokens, keep_tail=True)
+            break
+        kept.append(sentence)
+        used += cost
+    return "".join(reversed(kept)).lstrip()
@@ -0,0 +1,268 @@
+"""
+向量索引（语义检索）
+每个项目每类条目（passages: 章节片段，facts: 数据表条目）一个 float32 矩阵，
+以内存映射的 .npy 文件保存在 data/vectors/{project_id}/ 下：
+- {name}.npy: capacity x dim 向量矩阵，容量不足时按 2 倍扩容
+- {name}.keys.npy: 每行对应的条目键（int64），-1 为已删除行
+- {name}.json: 元数据（向量化实现、维度、已用行数、已删除行数）
+删除只标记键，已删除行超过 1/4 时压缩重写
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import DATA_DIR
+from logging_config import log_fields
+from models.schemas import SearchPassage
+from services.embedding_service import get_embedder
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIR = DATA_DIR / "vectors"
+
+_DELETED = -1
+_MIN_CAPACITY = 1024
+
+
+def fact_key(text: str) -> int:
+    """数据表条目的键：文本哈希的低 63 位（非负）"""
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+
+class VectorStore:
+    """单个项目单类条目的向量矩阵（非线程安全，调用方按项目加锁）"""
+
+    def __init__(self, directory: Path, name: str):
+        self.directory = directory
+        self.name = name
+        self.embedder: str | None = None
+        self.dim = 0
+        self.count = 0
+        self.deleted = 0
+        self._vectors: np.memmap | None = None
+        self._keys: np.memmap | None = None
+        self._rows: dict[int, int] = {}
+        self._load()
+
+    def _path(self, suffix: str) -> Path:
+        return self.directory / f"{self.name}{suffix}"
+
+    def _load(self) -> None:
+        meta_path = self._path(".json")
+        if not meta_path.exists():
+            return
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.embedder, self.dim = meta["embedder"], meta["dim"]
+        self.count, self.deleted = meta["count"], meta["deleted"]
+        self._vectors = np.load(self._path(".npy"), mmap_mode="r+")
+        self._keys = np.load(self._path(".keys.npy"), mmap_mode="r+")
+        keys = np.asarray(self._keys[:self.count])
+        live = np.flatnonzero(keys != _DELETED)
+        self._rows = dict(zip(keys[live].tolist(), live.tolist()))
+
+    def _save_meta(self) -> None:
+        meta = {"embedder": self.embedder, "dim": self.dim, "count": self.count, "deleted": self.deleted}
+        tmp = self._path(".json.tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self._path(".json"))
+
+    def _close(self) -> None:
+        # 替换文件前释放内存映射（Windows 下映射中的文件无法被替换）
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._keys.flush()
+        self._vectors = self._keys = None
+
+    def _rewrite(self, capacity: int, rows: np.ndarray | None = None) -> None:
+        """按新容量重写文件；rows 为要保留的行（为空时保留全部已用行）"""
+        vectors_tmp, keys_tmp = self._path(".npy.tmp"), self._path(".keys.npy.tmp")
+        new_vectors = open_memmap(vectors_tmp, mode="w+", dtype=np.float32, shape=(capacity, self.dim))
+        new_keys = open_memmap(keys_tmp, mode="w+", dtype=np.int64, shape=(capacity,))
+        new_keys[:] = _DELETED
+        if self._vectors is not None:
+            if rows is None:
+                rows = np.arange(self.count)
+            new_vectors[:len(rows)] = self._vectors[rows]
+            new_keys[:len(rows)] = self._keys[rows]
+            self.count = len(rows)
+        new_vectors.flush()
+        new_keys.flush()
+        del new_vectors, new_keys
+        self._close()
+        os.replace(vectors_tmp, self._path(".npy"))
+        os.replace(keys_tmp, self._path(".keys.npy"))
+        self._vectors = np.load(self._path(".npy"), mmap_mode="r+")
+        self._keys = np.load(self._path(".keys.npy"), mmap_mode="r+")
+        keys = np.asarray(self._keys[:self.count])
+        self._rows = dict(zip(keys.tolist(), range(self.count)))
+        self.deleted = 0
+
+    def clear(self) -> None:
+        """删除全部向量与文件"""
+        self._close()
+        for suffix in (".npy", ".keys.npy", ".json"):
+            self._path(suffix).unlink(missing_ok=True)
+        self.embedder, self.dim, self.count, self.deleted = None, 0, 0, 0
+        self._rows = {}
+
+    def reset(self, embedder: str, dim: int) -> None:
+        """清空并切换向量化实现（维度或模型变化时旧向量不可比较）"""
+        self._close()
+        self.embedder, self.dim, self.count, self.deleted = embedder, dim, 0, 0
+        self._rows = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._rewrite(_MIN_CAPACITY)
+        self._save_meta()
+
+    def keys(self) -> set[int]:
+        return set(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._rows
+
+    def append(self, keys: list[int], vectors: np.ndarray) -> None:
+        if not keys:
+            return
+        needed = self.count + len(keys)
+        if needed > len(self._keys):
+            self._rewrite(max(needed, len(self._keys) * 2))
+        self._vectors[self.count:needed] = vectors
+        self._keys[self.count:needed] = keys
+        self._vectors.flush()
+        self._keys.flush()
+        self._rows.update(zip(keys, range(self.count, needed)))
+        self.count = needed
+        self._save_meta()
+
+    def delete(self, keys: list[int]) -> None:
+        rows = [self._rows.pop(key) for key in keys if key in self._rows]
+        if not rows:
+            return
+        self._keys[rows] = _DELETED
+        self._vectors[rows] = 0.0
+        self.deleted += len(rows)
+        if self.deleted * 4 > self.count:
+            live = np.flatnonzero(np.asarray(self._keys[:self.count]) != _DELETED)
+            self._rewrite(max(_MIN_CAPACITY, len(live) * 2), rows=live)
+        else:
+            self._keys.flush()
+            self._vectors.flush()
+        self._save_meta()
+
+    def search(self, queries: np.ndarray, k: int) -> list[list[tuple[int, float]]]:
+        """批量余弦 top-k：queries 为归一化的 q x dim 矩阵，返回每个查询的 [(键, 相似度)]"""
+        if not self._rows or k <= 0:
+            return [[] for _ in range(len(queries))]
+        keys = np.asarray(self._keys[:self.count])
+        scores = queries @ np.asarray(self._vectors[:self.count]).T
+        if self.deleted:
+            scores[:, keys == _DELETED] = -np.inf
+        k = min(k, len(self._rows))
+        top = np.argpartition(scores, self.count - k, axis=1)[:, self.count - k:]
+        results = []
+        for query_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-query_scores[rows])]
+            results.append([(int(keys[row]), float(query_scores[row])) for row in rows])
+        return results
+
+
+# (project_id, name) -> VectorStore；每个项目一把锁，同步与检索互斥
+_stores: dict[tuple[int, str], VectorStore] = {}
+_locks: dict[int, asyncio.Lock] = {}
+
+
+def project_lock(project_id: int) -> asyncio.Lock:
+    return _locks.setdefault(project_id, asyncio.Lock())
+
+
+def get_store(project_id: int, name: str, embedder) -> VectorStore:
+    """打开（或创建）项目的向量矩阵；向量化实现变化时清空重建"""
+    store = _stores.get((project_id, name))
+    if store is None:
+        store = VectorStore(VECTOR_DIR / str(project_id), name)
+        _stores[(project_id, name)] = store
+    if store.embedder is not None and store.embedder != embedder.name:
+        logger.info("Embedder changed, rebuilding vectors", extra=log_fields(
+            project_id=project_id, store=name, old=store.embedder, new=embedder.name,
+        ))
+        store.clear()
+    return store
+
+
+async def _sync(store: VectorStore, embedder, items: dict[int, str]) -> dict:
+    """使向量矩阵与 {键: 文本} 一致：删除多余的键，分批向量化并追加缺少的键"""
+    removed = list(store.keys() - items.keys())
+    added = [key for key in items if key not in store]
+    if removed:
+        await asyncio.to_thread(store.delete, removed)
+    batch_size = settings.embedding_batch_size * 8
+    for start in range(0, len(added), batch_size):
+        batch = added[start:start + batch_size]
+        vectors = await embedder.embed([items[key] for key in batch])
+        if store.embedder is None:
+            await asyncio.to_thread(store.reset, embedder.name, vectors.shape[1])
+        await asyncio.to_thread(store.append, batch, vectors)
+    return {"added": len(added), "removed": len(removed)}
+
+
+async def sync_passages(db: AsyncSession, project_id: int, embedder) -> VectorStore:
+    """
+    同步章节片段向量（键为 search_passages.id）
+    片段表在保存章节时已增量更新，未变化的片段保留原 ID，因此只需向量化新增片段
+    """
+    store = get_store(project_id, "passages", embedder)
+    ids = set((await db.execute(
+        select(SearchPassage.id).where(SearchPassage.project_id == project_id)
+    )).scalars().all())
+    # 已有向量的片段不需要读取正文
+    items = dict.fromkeys(ids, "")
+    missing = sorted(ids - store.keys())
+    for start in range(0, len(missing), 500):
+        result = await db.execute(
+            select(SearchPassage.id, SearchPassage.text).where(SearchPassage.id.in_(missing[start:start + 500]))
+        )
+        items.update(result.all())
+    stats = await _sync(store, embedder, items)
+    if stats["added"] or stats["removed"]:
+        logger.info("Passage vectors synced", extra=log_fields(project_id=project_id, **stats))
+    return store
+
+
+async def sync_facts(project_id: int, embedder, facts: list[str]) -> tuple[VectorStore, dict[int, str]]:
+    """同步数据表条目向量（键为条目文本哈希），返回 (向量矩阵, {键: 文本})"""
+    store = get_store(project_id, "facts", embedder)
+    items = {fact_key(text): text for text in facts}
+    await _sync(store, embedder, items)
+    return store, items
+
+
+def remove_project_vectors(project_id: int) -> None:
+    """删除项目的全部向量文件"""
+    for key in [key for key in _stores if key[0] == project_id]:
+        _stores.pop(key)._close()
+    _locks.pop(project_id, None)
+    shutil.rmtree(VECTOR_DIR / str(project_id), ignore_errors=True)
+
+
+async def search_passage_vectors(db: AsyncSession, project_id: int, query: str, k: int) -> dict[int, float]:
+    """同步片段向量并检索与查询最相似的 k 个片段，返回 {片段 ID: 余弦相似度}"""
+    embedder = get_embedder()
+    async with project_lock(project_id):
+        store = await sync_passages(db, project_id, embedder)
+        vectors = await embedder.embed([query])
+        hits = await asyncio.to_thread(store.search, vectors, k)
+    return dict(hits[0])
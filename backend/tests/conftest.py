@@ -0,0 +1,8 @@
+"""
+测试公共配置：以 backend 目录为导入根（与 uvicorn main:app 的运行方式一致）
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,122 @@
+"""
+续写上下文组装的查询次数：缓存未命中时查询次数固定，不随章节数、关系数增长
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models.schemas import Chapter, Character, Project, Relationship, SummaryNode
+from services import context_service
+from services.context_service import ContextCache, get_continuation_sections
+
+# 项目 + 关系 + 当前章节 + 前文摘要 + 摘要树（与 load_continuation_context 文档一致）
+QUERIES_WITH_CHAPTER = 5
+# 未指定章节时只读取项目与关系
+QUERIES_WITHOUT_CHAPTER = 2
+
+
+async def _seed(session: AsyncSession, size: int) -> tuple[int, int]:
+    """写入 size 个章节（均有摘要）、size 个角色与 size 条关系，返回 (项目 ID, 最后一章 ID)"""
+    project = Project(title=f"project-{size}", world_view="世界观", style="风格", outline="大纲")
+    session.add(project)
+    await session.flush()
+    await session.execute(insert(Character), [
+        {"project_id": project.id, "name": f"角色{i}"} for i in range(size)
+    ])
+    characters = (await session.execute(
+        Character.__table__.select().where(Character.project_id == project.id).order_by(Character.id)
+    )).all()
+    await session.execute(insert(Relationship), [
+        {
+            "project_id": project.id,
+            "source_id": characters[i].id,
+            "target_id": characters[(i + 1) % size].id,
+            "relation_type": "朋友",
+        }
+        for i in range(size)
+    ])
+    await session.execute(insert(Chapter), [
+        {"project_id": project.id, "title": f"第{i}章", "rank": i, "summary": f"第{i}章摘要", "chapter_outline": "本章大纲"}
+        for i in range(1, size + 1)
+    ])
+    await session.execute(insert(SummaryNode), [
+        {"project_id": project.id, "level": "arc", "position": 0, "start_rank": 1, "end_rank": size,
+         "chapter_count": size, "summary": "阶段概要", "source_hash": "x"},
+    ])
+    last = (await session.execute(
+        Chapter.__table__.select().where(Chapter.project_id == project.id).order_by(Chapter.rank.desc()).limit(1)
+    )).first()
+    await session.commit()
+    return project.id, last.id
+
+
+async def _count_queries(db_url: str, size: int) -> tuple[int, int]:
+    engine = create_async_engine(db_url, poolclass=NullPool)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions() as session:
+            project_id, chapter_id = await _seed(session, size)
+
+        statements: list[str] = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        counts = []
+        async with sessions() as session:
+            for target in (chapter_id, None):
+                statements.clear()
+                sections = await get_continuation_sections(session, project_id, target)
+                assert sections is not None
+                assert len(sections.relationships) == size
+                if target is not None:
+                    assert sections.previous_summaries
+                counts.append(len(statements))
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+        return counts[0], counts[1]
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def cold_cache(monkeypatch):
+    monkeypatch.setattr(context_service, "context_cache", ContextCache(16))
+
+
+@pytest.mark.parametrize("size", [5, 500])
+def test_context_assembly_query_count(tmp_path, size):
+    with_chapter, without_chapter = asyncio.run(
+        _count_queries(f"sqlite+aiosqlite:///{tmp_path / 'context.db'}", size)
+    )
+    assert with_chapter == QUERIES_WITH_CHAPTER
+    assert without_chapter == QUERIES_WITHOUT_CHAPTER
+
+
+def test_cached_sections_need_no_queries(tmp_path):
+    """缓存命中时不查询数据库"""
+    async def run() -> int:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'context.db'}", poolclass=NullPool)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            sessions = async_sessionmaker(engine, expire_on_commit=False)
+            async with sessions() as session:
+                project_id, chapter_id = await _seed(session, 5)
+            async with sessions() as session:
+                await get_continuation_sections(session, project_id, chapter_id)
+                statements = []
+                event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+                await get_continuation_sections(session, project_id, chapter_id)
+                return len(statements)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,99 @@
+"""
+索引覆盖检查：用 EXPLAIN QUERY PLAN 确认常用查询走索引
+分别在 create_all 建出的新库和由旧结构迁移而来的库上检查
+"""
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.dialects import sqlite
+
+from database import Base
+from migrations import LATEST_VERSION, get_schema_version, run_migrations, set_schema_version
+from models.schemas import Chapter, Character, DataTable, Relationship, Snapshot
+
+# 迁移 1 添加的索引（旧版数据库中不存在）
+MIGRATED_INDEXES = (
+    "ix_chapters_project_rank",
+    "ix_characters_project_id",
+    "ix_relationships_project_id",
+    "ix_relationships_source_id",
+    "ix_relationships_target_id",
+    "ix_data_tables_project_type",
+    "ix_snapshots_project_created",
+)
+
+QUERIES = {
+    "chapters": (
+        select(Chapter).where(Chapter.project_id == 1).order_by(Chapter.rank),
+        "ix_chapters_project_rank",
+    ),
+    "characters": (
+        select(Character).where(Character.project_id == 1),
+        "ix_characters_project_id",
+    ),
+    "relationships": (
+        select(Relationship).where(Relationship.project_id == 1),
+        "ix_relationships_project_id",
+    ),
+    "relationships_source": (
+        select(Relationship).where(Relationship.source_id == 1),
+        "ix_relationships_source_id",
+    ),
+    "relationships_target": (
+        select(Relationship).where(Relationship.target_id == 1),
+        "ix_relationships_target_id",
+    ),
+    "data_tables": (
+        select(DataTable).where(DataTable.project_id == 1, DataTable.table_type == 1),
+        "ix_data_tables_project_type",
+    ),
+    "snapshots": (
+        select(Snapshot.id).where(Snapshot.project_id == 1).order_by(Snapshot.created_at.desc()),
+        "ix_snapshots_project_created",
+    ),
+}
+
+
+def _fresh(conn) -> None:
+    Base.metadata.create_all(conn)
+    set_schema_version(conn, LATEST_VERSION)
+
+
+def _migrated(conn) -> None:
+    # 模拟旧版数据库：没有迁移添加的索引，版本号为 0
+    Base.metadata.create_all(conn)
+    for name in MIGRATED_INDEXES:
+        conn.execute(text(f"DROP INDEX {name}"))
+    set_schema_version(conn, 0)
+    assert run_migrations(conn) == [migration for migration in range(1, LATEST_VERSION + 1)]
+
+
+@pytest.fixture(params=[_fresh, _migrated], ids=["fresh", "migrated"])
+def conn(request, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as connection:
+        request.param(connection)
+        yield connection
+    engine.dispose()
+
+
+def _query_plan(conn, stmt) -> str:
+    sql = str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_query_uses_index(conn, name):
+    stmt, index = QUERIES[name]
+    plan = _query_plan(conn, stmt)
+    assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
+    # 排序由索引提供，不需要临时 B 树
+    assert "TEMP B-TREE" not in plan, plan
+
+
+def test_migrations_are_rerunnable(conn):
+    """版本号落后于实际结构时（如迁移中途失败）重新执行迁移不报错"""
+    set_schema_version(conn, 1)
+    run_migrations(conn)
+    assert get_schema_version(conn) == LATEST_VERSION
@@ -0,0 +1,133 @@
+"""
+模型输出 JSON 解析器的模糊测试：
+- 完整对象（带推理内容、代码块、前后说明文字）一次性与分块输入都能还原
+- 截断后的结果与一次性解析一致，且是原对象的剪枝前缀
+- 插入错误字符时不抛异常，分块与一次性解析结果一致
+"""
+
+import json
+import random
+
+import pytest
+
+from services.json_parser import IncrementalJSONParser, parse_llm_json
+
+# 字符串取值包含引号、反斜杠、换行、括号和 think 标签的字符，覆盖转义与跨块边界的情况
+_ALPHABET = 'ab 中文"\\\n\t{}[],:<>/think'
+_PREFIXES = [
+    "",
+    '<think>思考 {"x": 1} [</think>',
+    "```json\n",
+    "说明：\n```json\n",
+    "<think>a</think>\n```\n",
+]
+_SUFFIXES = ["", "\n```", "\n```\n以上。{bad", "  trailing } ]"]
+ROUNDS = 2000
+
+
+def _string(rng: random.Random) -> str:
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 12)))
+
+
+def _value(rng: random.Random, depth: int = 0):
+    r = rng.random()
+    if depth < 4 and r < 0.25:
+        return {_string(rng): _value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+    if depth < 4 and r < 0.45:
+        return [_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return rng.choice([_string(rng), rng.randint(-1000, 1000), rng.random(), True, False, None])
+
+
+def _object(rng: random.Random) -> dict:
+    return {f"k{i}": _value(rng, 1) for i in range(rng.randint(1, 5))}
+
+
+def _feed_in_chunks(rng: random.Random, text: str, max_chunk: int = 9):
+    parser = IncrementalJSONParser()
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, max_chunk)
+        parser.feed(text[position:position + size])
+        position += size
+    return parser.result()
+
+
+def _is_pruned_prefix(result, original) -> bool:
+    """result 是否为 original 去掉末尾若干元素/键（逐层）后的结果"""
+    if isinstance(original, dict):
+        if not isinstance(result, dict):
+            return False
+        keys = list(result)
+        if keys != list(original)[:len(keys)]:
+            return False
+        return all(_is_pruned_prefix(result[key], original[key]) for key in keys)
+    if isinstance(original, list):
+        return (
+            isinstance(result, list)
+            and len(result) <= len(original)
+            and all(_is_pruned_prefix(a, b) for a, b in zip(result, original))
+        )
+    return result == original
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_complete_objects_round_trip(seed):
+    rng = random.Random(seed)
+    for _ in range(ROUNDS):
+        obj = _object(rng)
+        body = json.dumps(obj, ensure_ascii=rng.random() < 0.3, indent=rng.choice([None, 2]))
+        text = rng.choice(_PREFIXES) + body + rng.choice(_SUFFIXES)
+        assert parse_llm_json(text) == obj, text
+        assert _feed_in_chunks(rng, text) == obj, text
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_truncated_streams_match_one_shot(seed):
+    rng = random.Random(100 + seed)
+    for _ in range(ROUNDS):
+        obj = _object(rng)
+        body = json.dumps(obj, ensure_ascii=rng.random() < 0.3, indent=rng.choice([None, 2]))
+        text = rng.choice(_PREFIXES) + body[:rng.randint(0, len(body))]
+        one_shot = parse_llm_json(text)
+        assert _feed_in_chunks(rng, text) == one_shot, text
+        assert _feed_in_chunks(rng, text, max_chunk=1) == one_shot, text
+        if one_shot is not None:
+            assert _is_pruned_prefix(one_shot, obj), (text, one_shot)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_corrupted_input_never_raises(seed):
+    rng = random.Random(200 + seed)
+    for _ in range(ROUNDS):
+        body = json.dumps(_object(rng), ensure_ascii=False)
+        position = rng.randint(1, len(body) - 1)
+        text = body[:position] + rng.choice(["@", "}", "]", ",", ":", "x", '"']) + body[position:]
+        one_shot = parse_llm_json(text)
+        assert one_shot is None or isinstance(one_shot, dict), text
+        assert _feed_in_chunks(rng, text) == one_shot, text
+        try:
+            exact = json.loads(text)
+        except json.JSONDecodeError:
+            continue
+        assert one_shot == exact, text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a":[1,2]]}', {"a": [1, 2]}),
+    ('{"a": {"b": 1}], "c": 2}', {"a": {"b": 1}}),
+    ('<think>先想想 {"wrong": true}</think>{"ok": 1}', {"ok": 1}),
+    ('<thi', None),
+    ('```json\n{"a": "x\\"y"}\n```', {"a": 'x"y'}),
+    ('{"a": "引号\\"和\\\\反斜杠", "b": [1, 2', {"a": '引号"和\\反斜杠', "b": [1]}),
+    ('{"characters": [{"name": "林舟"}, {"name": "苏', {"characters": [{"name": "林舟"}]}),
+    ('{"a": 1, "b": tru', {"a": 1}),
+    ("没有 JSON", None),
+    ("", None),
+])
+def test_examples(text, expected):
+    assert parse_llm_json(text) == expected
+    # 每个字符单独输入（标签、转义和括号都被拆开）
+    parser = IncrementalJSONParser()
+    for char in text:
+        parser.feed(char)
+    assert parser.result() == expected
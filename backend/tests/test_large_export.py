@@ -0,0 +1,145 @@
+"""
+大项目流式导出/导入的内存占用：合成约 100MB 正文的项目，
+经 NDJSON 与 zip 流式导出到临时文件，再分别导入为新项目，
+各阶段 Python 内存峰值（tracemalloc）不随项目大小增长
+
+项目大小可用环境变量 LARGE_EXPORT_MB 调整（默认 100）
+"""
+
+import asyncio
+import os
+import tracemalloc
+
+import pytest
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models.schemas import Chapter, Character, Project, Relationship
+from services import archive_service, export_service
+from services.archive_service import import_project_archive, stream_project_archive
+from services.export_service import stream_project_ndjson
+from services.import_service import import_project_file
+
+PROJECT_MB = int(os.environ.get("LARGE_EXPORT_MB", "100"))
+# 每章约 20KB（UTF-8），100MB 约 5000 章
+CHAPTER_BYTES = 20 * 1024
+# 各阶段内存峰值上限：与项目大小无关，只取决于批大小与单条记录大小
+PEAK_LIMIT_BYTES = 48 * 1024 * 1024
+
+_PARAGRAPH = "夜色渐深，山间的风带着潮湿的凉意，林舟握紧了手中的剑。\n\n"
+
+
+class _UploadStub:
+    """与 UploadFile 一致的异步 read 接口"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.fileobj.read(size)
+
+
+def _chapter_text(index: int) -> str:
+    paragraph = f"第{index}章。" + _PARAGRAPH
+    return paragraph * (CHAPTER_BYTES // len(paragraph.encode("utf-8")))
+
+
+async def _seed(sessions, chapter_count: int) -> int:
+    async with sessions() as session:
+        project = Project(title="大项目", world_view="世界观", style="风格")
+        session.add(project)
+        await session.flush()
+        await session.execute(insert(Character), [
+            {"project_id": project.id, "name": f"角色{i}"} for i in range(200)
+        ])
+        first_character = (await session.execute(select(func.min(Character.id)))).scalar()
+        await session.execute(insert(Relationship), [
+            {"project_id": project.id, "source_id": first_character + i, "target_id": first_character + i + 1,
+             "relation_type": "朋友"}
+            for i in range(199)
+        ])
+        for start in range(0, chapter_count, 200):
+            await session.execute(insert(Chapter), [
+                {"project_id": project.id, "title": f"第{i}章", "content": _chapter_text(i), "rank": i}
+                for i in range(start, min(start + 200, chapter_count))
+            ])
+        await session.commit()
+        return project.id
+
+
+async def _measure(label: str, peaks: dict, coroutine):
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = await coroutine
+    peaks[label] = tracemalloc.get_traced_memory()[1] - baseline
+    return result
+
+
+async def _write_stream(stream, path, binary: bool) -> int:
+    written = 0
+    with open(path, "wb") as f:
+        async for chunk in stream:
+            data = chunk if binary else chunk.encode("utf-8")
+            f.write(data)
+            written += len(data)
+    return written
+
+
+@pytest.mark.slow
+def test_large_project_export_import_memory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'large.db'}", poolclass=NullPool)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(export_service, "async_session", sessions)
+    monkeypatch.setattr(archive_service, "async_session", sessions)
+    chapter_count = PROJECT_MB * 1024 * 1024 // CHAPTER_BYTES
+
+    async def run() -> dict:
+        peaks: dict[str, int] = {}
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        project_id = await _seed(sessions, chapter_count)
+
+        ndjson_path, zip_path = tmp_path / "export.ndjson", tmp_path / "export.zip"
+        ndjson_bytes = await _measure(
+            "export_ndjson", peaks, _write_stream(stream_project_ndjson(project_id), ndjson_path, binary=False)
+        )
+        await _measure("export_zip", peaks, _write_stream(stream_project_archive(project_id), zip_path, binary=True))
+        assert ndjson_bytes >= PROJECT_MB * 1024 * 1024
+
+        async with sessions() as session:
+            with open(ndjson_path, "rb") as f:
+                report = await _measure("import_ndjson", peaks, import_project_file(session, _UploadStub(f)))
+            await session.commit()
+        assert report["phases"]["chapters"]["records"] == chapter_count
+        assert report["phases"]["characters"]["records"] == 200
+        assert report["phases"]["relationships"]["records"] == 199
+
+        async with sessions() as session:
+            with open(zip_path, "rb") as f:
+                archive_report = await _measure("import_zip", peaks, import_project_archive(session, f))
+            await session.commit()
+        assert archive_report["phases"]["chapters"]["records"] == chapter_count
+
+        async with sessions() as session:
+            for imported in (report["project_id"], archive_report["project_id"]):
+                count, size = (await session.execute(
+                    select(func.count(), func.sum(func.length(Chapter.content))).where(Chapter.project_id == imported)
+                )).one()
+                original = (await session.execute(
+                    select(func.sum(func.length(Chapter.content))).where(Chapter.project_id == project_id)
+                )).scalar()
+                assert (count, size) == (chapter_count, original)
+        return peaks
+
+    tracemalloc.start()
+    try:
+        peaks = asyncio.run(run())
+    finally:
+        tracemalloc.stop()
+        asyncio.run(engine.dispose())
+
+    print({label: f"{peak / 2**20:.1f} MiB" for label, peak in peaks.items()})
+    for label, peak in peaks.items():
+        assert peak < PEAK_LIMIT_BYTES, f"{label}: peak {peak / 2**20:.1f} MiB for a {PROJECT_MB} MB project"
@@ -0,0 +1,165 @@
+"""
+摘要树增量更新：阶段按已有章节集合划分，插入或删除前面的章节只重新生成所在阶段；
+生成失败的阶段保留旧概要与覆盖范围
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import settings
+from database import Base
+from models.schemas import Chapter, Project, SummaryNode
+from services import summary_service
+from services.summary_service import rebuild_summary_tree
+
+ARC_SIZE = 10
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """临时数据库 + 记录调用的假 rollup，返回 (会话工厂, 调用记录)"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'tree.db'}", poolclass=NullPool)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    calls: list[tuple[str, list[str]]] = []
+    failing: set[str] = set()
+
+    async def fake_rollup(summaries, level, **kwargs):
+        calls.append((level, summaries))
+        if any(marker in s for s in summaries for marker in failing):
+            raise RuntimeError("rollup failed")
+        return f"{level}:{len(summaries)}"
+
+    monkeypatch.setattr(summary_service, "async_session", sessions)
+    monkeypatch.setattr(summary_service, "generate_rollup", fake_rollup)
+    monkeypatch.setattr(settings, "summary_arc_size", ARC_SIZE)
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with sessions() as session:
+            project = Project(title="p")
+            session.add(project)
+            await session.flush()
+            await session.execute(insert(Chapter), [
+                {"project_id": project.id, "title": f"第{i}章", "rank": i, "summary": f"摘要{i}"}
+                for i in range(1, 36)
+            ])
+            await session.commit()
+            return project.id
+
+    project_id = asyncio.run(create())
+    yield sessions, project_id, calls, failing
+    asyncio.run(engine.dispose())
+
+
+async def _arcs(sessions, project_id: int) -> list[tuple[int, int, int, int]]:
+    async with sessions() as session:
+        rows = (await session.execute(
+            select(SummaryNode.position, SummaryNode.start_rank, SummaryNode.end_rank, SummaryNode.chapter_count)
+            .where(SummaryNode.project_id == project_id, SummaryNode.level == "arc")
+            .order_by(SummaryNode.position)
+        )).all()
+    return [tuple(row) for row in rows]
+
+
+async def _insert_after(sessions, project_id: int, rank: int, title: str) -> None:
+    """在 rank 之后插入一章（后续章节整体后移）"""
+    async with sessions() as session:
+        await session.execute(
+            update(Chapter).where(Chapter.project_id == project_id, Chapter.rank > rank).values(rank=Chapter.rank + 1)
+        )
+        session.add(Chapter(project_id=project_id, title=title, rank=rank + 1, summary=f"{title}摘要"))
+        await session.commit()
+
+
+def _arc_calls(calls) -> list[list[str]]:
+    return [summaries for level, summaries in calls if level == "arc"]
+
+
+def test_initial_build_groups_by_arc_size(tree):
+    sessions, project_id, calls, _ = tree
+    result = asyncio.run(rebuild_summary_tree(project_id))
+    assert result["arcs"] == 4 and result["arcs_updated"] == 4 and result["book_updated"]
+    assert asyncio.run(_arcs(sessions, project_id)) == [(0, 1, 10, 10), (1, 11, 20, 10), (2, 21, 30, 10), (3, 31, 35, 5)]
+
+    calls.clear()
+    result = asyncio.run(rebuild_summary_tree(project_id))
+    assert calls == [] and result["arcs_updated"] == 0
+
+
+def test_insert_early_chapter_regenerates_one_arc(tree):
+    sessions, project_id, calls, _ = tree
+    asyncio.run(rebuild_summary_tree(project_id))
+    calls.clear()
+
+    asyncio.run(_insert_after(sessions, project_id, 2, "插入章"))
+    result = asyncio.run(rebuild_summary_tree(project_id))
+
+    arc_calls = _arc_calls(calls)
+    assert len(arc_calls) == 1 and any("插入章" in s for s in arc_calls[0])
+    assert result["arcs_updated"] == 1
+    # 插入的章节并入第一个阶段，后面的阶段只跟随排序后移
+    assert asyncio.run(_arcs(sessions, project_id)) == [(0, 1, 11, 11), (1, 12, 21, 10), (2, 22, 31, 10), (3, 32, 36, 5)]
+
+
+def test_delete_early_chapter_regenerates_one_arc(tree):
+    sessions, project_id, calls, _ = tree
+    asyncio.run(rebuild_summary_tree(project_id))
+    calls.clear()
+
+    async def remove():
+        async with sessions() as session:
+            await session.execute(delete(Chapter).where(Chapter.project_id == project_id, Chapter.rank == 3))
+            await session.commit()
+
+    asyncio.run(remove())
+    result = asyncio.run(rebuild_summary_tree(project_id))
+
+    assert len(_arc_calls(calls)) == 1 and result["arcs_updated"] == 1
+    assert asyncio.run(_arcs(sessions, project_id)) == [(0, 1, 10, 9), (1, 11, 20, 10), (2, 21, 30, 10), (3, 31, 35, 5)]
+
+
+def test_appended_chapters_fill_last_arc_then_start_new(tree):
+    sessions, project_id, calls, _ = tree
+    asyncio.run(rebuild_summary_tree(project_id))
+    calls.clear()
+
+    async def append():
+        async with sessions() as session:
+            await session.execute(insert(Chapter), [
+                {"project_id": project_id, "title": f"第{i}章", "rank": i, "summary": f"摘要{i}"}
+                for i in range(36, 43)
+            ])
+            await session.commit()
+
+    asyncio.run(append())
+    asyncio.run(rebuild_summary_tree(project_id))
+
+    assert len(_arc_calls(calls)) == 2
+    assert asyncio.run(_arcs(sessions, project_id))[3:] == [(3, 31, 40, 10), (4, 41, 42, 2)]
+
+
+def test_failed_rollup_keeps_summary_and_range(tree):
+    sessions, project_id, calls, failing = tree
+    asyncio.run(rebuild_summary_tree(project_id))
+    before = asyncio.run(_arcs(sessions, project_id))
+
+    asyncio.run(_insert_after(sessions, project_id, 2, "失败章"))
+    failing.add("失败章")
+    result = asyncio.run(rebuild_summary_tree(project_id))
+
+    assert [f["position"] for f in result["failed"] if f["level"] == "arc"] == [0]
+    arcs = asyncio.run(_arcs(sessions, project_id))
+    # 失败的阶段仍是旧章节的概要，覆盖范围不变；其余阶段跟随排序后移
+    assert arcs[0] == before[0]
+    assert arcs[1:] == [(1, 12, 21, 10), (2, 22, 31, 10), (3, 32, 36, 5)]
+
+    failing.clear()
+    calls.clear()
+    result = asyncio.run(rebuild_summary_tree(project_id))
+    assert len(_arc_calls(calls)) == 1 and result["failed"] == []
+    assert asyncio.run(_arcs(sessions, project_id))[0] == (0, 1, 11, 11)